@@ -0,0 +1,251 @@
+"""
+    Benchmarks of the simulator on deterministic procedural scenes (see scenes.py)
+    Each case (scene x resolution) is run in a fresh process and reports the frames/s and events/s of
+    DvsSensor.update, the mean duration of its stages (see profiling.FrameProfiler), the time spent in the arbiter,
+    in the growth of an EventBuffer holding all the events, in writing and reading the .dat file, and the peak
+    resident memory of the process.
+
+        python benchmark.py --resolutions qvga vga --save baselines/my_machine.json
+        python benchmark.py --resolutions qvga vga --compare baselines/my_machine.json
+
+    With --compare, the results are compared to a baseline case by case and the script exits with 1 if one of
+    them is slower (or uses more memory) than the baseline by more than the tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.append(SRC)
+from arbiter import BottleNeckArbiter, RowArbiter, SynchronousArbiter
+from dat_files import DatWriter, load_dat_event
+from dvs_sensor import DvsSensor
+from event_buffer import EventBuffer
+from profiling import STAGES
+from scenes import RESOLUTIONS, SCENES
+
+BENCHMARK_VERSION = 1
+ARBITERS = ['none', 'bottleneck', 'row', 'synchronous']
+
+# Sensor of the benchmarks, as in examples/00_video_2_events
+SENSOR = dict(lat=100, jit=10, ref=100, tau=40, th_pos=0.4, th_neg=0.4, th_noise=0.01, bgnp=0.1, bgnn=0.01)
+
+# Metrics compared to the baselines: name -> True if higher is better
+METRICS = {
+    'fps': True,
+    'events_per_s': True,
+    'arbiter_s': False,
+    'buffer_s': False,
+    'dat_write_s': False,
+    'dat_read_s': False,
+    'peak_rss_mb': False,
+}
+MIN_TIME = 1e-2  # Durations under 10 ms are not compared, they are too noisy
+
+
+def peak_rss_mb():
+    """ Peak resident memory of the process (MB) """
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+
+
+def run_case(scene, resolution, n_frames, dt=1000, arbiter='bottleneck', noise='freq', seed=0):
+    """ Run one benchmark case
+        Args:
+            scene: name of the scene, see scenes.SCENES
+            resolution: name of the resolution, see scenes.RESOLUTIONS
+            n_frames: number of frames simulated
+            dt: duration of a frame (us)
+            arbiter: 'none', 'bottleneck', 'row' or 'synchronous'
+            noise: 'freq' (NOISE_FREQ) or 'measure' (distributions measured under 161 lux)
+            seed: seed of the simulation
+        Returns:
+            dict of the results
+    """
+    width, height = RESOLUTIONS[resolution]
+    np.random.seed(seed)
+    dvs = DvsSensor("Benchmark")
+    dvs.initCamera(width, height, **SENSOR)
+    if noise == 'measure':
+        data = os.path.join(SRC, '..', 'data')
+        dvs.init_bgn_hist(os.path.join(data, 'noise_pos_161lux.npy'), os.path.join(data, 'noise_neg_161lux.npy'),
+                          seed=seed)
+    if arbiter == 'bottleneck':
+        ea = BottleNeckArbiter(0.01, 0)
+    elif arbiter == 'row':
+        ea = RowArbiter(0.01, 0)
+    elif arbiter == 'synchronous':
+        ea = SynchronousArbiter(0.1, 0, height)
+    else:
+        ea = None
+    frames = SCENES[scene](width, height, n_frames, seed)
+    dvs.init_image(next(frames))
+    profiler = dvs.set_profiling()
+
+    # The events of the sensor are kept for the buffer and the .dat file, the arbiter only gives its timings
+    packets = []
+    t_update = t_arbiter = 0.0
+    n_released = 0
+    for im in frames:
+        t0 = time.perf_counter()
+        ev = dvs.update(im, dt)
+        t1 = time.perf_counter()
+        if ea is not None:
+            n_released += ea.process(ev, dt).i
+        t2 = time.perf_counter()
+        t_update += t1 - t0
+        t_arbiter += t2 - t1
+        packets.append(ev)
+
+    t0 = time.perf_counter()
+    buffer = EventBuffer(1)
+    for ev in packets:
+        buffer.increase_ev(ev)
+    t_buffer = time.perf_counter() - t0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'ev.dat')
+        t0 = time.perf_counter()
+        with DatWriter(filename, width, height, sort_window=10000) as writer:
+            for ev in packets:
+                writer.write(ev)
+        t_write = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        ts = load_dat_event(filename)[0]
+        t_read = time.perf_counter() - t0
+        n_written = len(ts)
+
+    summary = profiler.summary()
+    n_events = summary['signal_on'] + summary['signal_off'] + summary['noise_on'] + summary['noise_off']
+    return {
+        'scene': scene,
+        'resolution': resolution,
+        'width': width,
+        'height': height,
+        'frames': n_frames,
+        'dt': dt,
+        'arbiter': arbiter,
+        'noise': noise,
+        'events': n_events,
+        'events_on': summary['signal_on'] + summary['noise_on'],
+        'noise_events': summary['noise_on'] + summary['noise_off'],
+        'events_written': n_written,
+        'update_s': t_update,
+        'fps': n_frames / t_update if t_update > 0 else 0.0,
+        'events_per_s': n_events / t_update if t_update > 0 else 0.0,
+        'stages_ms': {s: 1e3 * summary[s] for s in STAGES},
+        'mean_rounds': summary['mean_rounds'],
+        'arbiter_s': t_arbiter,
+        'arbiter_released': n_released,
+        'buffer_s': t_buffer,
+        'dat_write_s': t_write,
+        'dat_read_s': t_read,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def case_name(scene, resolution):
+    return "{}-{}".format(scene, resolution)
+
+
+def git_commit():
+    """ Commit of the repository, None if it is not known """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(SRC),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """ Compare results to a baseline
+        Args:
+            results, baseline: dicts of the cases, see run_case
+            tolerance: relative change above which a metric is a regression
+        Returns:
+            list of (case, metric, baseline value, value, relative change) of the regressions
+    """
+    regressions = []
+    print("{:<16} {:<14} {:>12} {:>12} {:>8}".format('case', 'metric', 'baseline', 'current', 'change'))
+    for name, res in results.items():
+        if name not in baseline:
+            continue
+        for metric, higher_better in METRICS.items():
+            b, v = baseline[name].get(metric), res.get(metric)
+            if b is None or v is None or b == 0:
+                continue
+            if metric.endswith('_s') and max(b, v) < MIN_TIME:
+                continue
+            change = (v - b) / b
+            worse = -change if higher_better else change
+            flag = "REGRESSION" if worse > tolerance else ""
+            print("{:<16} {:<14} {:>12.4g} {:>12.4g} {:>+7.1%} {}".format(name, metric, b, v, change, flag))
+            if worse > tolerance:
+                regressions.append((name, metric, b, v, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the simulator on procedural scenes")
+    parser.add_argument('--scenes', nargs='+', default=list(SCENES), choices=list(SCENES))
+    parser.add_argument('--resolutions', nargs='+', default=list(RESOLUTIONS), choices=list(RESOLUTIONS))
+    parser.add_argument('--frames', type=int, default=30, help="number of frames of each case")
+    parser.add_argument('--dt', type=int, default=1000, help="duration of a frame (us)")
+    parser.add_argument('--arbiter', default='bottleneck', choices=ARBITERS)
+    parser.add_argument('--noise', default='freq', choices=['freq', 'measure'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-isolate', action='store_true', help="run the cases in this process (the peak "
+                        "memory is then the peak of all the cases run so far)")
+    parser.add_argument('--save', help="save the results as a JSON baseline")
+    parser.add_argument('--compare', help="JSON baseline compared to the results")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="relative change of a regression")
+    args = parser.parse_args()
+
+    results = {}
+    for resolution in args.resolutions:
+        for scene in args.scenes:
+            params = (scene, resolution, args.frames, args.dt, args.arbiter, args.noise, args.seed)
+            if args.no_isolate:
+                res = run_case(*params)
+            else:
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    res = pool.submit(run_case, *params).result()
+            name = case_name(scene, resolution)
+            results[name] = res
+            print("{:<16} {:8.1f} frames/s {:10.3g} ev/s {:9d} events  arbiter {:.3f} s  buffer {:.3f} s  "
+                  "write {:.3f} s  read {:.3f} s  peak {:.0f} MB".format(
+                      name, res['fps'], res['events_per_s'], res['events'], res['arbiter_s'], res['buffer_s'],
+                      res['dat_write_s'], res['dat_read_s'], res['peak_rss_mb']))
+            print("{:<16} ms/frame: {}".format('', "  ".join("{} {:.2f}".format(s, t)
+                                                           for s, t in res['stages_ms'].items())))
+
+    if args.save:
+        meta = {'version': BENCHMARK_VERSION, 'date': datetime.now().isoformat(timespec='seconds'),
+                'commit': git_commit(), 'python': platform.python_version(), 'numpy': np.__version__,
+                'machine': platform.machine(), 'processor': platform.processor(), 'cpus': os.cpu_count()}
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=1)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get('meta', {}).get('version') != BENCHMARK_VERSION:
+            print("Warning: baseline of another version of the benchmarks")
+        print("Baseline of commit {} ({})".format(baseline['meta'].get('commit'), baseline['meta'].get('date')))
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if len(regressions) > 0:
+            print("{} regression(s)".format(len(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+    Deterministic procedural scenes of the benchmarks
+    Each scene is a generator of n_frames + 1 irradiance frames (lux) of shape (height, width): the first one is the
+    initial condition of the sensor, the others are given to DvsSensor.update.
+"""
+import numpy as np
+
+# Resolutions of the benchmarks: name -> (width, height)
+RESOLUTIONS = {
+    'qvga': (320, 240),
+    'vga': (640, 480),
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+}
+
+LUX_DARK = 100      # Illumination of the dark parts of the scenes (lux)
+LUX_BRIGHT = 1000   # Illumination of the bright parts of the scenes (lux)
+
+
+def texture(width, height, seed=0, block=16):
+    """ Static texture of random blocks between LUX_DARK and LUX_BRIGHT """
+    rng = np.random.RandomState(seed)
+    blocks = rng.uniform(LUX_DARK, LUX_BRIGHT, (-(-height // block), -(-width // block)))
+    return np.repeat(np.repeat(blocks, block, axis=0), block, axis=1)[:height, :width]
+
+
+def moving_edge(width, height, n_frames, seed=0):
+    """ Vertical edge, smoothed over 2 pixels, crossing 80% of the imager from left to right """
+    x = np.arange(width, dtype=float)[None, :]
+    for k in range(n_frames + 1):
+        x0 = width * (0.1 + 0.8 * k / max(1, n_frames))
+        row = LUX_DARK + (LUX_BRIGHT - LUX_DARK) / (1 + np.exp(-(x - x0) / 2.0))
+        yield np.repeat(row, height, axis=0)
+
+
+def flicker(width, height, n_frames, seed=0, block=16):
+    """ Blocks of block x block pixels flickering sinusoidally with random periods (4 to 16 frames) and phases """
+    rng = np.random.RandomState(seed)
+    shape = (-(-height // block), -(-width // block))
+    period = rng.uniform(4, 16, shape)
+    phase = rng.uniform(0, 2 * np.pi, shape)
+    mean = np.sqrt(LUX_DARK * LUX_BRIGHT)
+    for k in range(n_frames + 1):
+        blocks = mean * np.exp(np.log(LUX_BRIGHT / mean) * np.sin(2 * np.pi * k / period + phase))
+        yield np.repeat(np.repeat(blocks, block, axis=0), block, axis=1)[:height, :width]
+
+
+def static(width, height, n_frames, seed=0):
+    """ Static textured scene: the events are only noise """
+    im = texture(width, height, seed)
+    for k in range(n_frames + 1):
+        yield im
+
+
+def global_change(width, height, n_frames, seed=0):
+    """ Textured scene whose illumination goes up and down by a factor 3 every 20 frames """
+    im = texture(width, height, seed)
+    for k in range(n_frames + 1):
+        yield im * np.exp(np.log(3) * np.sin(2 * np.pi * k / 20))
+
+
+SCENES = {
+    'edge': moving_edge,
+    'flicker': flicker,
+    'static': static,
+    'global': global_change,
+}
@@ -0,0 +1,266 @@
+"""
+    Validation of the fast simulation modes against the reference simulation
+    The reference (DvsSensor with its default settings) and a candidate mode are run on the same procedural scenes
+    (see scenes.py) with the same seed, and their events are compared:
+    - counts of events of each pixel and polarity: relative difference of the totals, relative L1 distance and
+      correlation of the count maps;
+    - distributions of the latencies (time of the events since the beginning of their frame) and of the intervals
+      between consecutive events of a pixel: two-sample Kolmogorov-Smirnov test;
+    - noise rates: two-sample Poisson test of the numbers of noise events, with each noise model of the sensor
+      (frequency, measured distributions and distributions interpolated with the illumination).
+    The speedup of the candidate over DvsSensor.update at the same frame rate is reported next to these metrics. For
+    the sub-steps, the reference is simulated at a higher frame rate: it only serves as the reference of the events.
+
+        python validate.py --modes tiles substeps lut --resolution qvga --noise freq measure
+
+    The random draws of a mode diverge from the ones of the reference as soon as it simulates different pixels,
+    so the events are only expected to be statistically equivalent, except for tiles-exact which has to give the
+    same events. The script exits with 1 if a mode fails a check.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+import numpy as np
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.append(SRC)
+from benchmark import SENSOR
+from dvs_sensor import DvsSensor
+from noise_cache import lux_noise_files
+from representations import count_image
+from scenes import RESOLUTIONS, SCENES
+
+# Candidate modes: setup of the sensor, input frames converted with lookup tables (uint16, 0.1 lux per level), and
+# frame rate multiplier of the reference (frames interpolated in the log domain, the sub-steps approximate it)
+LUT_SCALE = 0.1
+MODES = {
+    'tiles': dict(setup=lambda dvs: dvs.set_tile_skipping(32, 1e-4)),
+    'tiles-exact': dict(setup=lambda dvs: dvs.set_tile_skipping(32, 0), exact=True),
+    'substeps': dict(setup=lambda dvs: dvs.set_substeps(0.1, 16), ref_interp=16),
+    'lut': dict(lut=True),
+}
+
+# Noise models of the sensor: 'freq' (bgnp and bgnn), 'measure' (distributions measured under 161 lux) and 'lux'
+# (distributions measured at several illuminations)
+NOISE_MODELS = ['freq', 'measure', 'lux']
+DATA_DIR = os.path.join(SRC, '..', 'data')
+
+# Default thresholds of the checks
+ALPHA = 0.01             # Significance of the statistical tests
+MAX_COUNT_DIFF = 0.05    # Relative difference of the total number of events
+MAX_COUNT_L1 = 0.25      # Relative L1 distance of the count maps
+MAX_KS = 0.05            # Kolmogorov-Smirnov distance accepted when the samples are so large that p is always small
+
+
+def ks_2samp(a, b):
+    """ Two-sample Kolmogorov-Smirnov test
+        Args:
+            a, b: samples
+        Returns:
+            distance D between the empirical distributions and asymptotic p-value
+    """
+    a = np.sort(np.asarray(a, dtype=float))
+    b = np.sort(np.asarray(b, dtype=float))
+    if len(a) == 0 or len(b) == 0:
+        return 0.0, 1.0
+    values = np.concatenate([a, b])
+    d = np.max(np.abs(np.searchsorted(a, values, side='right') / len(a) -
+                      np.searchsorted(b, values, side='right') / len(b)))
+    en = np.sqrt(len(a) * len(b) / (len(a) + len(b)))
+    lam = (en + 0.12 + 0.11 / en) * d
+    if lam < 0.2:
+        # The series does not converge, p > 0.9999
+        return float(d), 1.0
+    k = np.arange(1, 101)
+    p = 2 * np.sum((-1) ** (k - 1) * np.exp(-2 * k ** 2 * lam ** 2))
+    return float(d), float(np.clip(p, 0, 1))
+
+
+def poisson_test(n1, n2):
+    """ Two-sample test of equal Poisson rates over the same exposure
+        Returns:
+            z score and two-sided p-value
+    """
+    if n1 + n2 == 0:
+        return 0.0, 1.0
+    z = (n1 - n2) / np.sqrt(n1 + n2)
+    return float(z), math.erfc(abs(z) / math.sqrt(2))
+
+
+def intervals(ts, x, y, p, width):
+    """ Intervals between the consecutive events of each pixel (any polarity) """
+    pix = y.astype(np.int64) * width + x
+    order = np.lexsort((ts, pix))
+    pix, ts = pix[order], ts[order].astype(np.int64)
+    same = pix[1:] == pix[:-1]
+    return np.diff(ts)[same]
+
+
+def simulate(scene, resolution, n_frames, dt, seed, setup=None, quantize=False, lut=False, interp=1, noise='freq'):
+    """ Simulate a scene
+        Args:
+            scene, resolution: see scenes.SCENES and scenes.RESOLUTIONS
+            n_frames: number of frames
+            dt: duration of a frame (us)
+            seed: seed of the simulation
+            setup: function configuring the sensor
+            quantize: quantize the frames to LUT_SCALE lux, as the frames of the LUT mode
+            lut: give the quantized frames to the sensor as uint16, converted with lookup tables
+            interp: number of frames simulated for each frame of the scene, interpolated in the log domain
+            noise: noise model, see NOISE_MODELS
+        Returns:
+            dict of the events (ts, x, y, p), their latencies, the number of noise events and the duration of the
+            updates (s)
+    """
+    width, height = RESOLUTIONS[resolution]
+    np.random.seed(seed)
+    dvs = DvsSensor("Validation")
+    dvs.initCamera(width, height, **SENSOR)
+    if noise == 'measure':
+        dvs.init_bgn_hist(os.path.join(DATA_DIR, 'noise_pos_161lux.npy'),
+                          os.path.join(DATA_DIR, 'noise_neg_161lux.npy'), seed=seed)
+    elif noise == 'lux':
+        dvs.init_bgn_lux(lux_noise_files(DATA_DIR), seed=seed)
+    if setup is not None:
+        setup(dvs)
+    profiler = dvs.set_profiling()
+
+    def frame(im):
+        if not quantize:
+            return im, None
+        q = np.clip(np.round(im / LUT_SCALE), 0, 65535).astype(np.uint16)
+        return (q, LUT_SCALE) if lut else (q * LUT_SCALE, None)
+
+    frames = SCENES[scene](width, height, n_frames, seed)
+    prev = next(frames)
+    im, scale = frame(prev)
+    dvs.init_image(im, scale=scale)
+    ev = []
+    duration = 0.0
+    for k, nxt in enumerate(frames):
+        l0, l1 = np.log(prev + 1), np.log(nxt + 1)
+        for j in range(1, interp + 1):
+            im, scale = frame(nxt if j == interp else np.exp(l0 + (l1 - l0) * (j / interp)) - 1)
+            t0 = time.perf_counter()
+            pk = dvs.update(im, dt // interp if j < interp else dt - (interp - 1) * (dt // interp), scale)
+            duration += time.perf_counter() - t0
+            ev.append((pk.ts[:pk.i].copy(), pk.x[:pk.i].copy(), pk.y[:pk.i].copy(), pk.p[:pk.i].copy(),
+                       np.full(pk.i, k * dt, dtype=np.int64)))
+        prev = nxt
+    ts, x, y, p, t_frame = [np.concatenate([e[i] for e in ev]) for i in range(5)]
+    summary = profiler.summary()
+    return {'ts': ts, 'x': x, 'y': y, 'p': p, 'latency': ts.astype(np.int64) - t_frame,
+            'noise': summary['noise_on'] + summary['noise_off'], 'duration': duration,
+            'width': width, 'height': height}
+
+
+def compare(ref, cand, alpha=ALPHA, max_count_diff=MAX_COUNT_DIFF, max_count_l1=MAX_COUNT_L1, max_ks=MAX_KS,
+            exact=False, baseline=None):
+    """ Compare the events of a candidate to the ones of the reference
+        Args:
+            ref, cand: results of simulate
+            alpha: significance of the statistical tests
+            max_count_diff, max_count_l1, max_ks: thresholds of the checks, see the module constants
+            exact: the events have to be identical
+            baseline: result of simulate giving the duration the speedup is computed from, ref if None
+        Returns:
+            dict of the metrics, with the list of the checks failed ('failed')
+    """
+    w, h = ref['width'], ref['height']
+    baseline = ref if baseline is None else baseline
+    c_ref = count_image((ref['ts'], ref['x'], ref['y'], ref['p']), w, h).astype(float)
+    c_cand = count_image((cand['ts'], cand['x'], cand['y'], cand['p']), w, h).astype(float)
+    n_ref, n_cand = c_ref.sum(), c_cand.sum()
+    m = {
+        'speedup': baseline['duration'] / cand['duration'] if cand['duration'] > 0 else float('inf'),
+        'events_ref': int(n_ref),
+        'events_cand': int(n_cand),
+        'count_diff': (n_cand - n_ref) / n_ref if n_ref > 0 else float(n_cand > 0),
+        'count_l1': np.abs(c_cand - c_ref).sum() / n_ref if n_ref > 0 else float(n_cand > 0),
+        'count_corr': float(np.corrcoef(c_ref.ravel(), c_cand.ravel())[0, 1])
+        if c_ref.std() > 0 and c_cand.std() > 0 else 1.0,
+        'on_ratio_ref': float(c_ref[1].sum() / n_ref) if n_ref > 0 else 0.0,
+        'on_ratio_cand': float(c_cand[1].sum() / n_cand) if n_cand > 0 else 0.0,
+    }
+    m['latency_ks'], m['latency_p'] = ks_2samp(ref['latency'], cand['latency'])
+    m['interval_ks'], m['interval_p'] = ks_2samp(intervals(ref['ts'], ref['x'], ref['y'], ref['p'], w),
+                                                 intervals(cand['ts'], cand['x'], cand['y'], cand['p'], w))
+    m['noise_ref'], m['noise_cand'] = int(ref['noise']), int(cand['noise'])
+    m['noise_z'], m['noise_p'] = poisson_test(cand['noise'], ref['noise'])
+
+    failed = []
+    if exact:
+        if not all(np.array_equal(ref[k], cand[k]) for k in ['ts', 'x', 'y', 'p']):
+            failed.append('exact')
+    if abs(m['count_diff']) > max_count_diff:
+        failed.append('count_diff')
+    if m['count_l1'] > max_count_l1:
+        failed.append('count_l1')
+    # With large samples, tiny deviations are significant: a distribution fails if it is both significantly
+    # and noticeably different
+    if m['latency_p'] < alpha and m['latency_ks'] > max_ks:
+        failed.append('latency')
+    if m['interval_p'] < alpha and m['interval_ks'] > max_ks:
+        failed.append('interval')
+    if m['noise_p'] < alpha:
+        failed.append('noise')
+    m['failed'] = failed
+    return m
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validation of the fast simulation modes")
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    parser.add_argument('--scenes', nargs='+', default=list(SCENES), choices=list(SCENES))
+    parser.add_argument('--resolution', default='qvga', choices=list(RESOLUTIONS))
+    parser.add_argument('--noise', nargs='+', default=NOISE_MODELS, choices=NOISE_MODELS)
+    parser.add_argument('--frames', type=int, default=30)
+    parser.add_argument('--dt', type=int, default=1000, help="duration of a frame (us)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--alpha', type=float, default=ALPHA)
+    parser.add_argument('--max-count-diff', type=float, default=MAX_COUNT_DIFF)
+    parser.add_argument('--max-count-l1', type=float, default=MAX_COUNT_L1)
+    parser.add_argument('--max-ks', type=float, default=MAX_KS)
+    parser.add_argument('--json', help="save the metrics in a JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    n_failed = 0
+    print("{:<10} {:<8} {:<12} {:>7} {:>9} {:>9} {:>7} {:>6} {:>6} {:>9} {:>6} {:>9} {:>7}  {}".format(
+        'scene', 'noise', 'mode', 'speedup', 'ev ref', 'ev cand', 'count', 'L1', 'lat D', 'lat p', 'iei D', 'iei p',
+        'noise z', 'result'))
+    for scene in args.scenes:
+        for noise in args.noise:
+            refs = {}
+            for mode in args.modes:
+                spec = MODES[mode]
+                # The reference of the events, and the update at the same frame rate the speedup is measured from
+                keys = [(spec.get('lut', False), spec.get('ref_interp', 1)), (spec.get('lut', False), 1)]
+                for key in keys:
+                    if key not in refs:
+                        refs[key] = simulate(scene, args.resolution, args.frames, args.dt, args.seed, quantize=key[0],
+                                             interp=key[1], noise=noise)
+                cand = simulate(scene, args.resolution, args.frames, args.dt, args.seed, setup=spec.get('setup'),
+                                quantize=keys[0][0], lut=keys[0][0], noise=noise)
+                m = compare(refs[keys[0]], cand, args.alpha, args.max_count_diff, args.max_count_l1, args.max_ks,
+                            spec.get('exact', False), refs[keys[1]])
+                results["{}-{}-{}".format(scene, noise, mode)] = m
+                n_failed += len(m['failed']) > 0
+                print("{:<10} {:<8} {:<12} {:>7.2f} {:>9d} {:>9d} {:>+7.2%} {:>6.3f} {:>6.3f} {:>9.2g} {:>6.3f} "
+                      "{:>9.2g} {:>+7.2f}  {}".format(
+                          scene, noise, mode, m['speedup'], m['events_ref'], m['events_cand'], m['count_diff'],
+                          m['count_l1'], m['latency_ks'], m['latency_p'], m['interval_ks'], m['interval_p'],
+                          m['noise_z'], 'FAIL ' + ','.join(m['failed']) if len(m['failed']) > 0 else 'ok'))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'resolution': args.resolution, 'frames': args.frames, 'dt': args.dt, 'seed': args.seed,
+                       'noise': args.noise, 'results': results}, f, indent=1)
+    if n_failed > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
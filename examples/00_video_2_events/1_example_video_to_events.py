@@ -8,7 +8,9 @@
 import cv2
 import sys
 sys.path.append("../../src")
-from event_buffer import EventBuffer
+from dat_files import DatWriter
+import numpy as np
+from frame_source import VideoSource, CONVERT_LUV, IRRADIANCE_SCALE
 from dvs_sensor import DvsSensor
 from event_display import EventDisplay
 from arbiter import SynchronousArbiter, BottleNeckArbiter, RowArbiter
@@ -31,65 +33,56 @@ ref = 100           # refractory period in us
 dt = 1000           # time between frames in us
 time = 0
 
-cap = cv2.VideoCapture(filename)
+# Frames are decoded in the background and kept in uint8, the sensor converts them such that 255 = 1e4,
+# representing 10 klux
+# The first 49 frames of the video are skipped to remove video artifacts, the next one is the initial condition
+num_frames = 50
+source = VideoSource(filename, skip=49, max_frames=num_frames + 1, convert=CONVERT_LUV, scale=None, dtype=np.uint8)
 
 # Initialise the DVS sensor
 dvs = DvsSensor("MySensor")
-dvs.initCamera(int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+dvs.initCamera(source.width, source.height,
                    lat=lat, jit = jit, ref = ref, tau = tau, th_pos = th_pos, th_neg = th_neg, th_noise = th_noise,
                    bgnp=bgnp, bgnn=bgnn)
 # To use the measured noise distributions, uncomment the following line
 dvs.init_bgn_hist("../../data/noise_pos_161lux.npy", "../../data/noise_neg_161lux.npy")
 
-# Skip the first 50 frames of the video to remove video artifacts
-for i in range(50): 
-    ret, im = cap.read()
+# Set the first frame as the initial condition of the sensor
+dvs.init_image(next(source), scale=IRRADIANCE_SCALE)
 
-# Convert the image from uint8, such that 255 = 1e4, representing 10 klux
-im = cv2.cvtColor(im, cv2.COLOR_RGB2LUV)[:, :, 0] / 255.0 * 1e4
-
-# Set as the initial condition of the sensor
-dvs.init_image(im)
-
-# Create the event buffer
-ev_full = EventBuffer(1)
+# Create the event file, events are appended frame by frame
+# Events are kept 10 ms (maximum latency of the sensor) before being written, so the file stays sorted
+writer = DatWriter('outputs/ev_{}_{}_{}_{}_{}_{}.dat'.format(lat, jit, ref, tau, th_pos, th_noise),
+                   dvs.shape[1], dvs.shape[0], sort_window=10000)
 
 # Create the arbiter - optional, pick from one below
 # ea = BottleNeckArbiter(0.01, time)                # This is a mock arbiter
 # ea = RowArbiter(0.01, time)                       # Old arbiter that handles rows in random order
-ea = SynchronousArbiter(0.1, time, im.shape[0])  # DVS346-like arbiter
+ea = SynchronousArbiter(0.1, time, source.height)  # DVS346-like arbiter
 
 # Create the display
 render_timesurface = 1
 ed = EventDisplay("Events", 
-                  cap.get(cv2.CAP_PROP_FRAME_WIDTH), 
-                  cap.get(cv2.CAP_PROP_FRAME_HEIGHT), 
+                  source.width, 
+                  source.height, 
                   dt, 
                   render_timesurface)
 
-if cap.isOpened():
-    # Loop over num_frames frames
-    num_frames = 50
-    for frame in tqdm(range(num_frames), desc="Converting video to events"):
-        # Get frame from the video
-        ret, im = cap.read()
-        if im is None:
-            break
-        # Convert the image from uint8, such that 255 = 1e4, representing 10 klux
-        im = cv2.cvtColor(im, cv2.COLOR_RGB2LUV)[:, :, 0] / 255.0 * 1e4
-        # Calculate the events
-        ev = dvs.update(im, dt)
-        # Simulate the arbiter
-        # num_produced = ev.i
-        # ev = ea.process(ev, dt)
-        # num_released = ev.i
-        # statistics for the arbiter
-        # print("{} produced, {} released".format(num_produced, num_released))
-        # Display the events
-        ed.update(ev, dt)
-        # Add the events to the buffer for the full video
-        ev_full.increase_ev(ev)
+# Loop over num_frames frames
+for im in tqdm(source, total=num_frames, desc="Converting video to events"):
+    # Calculate the events
+    ev = dvs.update(im, dt, scale=IRRADIANCE_SCALE)
+    # Simulate the arbiter
+    # num_produced = ev.i
+    # ev = ea.process(ev, dt)
+    # num_released = ev.i
+    # statistics for the arbiter
+    # print("{} produced, {} released".format(num_produced, num_released))
+    # Display the events
+    ed.update(ev, dt)
+    # Append the events to the .dat file
+    writer.write(ev)
 
-cap.release()
-# Save the events to a .dat file
-ev_full.write('outputs/ev_{}_{}_{}_{}_{}_{}.dat'.format(lat, jit, ref, tau, th_pos, th_noise))
\ No newline at end of file
+source.close()
+# Write the last events and close the .dat file
+writer.close()
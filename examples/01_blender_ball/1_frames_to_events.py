@@ -9,20 +9,24 @@ from dvs_sensor import DvsSensor
 from event_display import EventDisplay
 from event_buffer import EventBuffer
 from arbiter import SynchronousArbiter, BottleNeckArbiter, RowArbiter
+from frame_source import ImageDirSource, InterpolatedSource, INTERP_LOG
+from pipeline import SimulationPipeline
 
 FRAME_DIR = "frames"
 OUTPUT_DIR = "outputs"
+FPS = 120           # Frame rate of the rendered frames (FPS in 0_generate_frames.py)
+N_INTERP = 0        # Frames interpolated between two rendered frames, e.g. 7 for frames rendered at 15 fps
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-frame_files = sorted(
-    [os.path.join(FRAME_DIR, f) for f in os.listdir(FRAME_DIR) if f.endswith(".png")]
-)
-if not frame_files:
+if not os.path.isdir(FRAME_DIR) or not any(f.endswith(".png") for f in os.listdir(FRAME_DIR)):
     raise RuntimeError("No frames found. Run 0_generate_frames.py in Blender first.")
 
-# Read first frame to initialise the sensor
-im = cv2.imread(frame_files[0], cv2.IMREAD_GRAYSCALE)
-height, width = im.shape
+# Frames are decoded in the background and converted such that 255 = 1e4, representing 10 klux
+source = ImageDirSource(FRAME_DIR, extensions=(".png",), dtype=np.float32)
+if N_INTERP > 0:
+    # Intermediate frames are generated on the fly instead of being rendered and stored
+    source = InterpolatedSource(source, N_INTERP, method=INTERP_LOG, dtype=np.float32)
+height, width = source.height, source.width
 
 th_pos = 0.01        # ON threshold = 50% (ln(1.5) = 0.4)
 th_neg = 0.01       # OFF threshold = 50%
@@ -43,11 +47,12 @@ sensor.initCamera(width, height, lat=lat, jit=jit, ref=ref, tau=tau,
                    bgnp=bgnp, bgnn=bgnn)
 sensor.init_bgn_hist("../../data/noise_pos_161lux.npy", "../../data/noise_neg_161lux.npy")
 
-sensor.init_image(im.astype(np.float32) / 255.0 * 1e4)
+# Read first frame to initialise the sensor
+sensor.init_image(next(source))
 
-dt = 1e6 / 120  # microseconds per frame at 30 fps
+dt = 1e6 / (FPS * (N_INTERP + 1))  # microseconds per frame given to the sensor
 buffer = EventBuffer(1)
-ea = SynchronousArbiter(0.1, time, im.shape[0])  # DVS346-like arbiter
+ea = SynchronousArbiter(0.1, time, height)  # DVS346-like arbiter
 
 render_timesurface = 1
 
@@ -57,11 +62,10 @@ ed = EventDisplay("Events",
                   dt, 
                   render_timesurface)
 
-for f in frame_files[1:]:
-    im = cv2.imread(f, cv2.IMREAD_GRAYSCALE)
-    im = im.astype(np.float32) / 255.0 * 1e4
-    events = sensor.update(im, dt)
-    ed.update(events, dt)
-    buffer.increase_ev(events)
+# Decoding, simulation and display run concurrently
+pipeline = SimulationPipeline(source, sensor, dt, display=ed, sinks=[buffer], init_first_frame=False)
+stats = pipeline.run(progress=True)
+print("Sensor: {:.2f} s, display and storage: {:.2f} s, total: {:.2f} s".format(
+    stats["sensor"]["busy"], stats["sink"]["busy"], stats["total"]))
 
 buffer.write(os.path.join(OUTPUT_DIR, "ball_events.dat"))
@@ -36,6 +36,7 @@ def set_visibility(obj, *, camera=None, shadow=None):
 sys.path.append("../../src")
 from dvs_sensor import DvsSensor
 from event_buffer import EventBuffer
+from dat_files import merge_dat_files
 
 # Output directory
 base_path = "./output_ball/"
@@ -53,6 +54,7 @@ delta = (end_pos - start_pos) / (frames - 1)
 
 dat_path_obj = os.path.join(base_path, "ball_object.dat")
 dat_path_shadow = os.path.join(base_path, "ball_shadow.dat")
+dat_path_merged = os.path.join(base_path, "ball_merged.dat")
 tmp_obj_path = os.path.join(base_path, "tmp_object.png")
 tmp_shadow_path = os.path.join(base_path, "tmp_shadow.png")
 video_path = os.path.join(base_path, "ball.avi")
@@ -175,6 +177,11 @@ if buffer_shadow.i > 0:
 else:
     print("No shadow events generated.")
 
+# Merge object and shadow events into a single sorted file
+if buffer_obj.i > 0 and buffer_shadow.i > 0:
+    merge_dat_files([dat_path_obj, dat_path_shadow], dat_path_merged)
+    print(f"Generated merged event data: {dat_path_merged}")
+
 # Output video
 set_visibility(ball, camera=True, shadow=True)
 backdrop.cycles.is_shadow_catcher = False
@@ -1,5 +1,6 @@
 import numpy as np
 from event_buffer import EventBuffer
+from tracing import traced
 
 
 class BottleNeckArbiter():
@@ -18,6 +19,18 @@ class BottleNeckArbiter():
         self.time = time
         self.ev_acc = EventBuffer(0)
 
+    def get_state(self):
+        """ Copy of the state of the arbiter: time and events waiting, see set_state """
+        return {'t_per_event': self.t_per_event, 'time': self.time, 'ev_acc': self.ev_acc.get_state()}
+
+    def set_state(self, state):
+        """ Restore a state given by get_state """
+        self.t_per_event = state['t_per_event']
+        self.time = state['time']
+        self.ev_acc = EventBuffer(0)
+        self.ev_acc.set_state(state['ev_acc'])
+
+    @traced('arbiter')
     def process(self, new_ev, dt):
         """
         Args:
@@ -59,6 +72,18 @@ class RowArbiter():
         self.time = time
         self.ev_acc = EventBuffer(0)
 
+    def get_state(self):
+        """ Copy of the state of the arbiter: time and events waiting, see set_state """
+        return {'t_per_event': self.t_per_event, 'time': self.time, 'ev_acc': self.ev_acc.get_state()}
+
+    def set_state(self, state):
+        """ Restore a state given by get_state """
+        self.t_per_event = state['t_per_event']
+        self.time = state['time']
+        self.ev_acc = EventBuffer(0)
+        self.ev_acc.set_state(state['ev_acc'])
+
+    @traced('arbiter')
     def process(self, new_ev, dt):
         """
         Args:
@@ -105,6 +130,21 @@ class SynchronousArbiter():
         self.max_row = max_row
         self.ev_acc = EventBuffer(0)
 
+    def get_state(self):
+        """ Copy of the state of the arbiter: time, row processed and events waiting, see set_state """
+        return {'clock_period': self.clock_period, 'time': self.time, 'cur_row': int(self.cur_row),
+                'max_row': self.max_row, 'ev_acc': self.ev_acc.get_state()}
+
+    def set_state(self, state):
+        """ Restore a state given by get_state """
+        self.clock_period = state['clock_period']
+        self.time = state['time']
+        self.cur_row = state['cur_row']
+        self.max_row = state['max_row']
+        self.ev_acc = EventBuffer(0)
+        self.ev_acc.set_state(state['ev_acc'])
+
+    @traced('arbiter')
     def process(self, new_ev, dt):
         """
         Args:
@@ -0,0 +1,413 @@
+"""
+    Batch simulations: many (input, sensor configuration) jobs run by a pool of long-lived processes
+
+        python iebcs.py batch jobs.toml --workers 8 --retries 1 --summary summary.json
+
+    The manifest is a TOML or JSON file:
+
+        config = "base.toml"            # Optional configuration shared by the jobs, see iebcs.DEFAULT_CONFIG
+        output_dir = "outputs"          # Events of the jobs without output.path: <output_dir>/<name>.dat
+        [defaults.sensor]               # Optional values applied to every job
+        noise = "measure"
+        seed = 0
+        [[jobs]]
+        name = "bird_th03"
+        cost = 2.0                      # Optional estimated cost, the number of pixels simulated if missing
+        input = {path = "bird.mp4"}
+        sensor = {th_pos = 0.3, th_neg = 0.3}
+
+    or a JSON lines file (.jsonl) with one job per line. Paths are relative to the manifest.
+
+    The workers keep their state from one job to the next: modules imported once, noise tables of the seeded
+    sensors kept loaded (see noise_cache.load_noise_tables) and decoded frames kept in a cache of frame_cache_mb MB,
+    replayed when another job simulates the same input. The jobs are grouped by input into tasks of jobs_per_task
+    jobs, sent to the workers by decreasing estimated cost so that the longest ones do not finish last. A job which
+    fails, or whose worker dies while it runs alone (see run_batch), is run again up to retries times.
+"""
+import json
+import os
+import time
+import traceback
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import cv2
+from frame_source import ArraySource, CONVERT_NONE
+from iebcs import DEFAULT_CONFIG, open_frames, read_config, resolve_config, simulate
+from tqdm import tqdm
+
+FRAME_CACHE_MB = 256     # Decoded frames kept by each worker (MB)
+JOBS_PER_TASK = 4        # Maximum number of jobs of the same input sent at once to a worker
+OUTPUT_EXTENSIONS = {'dat': '.dat', 'evt2': '.raw'}
+STATUS_OK = 'ok'
+STATUS_FAILED = 'failed'
+
+_worker = {}  # State of the worker process: frame cache
+
+
+class FrameCache():
+    """ Decoded frames of the last inputs simulated, kept for the next jobs simulating the same input """
+    # max_bytes = 0            # Size of the cache
+    # nbytes = 0               # Size of the frames cached
+    # entries = OrderedDict()  # key -> (frames, fps), from the least to the most recently used
+    # hits = 0                 # Number of inputs replayed from the cache
+    # misses = 0               # Number of inputs decoded
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def open(self, cfg):
+        """ Source of the frames of an [input] section, see iebcs.make_source
+            The frames are replayed from the cache if they are in it, decoded and recorded otherwise
+        """
+        key = input_key(cfg)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            frames, fps = self.entries[key]
+            self.hits += 1
+            source = ArraySource(frames, frames[0].shape[1], frames[0].shape[0], convert=CONVERT_NONE, scale=None,
+                                 dtype=frames[0].dtype)
+            source.fps = fps
+            return source
+        self.misses += 1
+        return RecordingSource(open_frames(cfg), self, key)
+
+    def put(self, key, frames, fps):
+        """ Add the frames of an input, the least recently used inputs are removed to make room for them """
+        nbytes = sum(im.nbytes for im in frames)
+        if len(frames) == 0 or nbytes > self.max_bytes:
+            return
+        while self.nbytes + nbytes > self.max_bytes:
+            _, (old, _) = self.entries.popitem(last=False)
+            self.nbytes -= sum(im.nbytes for im in old)
+        self.entries[key] = (frames, fps)
+        self.nbytes += nbytes
+
+
+class RecordingSource():
+    """ Frames of a source, copied as they are read and given to a FrameCache when the source is exhausted
+        Recording stops if the frames do not fit in the cache.
+    """
+
+    def __init__(self, source, cache, key):
+        self.source = source
+        self.cache = cache
+        self.key = key
+        self.width = source.width
+        self.height = source.height
+        self.fps = getattr(source, 'fps', 0)
+        self.frames = []
+        self.nbytes = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            im = next(self.source)
+        except StopIteration:
+            if self.frames is not None:
+                self.cache.put(self.key, self.frames, self.fps)
+                self.frames = None
+            raise
+        if self.frames is not None:
+            self.nbytes += im.nbytes
+            if self.nbytes > self.cache.max_bytes:
+                self.frames = None
+            else:
+                self.frames.append(im.copy())
+        return im
+
+    def close(self):
+        self.source.close()
+
+
+def input_key(cfg):
+    """ Identifier of the frames of an [input] section before interpolation """
+    path = cfg['path']
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    return (cfg['type'], path, mtime, cfg['skip'], cfg['max_frames'], cfg['convert'], cfg['lut'],
+            None if cfg['lut'] else cfg['scale'])
+
+
+def load_manifest(filename, output_dir=None):
+    """ Read the jobs of a manifest
+        Args:
+            filename: TOML or JSON manifest, or JSON lines file (.jsonl) of jobs
+            output_dir: directory of the events of the jobs without output.path, output_dir of the manifest (or
+                        the directory of the manifest) if None
+        Returns:
+            list of jobs: dicts of the name, the configuration (see iebcs.load_config) and the estimated cost
+    """
+    root = os.path.dirname(os.path.abspath(filename))
+    if filename.endswith('.jsonl'):
+        with open(filename, 'r') as f:
+            manifest = {'jobs': [json.loads(line) for line in f if line.strip()]}
+    else:
+        manifest = read_config(filename)
+    if output_dir is None:
+        output_dir = manifest.get('output_dir', '.')
+    output_dir = os.path.join(root, output_dir)
+    base = DEFAULT_CONFIG
+    if manifest.get('config') is not None:
+        path = os.path.join(root, manifest['config'])
+        base = resolve_config(read_config(path), os.path.dirname(path), name=path)
+    base = resolve_config(manifest.get('defaults', {}), root, base, name=filename)
+
+    jobs = []
+    names = set()
+    outputs = set()
+    sizes = {}
+    for i, entry in enumerate(manifest.get('jobs', [])):
+        entry = dict(entry)
+        name = str(entry.pop('name', 'job{:05d}'.format(i)))
+        cost = entry.pop('cost', None)
+        config = base
+        if entry.get('config') is not None:
+            path = os.path.join(root, entry['config'])
+            config = resolve_config(read_config(path), os.path.dirname(path), name=path)
+            config = resolve_config(manifest.get('defaults', {}), root, config, name=filename)
+        entry.pop('config', None)
+        config = resolve_config(entry, root, config, name="job {} of {}".format(name, filename))
+        if 'path' not in entry.get('output', {}):
+            config['output']['path'] = os.path.join(output_dir,
+                                                    name + OUTPUT_EXTENSIONS.get(config['output']['format'], ''))
+        config['display']['enabled'] = False
+        if config['input']['path'] is None:
+            raise ValueError("input.path is missing in job {} of {}".format(name, filename))
+        if name in names:
+            raise ValueError("Job {} is defined twice in {}".format(name, filename))
+        if config['output']['path'] in outputs:
+            raise ValueError("Output {} of job {} is already used".format(config['output']['path'], name))
+        names.add(name)
+        outputs.add(config['output']['path'])
+        jobs.append({'name': name, 'config': config,
+                     'cost': float(cost) if cost is not None else estimate_cost(config, sizes)})
+    return jobs
+
+
+def estimate_cost(config, sizes=None):
+    """ Estimated cost of a job: number of pixels simulated (frames x width x height)
+        Args:
+            config: configuration of the job
+            sizes: dict of the sizes of the inputs already opened, filled by the function
+        Returns:
+            cost, 0 if the input cannot be opened
+    """
+    cfg = config['input']
+    key = input_key(cfg)
+    if sizes is None or key not in sizes:
+        try:
+            source = open_frames(cfg)
+        except (IOError, OSError, ValueError):
+            size = (0, 0, 0)
+        else:
+            if hasattr(source, 'cap'):
+                n = max(0, int(source.cap.get(cv2.CAP_PROP_FRAME_COUNT)) - cfg['skip'])
+                n = n if cfg['max_frames'] is None else min(n, cfg['max_frames'])
+            else:
+                n = len(source)
+            size = (n, source.width, source.height)
+            source.close()
+        if sizes is None:
+            return _cost(config, size)
+        sizes[key] = size
+    return _cost(config, sizes[key])
+
+
+def _cost(config, size):
+    n, width, height = size
+    n = max(0, n - 1) * (config['input']['n_interp'] + 1)
+    if config['simulation']['max_frames'] is not None:
+        n = min(n, config['simulation']['max_frames'])
+    return float(n) * width * height
+
+
+def make_tasks(jobs, jobs_per_task=JOBS_PER_TASK):
+    """ Group the jobs simulating the same input into tasks of at most jobs_per_task jobs
+        Returns:
+            list of tasks (lists of jobs), by decreasing total cost
+    """
+    groups = OrderedDict()
+    for job in jobs:
+        groups.setdefault(input_key(job['config']['input']), []).append(job)
+    tasks = []
+    for group in groups.values():
+        group = sorted(group, key=lambda job: -job['cost'])
+        tasks += [group[i:i + jobs_per_task] for i in range(0, len(group), max(1, jobs_per_task))]
+    return sorted(tasks, key=lambda task: -sum(job['cost'] for job in task))
+
+
+def run_batch(jobs, n_workers=None, retries=1, jobs_per_task=JOBS_PER_TASK, frame_cache_mb=FRAME_CACHE_MB,
+              progress=True):
+    """ Run jobs with a pool of processes
+        When a worker dies, the pool stops all its workers: the tasks running at this time are split into single
+        jobs, which are run again one at a time, alone in the pool, without counting an attempt. A job only
+        counts an attempt for a dead worker when it was running alone.
+        Args:
+            jobs: list of jobs, see load_manifest
+            n_workers: number of processes, os.cpu_count() if None, 0 to run the jobs in the calling process
+            retries: number of times a job which failed is run again
+            jobs_per_task: maximum number of jobs of the same input sent at once to a worker
+            frame_cache_mb: size of the frame cache of each worker (MB)
+            progress: display a progress bar
+        Returns:
+            list of the results of the jobs (see _run_job), in the order of the jobs, and the total time (s)
+    """
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    queue = deque(make_tasks(jobs, jobs_per_task))
+    attempts = {job['name']: 0 for job in jobs}
+    results = {}
+    bar = tqdm(total=len(jobs), desc="Batch") if progress else None
+    t_start = time.perf_counter()
+    pool = None
+    broken = False
+    running = {}        # future -> (task, run alone)
+    suspects = deque()  # Jobs of the tasks stopped with a dead worker, run alone
+    if n_workers == 0:
+        _init_worker(frame_cache_mb, single_thread=False)
+    try:
+        while len(queue) > 0 or len(suspects) > 0 or len(running) > 0:
+            if n_workers > 0 and pool is None:
+                pool = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                           initargs=(frame_cache_mb,))
+            # One task per worker at a time, so that the order of the queue is kept. A suspect waits for the
+            # running tasks to finish and runs alone
+            while not broken:
+                if len(suspects) > 0:
+                    if len(running) > 0:
+                        break
+                    task, alone = suspects.popleft(), True
+                elif len(queue) > 0 and (pool is None or len(running) < n_workers):
+                    task, alone = queue.popleft(), False
+                else:
+                    break
+                if pool is None:
+                    fut = Future()
+                    fut.set_result(_run_task(task))
+                else:
+                    fut = pool.submit(_run_task, task)
+                running[fut] = (task, alone)
+                if alone:
+                    break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                task, alone = running.pop(fut)
+                try:
+                    outcomes = fut.result()
+                except BrokenProcessPool:
+                    broken = True
+                    if not alone:
+                        # Maybe stopped because another worker died
+                        suspects.extend([job] for job in task)
+                        continue
+                    outcomes = [_failed(job, "The worker process died") for job in task]
+                except Exception:
+                    outcomes = [_failed(job, traceback.format_exc()) for job in task]
+                for job, res in zip(task, outcomes):
+                    attempts[job['name']] += 1
+                    res['attempts'] = attempts[job['name']]
+                    if res['status'] != STATUS_OK and attempts[job['name']] <= retries:
+                        queue.append([job])
+                        continue
+                    results[job['name']] = res
+                    if bar is not None:
+                        bar.set_postfix(failed=sum(r['status'] != STATUS_OK for r in results.values()),
+                                        refresh=False)
+                        bar.update(1)
+            if broken and len(running) == 0:
+                pool.shutdown(wait=True)
+                pool = None
+                broken = False
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+        if bar is not None:
+            bar.close()
+    return [results[job['name']] for job in jobs], time.perf_counter() - t_start
+
+
+def summarize(results, total, n_workers):
+    """ Throughput of a batch
+        Args:
+            results: results of the jobs, see run_batch
+            total: duration of the batch (s)
+            n_workers: number of processes
+        Returns:
+            dict of the numbers of jobs, frames and events, the throughput and the share of the time the workers
+            spent running jobs
+    """
+    ok = [r for r in results if r['status'] == STATUS_OK]
+    busy = sum(r['time'] for r in results)
+    frames = sum(r['frames'] for r in ok)
+    events = sum(r['events'] for r in ok)
+    return {
+        'jobs': len(results),
+        'ok': len(ok),
+        'failed': len(results) - len(ok),
+        'retried': sum(r['attempts'] > 1 for r in results),
+        'frames': frames,
+        'events': events,
+        'total': total,
+        'jobs_per_s': len(results) / total if total > 0 else 0.0,
+        'fps': frames / total if total > 0 else 0.0,
+        'events_per_s': events / total if total > 0 else 0.0,
+        'utilization': busy / (total * max(1, n_workers)) if total > 0 else 0.0,
+        'frame_cache_hits': sum(r.get('frame_cache_hit', False) for r in ok),
+    }
+
+
+def print_summary(summary, results):
+    """ Print the throughput of a batch and the errors of the jobs which failed """
+    for r in results:
+        if r['status'] != STATUS_OK:
+            print("Job {} failed after {} attempt(s):\n{}".format(r['name'], r['attempts'], r['error']))
+    print("{} jobs ({} failed, {} retried), {} frames, {} events in {:.2f} s: {:.2f} jobs/s, {:.1f} frames/s, "
+          "{:.3g} events/s".format(summary['jobs'], summary['failed'], summary['retried'], summary['frames'],
+                                   summary['events'], summary['total'], summary['jobs_per_s'], summary['fps'],
+                                   summary['events_per_s']))
+    print("  workers busy {:.0%} of the time, {} inputs replayed from the frame caches".format(
+        summary['utilization'], summary['frame_cache_hits']))
+
+
+def _init_worker(frame_cache_mb, single_thread=True):
+    # The workers already run in parallel, OpenCV uses one thread in each of them (not when the jobs run in the
+    # calling process)
+    if single_thread:
+        cv2.setNumThreads(1)
+    _worker['frames'] = FrameCache(int(frame_cache_mb * 2 ** 20))
+
+
+def _run_task(task):
+    return [_run_job(job) for job in task]
+
+
+def _run_job(job):
+    """ Run one job in a worker
+        Returns:
+            dict of the name and status of the job, its frames, events, duration (s) and throughput, the process
+            which ran it, whether its frames came from the frame cache, and the error if it failed
+    """
+    cache = _worker['frames']
+    hits = cache.hits
+    t0 = time.perf_counter()
+    try:
+        stats = simulate(job['config'], progress=False, open_source=cache.open)
+    except Exception:
+        res = _failed(job, traceback.format_exc())
+        res['time'] = time.perf_counter() - t0
+        return res
+    t = time.perf_counter() - t0
+    return {'name': job['name'], 'status': STATUS_OK, 'output': job['config']['output']['path'],
+            'cost': job['cost'], 'frames': stats['frames'], 'events': stats['events'], 'time': t,
+            'fps': stats['frames'] / t if t > 0 else 0.0, 'events_per_s': stats['events'] / t if t > 0 else 0.0,
+            'pid': os.getpid(), 'frame_cache_hit': cache.hits > hits, 'peak_rss_mb': stats['peak_rss_mb']}
+
+
+def _failed(job, error):
+    return {'name': job['name'], 'status': STATUS_FAILED, 'output': job['config']['output']['path'],
+            'cost': job['cost'], 'frames': 0, 'events': 0, 'time': 0.0, 'pid': os.getpid(), 'error': error}
@@ -0,0 +1,129 @@
+import json
+import os
+import shutil
+import numpy as np
+
+# Checkpoints are directories: state.json holds the scalars, every array is saved in its own .npy file so that it
+# can be loaded with memory mapping
+CHECKPOINT_VERSION = 1
+CHECKPOINT_STATE = 'state.json'
+CHECKPOINT_COMPONENTS = ['sensor', 'arbiter', 'writer']
+
+
+def save_checkpoint(path, sensor=None, arbiter=None, writer=None, **extra):
+    """ Save the state of a simulation into a directory
+        The state of each component is given by its get_state method. The checkpoint is written next to the
+        previous one (<path>.tmp) and replaces it at the end, so that a simulation stopped while saving keeps its
+        last checkpoint: the previous checkpoint is moved to <path>.old during the swap, and load_checkpoint reads
+        <path>.old if the simulation stopped before <path> was replaced.
+        On Windows, files mapped in memory cannot be renamed or deleted: a checkpoint loaded with mmap=True (the
+        default) cannot be replaced while its arrays are used, e.g. by the sensor restored from it. Save into another
+        directory, or load it with mmap=False.
+
+            for i, im in enumerate(source):
+                writer.write(dvs.update(im, dt))
+                if i % 1000 == 0:
+                    save_checkpoint("ckpt", sensor=dvs, writer=writer, frame=i + 1)
+
+        Args:
+            path: directory of the checkpoint
+            sensor: DvsSensor
+            arbiter: arbiter with a get_state method
+            writer: DatWriter
+            extra: scalars saved with the checkpoint, e.g. the number of frames simulated
+    """
+    path = os.path.normpath(path)
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    state = {'version': CHECKPOINT_VERSION, 'extra': _to_json(extra, tmp, 'extra')}
+    for name, obj in zip(CHECKPOINT_COMPONENTS, (sensor, arbiter, writer)):
+        if obj is not None:
+            state[name] = _to_json(obj.get_state(), tmp, name)
+    with open(os.path.join(tmp, CHECKPOINT_STATE), 'w') as f:
+        json.dump(state, f)
+    old = path + '.old'
+    if os.path.exists(path):
+        # A .old left by a save which was stopped is older than path
+        if os.path.exists(old):
+            shutil.rmtree(old)
+        os.replace(path, old)
+    os.replace(tmp, path)
+    if os.path.exists(old):
+        shutil.rmtree(old)
+
+
+def load_checkpoint(path, mmap=True):
+    """ Load a checkpoint written by save_checkpoint
+        If the simulation stopped while replacing the checkpoint, the previous one (<path>.old) is loaded.
+        Args:
+            path: directory of the checkpoint
+            mmap: map the arrays in memory (copy-on-write) instead of reading them: they are only read when they
+                  are used, and the pages are shared by the processes loading the same checkpoint. On Windows, the
+                  checkpoint cannot be replaced while they are mapped, see save_checkpoint
+        Returns:
+            dict with the states of the components ('sensor', 'arbiter', 'writer', None if not saved) and the
+            extra scalars ('extra')
+    """
+    path = os.path.normpath(path)
+    if not os.path.exists(path) and os.path.exists(os.path.join(path + '.old', CHECKPOINT_STATE)):
+        path = path + '.old'
+    with open(os.path.join(path, CHECKPOINT_STATE), 'r') as f:
+        state = json.load(f)
+    if state.get('version') != CHECKPOINT_VERSION:
+        raise ValueError("Unsupported checkpoint version {} in {}".format(state.get('version'), path))
+    ckpt = {name: None for name in CHECKPOINT_COMPONENTS}
+    for name in CHECKPOINT_COMPONENTS + ['extra']:
+        if name in state:
+            ckpt[name] = _from_json(state[name], path, 'c' if mmap else None)
+    return ckpt
+
+
+def restore_checkpoint(path, sensor=None, arbiter=None, mmap=True):
+    """ Restore the state of the sensor and of the arbiter from a checkpoint
+        The writer is resumed with DatWriter(filename, width, height, resume=ckpt['writer']).
+        Args:
+            path: directory of the checkpoint
+            sensor: DvsSensor restored, it does not need to be initialised
+            arbiter: arbiter restored, of the type of the saved one
+            mmap: see load_checkpoint
+        Returns:
+            the checkpoint, see load_checkpoint
+    """
+    ckpt = load_checkpoint(path, mmap)
+    if sensor is not None:
+        if ckpt['sensor'] is None:
+            raise ValueError("No sensor in the checkpoint {}".format(path))
+        sensor.set_state(ckpt['sensor'])
+    if arbiter is not None:
+        if ckpt['arbiter'] is None:
+            raise ValueError("No arbiter in the checkpoint {}".format(path))
+        arbiter.set_state(ckpt['arbiter'])
+    return ckpt
+
+
+def _to_json(value, path, key):
+    """ Replace the arrays of a state by the names of the .npy files where they are saved """
+    if isinstance(value, dict):
+        return {k: _to_json(v, path, key + '.' + k) for k, v in value.items()}
+    if isinstance(value, np.ndarray):
+        filename = key + '.npy'
+        np.save(os.path.join(path, filename), value)
+        return {'npy': filename}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(v, path, key + '.' + str(i)) for i, v in enumerate(value)]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _from_json(value, path, mmap_mode):
+    """ Load the arrays of a state saved by _to_json """
+    if isinstance(value, dict):
+        if list(value.keys()) == ['npy']:
+            return np.load(os.path.join(path, value['npy']), mmap_mode=mmap_mode)
+        return {k: _from_json(v, path, mmap_mode) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_from_json(v, path, mmap_mode) for v in value]
+    return value
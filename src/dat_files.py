@@ -1,84 +1,78 @@
+import lzma
 import numpy as np
+import os
+import queue
 import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from tracing import traced
 
-def load_dat_event(filename, start=0, stop=-1, display=False):
+# Masks and shifts of the Version 2 x-y-pol word
+X_MASK = np.uint32(0x00007FF)
+Y_MASK = np.uint32(0x0FFFC000)
+POL_MASK = np.uint32(0x10000000)
+X_SHIFT = 0
+Y_SHIFT = 14
+POL_SHIFT = 28
+
+# Parallel codec
+PARALLEL_MIN_EVENTS = 1 << 22   # Number of events from which load_dat_event and write_event_dat use several threads
+PARALLEL_MIN_CHUNK = 1 << 18    # Minimum number of events per thread
+PARALLEL_MAX_THREADS = 16       # Maximum number of threads used by default
+
+# Epoch markers: records inserted before the first event of each epoch of 2^32 us (see unwrap_dat_ts)
+DAT_MARKER_MASK = np.uint32(0xE0000000)
+DAT_EPOCH_MASK = np.uint32(0x0FFFFFFF)
+
+# EVT 2.0 words: 4 bits of type, then 6 bits of timestamp, 11 bits of x and 11 bits of y for the CD events,
+# or the 28 high bits of the timestamp for the time high words
+EVT2_CD_OFF = 0x0
+EVT2_CD_ON = 0x1
+EVT2_TIME_HIGH = 0x8
+EVT2_TS_LOW_BITS = 6
+EVT2_TIME_HIGH_MASK = np.uint32(0x0FFFFFFF)
+EVT2_COORD_MASK = np.uint32(0x7FF)
+EVT2_COMPRESSIONS = [None, 'zlib', 'lzma']
+
+# Sidecar index
+INDEX_VERSION = 1
+INDEX_EVERY_N = 65536     # Number of events between two timestamps of the index
+INDEX_EVERY_US = 10000    # Duration of a time bin of the index (us)
+
+@traced('dat')
+def load_dat_event(filename, start=0, stop=-1, display=False, n_threads=None):
     """ Load .dat events from file.
         Args:
             filename: Path of the .dat file
             start: starting timestamp (us)
             stop: if different than -1, last timestamp
             display: display file info
+            n_threads: number of threads decoding the events, automatic if None (see codec_threads)
+            If a sidecar index exists (see build_dat_index), it is used to find start and stop without scanning
+            Timestamps beyond 32 bits (about 71 min) are unwrapped, see unwrap_dat_ts
         Returns:
              ts, x, y, pol numpy arrays of timestamps, positions, and polarities
+             ts is uint32, or uint64 if the recording is longer than 32 bits of us
      """
-    f = open(filename, 'rb')
-    if f == -1:
-        print("The file does not exist")
-        return
-    else:
-        if display: print("Load DAT Events: " + filename)
-    l = f.readline()
-    all_lines = l
-    while l[0] == 37:
-        p = f.tell()
-        if display: print(l)
-        l = f.readline()
-        all_lines = all_lines + l
-    # f.close()
-    all_lines = str(all_lines)
-    # f = open(filename, 'rb')
-    f.seek(p, 0)
-    evType = np.uint8(f.read(1)[0])
-    evSize = np.uint8(f.read(1)[0])
-    p = f.tell()
-    l_last = f.tell()
-    if start > 0:
-        t = np.uint32(struct.unpack("<I", bytearray(f.read(4)))[0])
-        dat = np.uint32(struct.unpack("<I", bytearray(f.read(4)))[0])
-        while t < start:
-            p = f.tell()
-            t = np.uint32(struct.unpack("<I", bytearray(f.read(4)))[0])
-            dat = np.uint32(struct.unpack("<I", bytearray(f.read(4)))[0])
-
-    if stop > 0:
-        t = np.uint32(struct.unpack("<I", bytearray(f.read(4)))[0])
-        dat = np.uint32(struct.unpack("<I", bytearray(f.read(4)))[0])
-        while t < stop:
-            l_last = f.tell()
-            t = np.uint32(struct.unpack("<I", bytearray(f.read(4)))[0])
-            dat = np.uint32(struct.unpack("<I", bytearray(f.read(4)))[0])
-    else:
-        l_last = f.seek(0, 2)
-
-    num_b = ((l_last - p) // int(evSize)) * 2
-    f.close()
-    data = np.fromfile(filename, dtype=np.uint32, count=num_b, offset=p)
-    ts = data[::2]
-    v = 0
-    ind = all_lines.find("Version")
-    if ind > 0:
-        v = int(all_lines[ind+8])
-    if v >= 2:
-        x_mask = np.uint32(0x00007FF)
-        y_mask = np.uint32(0x0FFFC000)
-        pol_mask = np.uint32(0x10000000)
-        x_shift = 0
-        y_shift = 14
-        pol_shift = 28
-    else:
-        x_mask = np.uint32(0x00001FF)
-        y_mask = np.uint32(0x0001FE00)
-        pol_mask = np.uint32(0x00020000)
-        x_shift = 0
-        y_shift = 9
-        pol_shift = 17
-    x = data[1::2] & x_mask
-    x = x >> x_shift
-    y = data[1::2] & y_mask
-    y = y >> y_shift
-    pol = data[1::2] & pol_mask
-    pol = pol >> pol_shift
+    header = read_dat_header(filename)
+    if display:
+        print("Load DAT Events: " + filename)
+        print("Version: {}, Width: {}, Height: {}, Events: {}".format(header['version'], header['width'],
+                                                                    header['height'], header['n_events']))
+    data = memmap_dat_event(filename, header)
+    prev_ts = None
+    i_start, i_stop = 0, data.shape[0]
+    if start > 0 or stop > 0:
+        index = load_dat_index(filename)
+        if index is not None:
+            # Use the sidecar index instead of scanning the file
+            i_start, i_stop = index.event_range(start, stop if stop > 0 else None, data)
+        else:
+            i_start, i_stop = scan_dat_event_range(data, header['version'], start, stop if stop > 0 else None)
+        prev_ts = start
+    ts, x, y, pol = decode_dat_records(data[i_start:i_stop], header['version'], prev_ts, n_threads)
     if len(ts) > 0:
         if display:
             print("First Event: ", ts[0], " us")
@@ -87,8 +81,175 @@ def load_dat_event(filename, start=0, stop=-1, display=False):
     return ts, x, y, pol
 
 
+def unwrap_dat_ts(data, version=2, prev_ts=None):
+    """ Timestamps of the records of a .dat file on 64 bits
+        DatWriter and write_event_dat insert an epoch marker record (ts = 0, x-y-pol word with the 3 unused high
+        bits set and the number of the epoch in the low bits) before the first event of every new epoch of 2^32 us.
+        Files without markers (other tools) are unwrapped when the timestamps go backward by more than 2^31 us.
+        Args:
+            data: records of the file, uint32 array of shape (n, 2)
+            version: version of the .dat file, markers only exist from version 2
+            prev_ts: timestamp (us) of the record preceding data, or a time at most 2^31 us before the first record
+        Returns:
+            ts: uint64 timestamps of the records (epoch * 2^32 for the markers)
+            is_ev: bool array, False for the marker records
+    """
+    n = data.shape[0]
+    ts = data[:, 0].astype(np.uint64)
+    epoch0 = 0 if prev_ts is None else int(prev_ts) >> 32
+    if version >= 2:
+        is_marker = (data[:, 1] & DAT_MARKER_MASK) == DAT_MARKER_MASK
+    else:
+        is_marker = np.zeros(n, dtype=bool)
+    if np.any(is_marker):
+        last_marker = np.maximum.accumulate(np.where(is_marker, np.arange(n), -1))
+        epoch = np.where(last_marker >= 0, data[last_marker, 1] & DAT_EPOCH_MASK, epoch0).astype(np.uint64)
+    else:
+        prev = 0 if prev_ts is None else int(prev_ts) & 0xFFFFFFFF
+        back = np.diff(data[:, 0].astype(np.int64), prepend=prev) < -(1 << 31)
+        epoch = np.cumsum(back, dtype=np.uint64) + np.uint64(epoch0)
+    ts |= epoch << np.uint64(32)
+    return ts, ~is_marker
+
+
+def decode_dat_records(data, version=2, prev_ts=None, n_threads=None):
+    """ Decode the records of a .dat file
+        The records are split into record-aligned chunks decoded concurrently into preallocated arrays (NumPy
+        releases the GIL), data can directly be a memory map so that reading the file is also parallel.
+        Args:
+            data: records of the file, uint32 array of shape (n, 2)
+            version: version of the .dat file
+            prev_ts: see unwrap_dat_ts
+            n_threads: number of threads, automatic if None (see codec_threads)
+        Returns:
+             ts, x, y, pol numpy arrays of timestamps, positions, and polarities
+             ts is uint32, or uint64 if one of the timestamps does not fit on 32 bits
+    """
+    n = data.shape[0]
+    bounds = _chunk_bounds(n, codec_threads(n, n_threads))
+    epoch0 = 0 if prev_ts is None else int(prev_ts) >> 32
+    prev32 = 0 if prev_ts is None else int(prev_ts) & 0xFFFFFFFF
+    prevs = [prev32] + [int(data[i - 1, 0]) for i in bounds[1:-1]]
+
+    # Count the markers and backward jumps of each chunk to find the epoch at the start of the chunks
+    summaries = _map_chunks(lambda c: _dat_chunk_summary(data[bounds[c]:bounds[c + 1]], version, prevs[c]),
+                            len(bounds) - 1)
+    use_markers = any(s[0] > 0 for s in summaries)
+    epochs = [epoch0]
+    for n_markers, last_epoch, n_back in summaries:
+        if use_markers:
+            epochs.append(epochs[-1] if last_epoch is None else last_epoch)
+        else:
+            epochs.append(epochs[-1] + n_back)
+    out_bounds = np.cumsum([0] + [(bounds[c + 1] - bounds[c]) - summaries[c][0] for c in range(len(summaries))])
+
+    ts = np.empty(out_bounds[-1], dtype=np.uint64 if epochs[-1] > 0 else np.uint32)
+    x = np.empty(out_bounds[-1], dtype=np.uint32)
+    y = np.empty(out_bounds[-1], dtype=np.uint32)
+    pol = np.empty(out_bounds[-1], dtype=np.uint32)
+
+    def decode(c):
+        o = slice(out_bounds[c], out_bounds[c + 1])
+        _decode_dat_chunk(data[bounds[c]:bounds[c + 1]], version, epochs[c], prevs[c], use_markers,
+                          ts[o], x[o], y[o], pol[o])
+    _map_chunks(decode, len(bounds) - 1)
+    return ts, x, y, pol
+
+
+def codec_threads(n, n_threads=None):
+    """ Number of threads used to decode or encode n events
+        Args:
+            n: number of events
+            n_threads: number of threads requested, automatic if None: one thread for less than
+                       PARALLEL_MIN_EVENTS events, else one per core (at most PARALLEL_MAX_THREADS)
+    """
+    if n_threads is None:
+        if n < PARALLEL_MIN_EVENTS:
+            return 1
+        n_threads = min(os.cpu_count() or 1, PARALLEL_MAX_THREADS)
+    return max(1, min(int(n_threads), n // PARALLEL_MIN_CHUNK + 1))
+
+
+def _chunk_bounds(n, n_threads):
+    """ Bounds of the record-aligned chunks processed by n_threads threads """
+    n_chunks = 1 if n_threads == 1 else 2 * n_threads
+    return [n * c // n_chunks for c in range(n_chunks + 1)]
+
+
+def _map_chunks(fn, n_chunks):
+    """ Apply fn to every chunk number, in a thread pool if there are several chunks """
+    if n_chunks == 1:
+        return [fn(0)]
+    with ThreadPoolExecutor(max_workers=(n_chunks + 1) // 2) as pool:
+        return list(pool.map(fn, range(n_chunks)))
+
+
+def _dat_chunk_summary(data, version, prev32):
+    """ Number of markers, epoch of the last marker (None if no marker) and number of backward jumps of more than
+        2^31 us of a chunk of records, prev32 being the timestamp of the previous record
+    """
+    n_markers = 0
+    last_epoch = None
+    if version >= 2:
+        is_marker = (data[:, 1] & DAT_MARKER_MASK) == DAT_MARKER_MASK
+        n_markers = int(np.count_nonzero(is_marker))
+        if n_markers > 0:
+            last_epoch = int(data[np.flatnonzero(is_marker)[-1], 1] & DAT_EPOCH_MASK)
+    ts = data[:, 0]
+    n_back = 0
+    if ts.shape[0] > 0:
+        n_back = int(np.count_nonzero(np.diff(ts.astype(np.int64), prepend=prev32) < -(1 << 31)))
+    return n_markers, last_epoch, n_back
+
+
+def _decode_dat_chunk(data, version, epoch0, prev32, use_markers, ts, x, y, pol):
+    """ Decode a chunk of records into the output arrays ts, x, y, pol """
+    x_mask, y_mask, pol_mask, x_shift, y_shift, pol_shift = dat_masks(version)
+    if use_markers or ts.dtype == np.uint64:
+        prev_ts = (epoch0 << 32) | prev32
+        ts_64, is_ev = unwrap_dat_ts(data, version if use_markers else 1, prev_ts)
+        if not np.all(is_ev):
+            data = data[is_ev]
+            ts_64 = ts_64[is_ev]
+        ts[:] = ts_64
+    else:
+        ts[:] = data[:, 0]
+    ev = data[:, 1]
+    np.right_shift(np.bitwise_and(ev, x_mask, out=x), x_shift, out=x)
+    np.right_shift(np.bitwise_and(ev, y_mask, out=y), y_shift, out=y)
+    np.right_shift(np.bitwise_and(ev, pol_mask, out=pol), pol_shift, out=pol)
+
+
+def scan_dat_event_range(data, version, t_start, t_stop, chunk_size=1 << 22):
+    """ Find the records whose timestamps are in [t_start, t_stop) by reading the timestamps chunk by chunk
+        Args:
+            data: records of the file, usually memory mapped, uint32 array of shape (n, 2)
+            version: version of the .dat file
+            t_start: first timestamp (us)
+            t_stop: end of the window (us), None for the end of the file
+            chunk_size: number of records read at once
+        Returns:
+            number of the first record and number of the record following the last one
+    """
+    i_start = None
+    prev_ts = None
+    for i in range(0, data.shape[0], chunk_size):
+        ts = unwrap_dat_ts(np.array(data[i:i + chunk_size]), version, prev_ts)[0]
+        prev_ts = ts[-1]
+        if i_start is None and ts[-1] >= t_start:
+            i_start = i + int(np.searchsorted(ts, t_start, side='left'))
+        if i_start is not None and t_stop is None:
+            return i_start, data.shape[0]
+        if i_start is not None and ts[-1] >= t_stop:
+            return i_start, max(i_start, i + int(np.searchsorted(ts, t_stop, side='left')))
+    if i_start is None:
+        i_start = data.shape[0]
+    return i_start, data.shape[0]
+
+
+@traced('dat')
 def write_event_dat(filename, ts, x, y, pol,
-                    event_type='dvs', width=None, height=None):
+                    event_type='dvs', width=None, height=None, n_threads=None):
     """ Write the events in a .DAT file
         The file header begins with %, then event type (one byte uint8) and event lenght
         (one byte uint8), then the data are stores ts (4 bytes uint32) and x-y-pol (4 bytes uint32)
@@ -97,11 +258,85 @@ def write_event_dat(filename, ts, x, y, pol,
             ts: stimestamp
             x, y: positions of the pixels
             p: polarities (0 or 1)
+            n_threads: number of threads packing the events, automatic if None (see codec_threads)
+    """
+    if width is None:
+        width = x.max() + 1
+    if height is None:
+        height = y.max() + 1
+    with open(filename, 'wb') as f:
+        write_dat_header(f, width, height, event_type)
+        pack_events(ts, x, y, pol, n_threads=n_threads).tofile(f)
+
+
+def dat_masks(version):
+    """ Masks and shifts used to decode the x-y-pol word of a .dat file
+        Args:
+            version: version of the .dat file
+        Returns:
+            x_mask, y_mask, pol_mask, x_shift, y_shift, pol_shift
+    """
+    if version >= 2:
+        return X_MASK, Y_MASK, POL_MASK, X_SHIFT, Y_SHIFT, POL_SHIFT
+    return np.uint32(0x00001FF), np.uint32(0x0001FE00), np.uint32(0x00020000), 0, 9, 17
+
+
+def read_dat_header(filename):
+    """ Read the header of a .dat file
+        Args:
+            filename: path of the .dat file
+        Returns:
+            dict with the version, width, height (None if not given), ev_type, ev_size,
+            offset (position of the first event in bytes) and n_events
+    """
+    header = {'version': 0, 'width': None, 'height': None}
+    with open(filename, 'rb') as f:
+        p = 0
+        l = f.readline()
+        while len(l) > 0 and l[0] == 37:
+            words = l.decode('utf8', errors='ignore')[1:].split()
+            if len(words) >= 2 and words[0] == 'Version':
+                header['version'] = int(words[1])
+            if len(words) >= 2 and words[0] == 'Width':
+                header['width'] = int(words[1])
+            if len(words) >= 2 and words[0] == 'Height':
+                header['height'] = int(words[1])
+            p = f.tell()
+            l = f.readline()
+        f.seek(p, 0)
+        header['ev_type'] = int(f.read(1)[0])
+        header['ev_size'] = int(f.read(1)[0])
+        header['offset'] = f.tell()
+        size = f.seek(0, 2)
+    header['n_events'] = (size - header['offset']) // header['ev_size']
+    return header
+
+
+def memmap_dat_event(filename, header=None):
+    """ Map the events of a .dat file in memory without reading them
+        Args:
+            filename: path of the .dat file
+            header: header returned by read_dat_header, read if None
+        Returns:
+            np.memmap of uint32 of shape (n_events, 2): timestamps and x-y-pol words
+    """
+    if header is None:
+        header = read_dat_header(filename)
+    if header['ev_size'] != 8:
+        raise ValueError("{}: events of {} bytes are not supported, only 8 bytes (timestamp and x-y-pol word)"
+                         .format(filename, header['ev_size']))
+    if header['n_events'] == 0:
+        return np.zeros((0, 2), dtype=np.uint32)
+    return np.memmap(filename, dtype=np.uint32, mode='r', offset=header['offset'], shape=(header['n_events'], 2))
+
+
+def write_dat_header(f, width, height, event_type='dvs'):
+    """ Write the header of a Version 2 .dat file
+        Args:
+            f: file opened in binary mode
+            width, height: size of the sensor
+            event_type: 'dvs', 'cd', 'td', 'aps' or 'em'
     """
-    f = open(filename, 'wb')
-    if f == -1:
-        print("Cannot open the file")
-        return
     if event_type in ['dvs', 'cd', 'td']:
         f.write(bytes("% Data file containing DVS events.\n", encoding='utf8'))
     elif event_type in ['aps', 'em']:
@@ -111,32 +346,868 @@ def write_event_dat(filename, ts, x, y, pol,
 
     f.write(bytes("% Version 2\n", encoding='utf8'))
     f.write(bytes("% Date " + str(datetime.now().replace(microsecond=0)) + '\n', encoding='utf8'))
+    f.write(bytes("% Height " + str(height) + '\n', encoding='utf8'))
+    f.write(bytes("% Width " + str(width) + '\n', encoding='utf8'))
+
+    f.write(bytes(np.uint8([0])))  # Event Type
+    f.write(bytes(np.uint8([8])))  # Event length
+
+
+def pack_events(ts, x, y, pol, epoch=0, n_threads=None):
+    """ Pack events into the interleaved ts / x-y-pol uint32 words of a Version 2 .dat file
+        The timestamps are stored on 32 bits: an epoch marker record is inserted before the first event of each new
+        epoch of 2^32 us (about 71 min), see unwrap_dat_ts.
+        The events are packed by record-aligned chunks in several threads, see decode_dat_records.
+        Args:
+            ts: timestamps (us), sorted
+            x, y: positions of the pixels
+            pol: polarities (0 or 1)
+            epoch: epoch of the last event already written
+            n_threads: number of threads, automatic if None (see codec_threads)
+        Returns:
+            np.array of uint32 of size 2 * (len(ts) + number of markers)
+    """
+    n = ts.shape[0]
+    bounds = _chunk_bounds(n, codec_threads(n, n_threads))
+    epochs = None
+    if n > 0 and (int(ts[0]) >> 32 != epoch or int(ts[-1]) >> 32 != epoch):
+        epochs = np.asarray(ts, dtype=np.uint64) >> np.uint64(32)
+    records = np.empty((n, 2), dtype=np.uint32)
+
+    def pack(c):
+        i = slice(bounds[c], bounds[c + 1])
+        records[i, 0] = ts[i]
+        ev = records[i, 1]
+        np.bitwise_and(np.left_shift(np.asarray(x[i], dtype=np.uint32), X_SHIFT), X_MASK, out=ev)
+        ev |= np.left_shift(np.asarray(y[i], dtype=np.uint32), Y_SHIFT) & Y_MASK
+        ev |= np.left_shift(np.asarray(pol[i], dtype=np.uint32), POL_SHIFT) & POL_MASK
+    _map_chunks(pack, len(bounds) - 1)
+    if epochs is None:
+        return records.reshape(2 * n)
+
+    # Insert the epoch markers
+    new_epoch = np.empty(n, dtype=bool)
+    new_epoch[0] = epochs[0] != epoch
+    np.not_equal(epochs[1:], epochs[:-1], out=new_epoch[1:])
+    pos = np.arange(1, n + 1) + np.cumsum(new_epoch) - 1
+    arr = np.zeros((n + int(np.count_nonzero(new_epoch)), 2), dtype=np.uint32)
+    arr[pos] = records
+    arr[pos[new_epoch] - 1, 1] = DAT_MARKER_MASK | (epochs[new_epoch].astype(np.uint32) & DAT_EPOCH_MASK)
+    return arr.reshape(2 * arr.shape[0])
+
+
+def reorder_events(pending, ts, x, y, pol, sort_window):
+    """ Sort new events with the events kept from the previous packets (see DatWriter)
+        Args:
+            pending: (ts, x, y, pol) kept from the previous call, or None
+            ts, x, y, pol: new events
+            sort_window: time (us) during which the events are kept to be sorted with the next packets
+        Returns:
+            (ts, x, y, pol) of the events older than the latest timestamp minus sort_window, sorted, and the
+            events to keep until the next call
+    """
+    if pending is not None:
+        ts = np.concatenate((pending[0], ts))
+        x = np.concatenate((pending[1], x))
+        y = np.concatenate((pending[2], y))
+        pol = np.concatenate((pending[3], pol))
+    if len(ts) == 0:
+        return (ts, x, y, pol), None
+    ind = np.argsort(ts, kind='stable')
+    ts, x, y, pol = ts[ind], x[ind], y[ind], pol[ind]
+    t_limit = int(ts[-1]) - sort_window
+    n = np.searchsorted(ts, t_limit, side='right') if t_limit >= 0 else 0
+    return (ts[:n], x[:n], y[:n], pol[:n]), (ts[n:], x[n:], y[n:], pol[n:])
+
+
+class DatWriter():
+    """ Stream events into a Version 2 .dat file packet by packet
+        The header is written once when the file is opened, every packet given to write() is packed and appended
+        through a buffered file, so the events never have to be kept in memory until the end of the simulation.
+        The file can be read with load_dat_event.
+
+        Packets produced by DvsSensor.update are sorted, but the latency of a pixel can push its events after the
+        first events of the next packet. sort_window (us) keeps the most recent events in a small pending buffer
+        and only writes the events older than the latest timestamp received minus sort_window, so that the
+        file stays monotonic. With the default latency model of DvsSensor (clipped to 10 ms), sort_window=10000
+        is enough.
+
+        Usage:
+            with DatWriter("ev.dat", width, height, sort_window=10000) as writer:
+                for im in frames:
+                    writer.write(dvs.update(im, dt))
+    """
+    # filename = ""            # Path of the file
+    # width = 0                # Width of the sensor
+    # height = 0               # Height of the sensor
+    # n_events = 0             # Number of events written in the file
+    # sort_window = 0          # Time (us) during which events are kept to be sorted with the next packets
+
+    def __init__(self, filename, width, height, event_type='dvs', sort_window=0, buffer_size=1 << 20,
+                 threaded=False, max_queue=16, index=False, index_every_n=INDEX_EVERY_N,
+                 index_every_us=INDEX_EVERY_US, resume=None):
+        """ Open the file and write the header, or resume a file written by another writer
+            Args:
+                filename: path of the file to create
+                width, height: size of the sensor
+                event_type: 'dvs', 'cd', 'td', 'aps' or 'em'
+                sort_window: time (us) during which the events are kept to be sorted with the next packets
+                buffer_size: size of the write buffer (bytes)
+                threaded: pack and write the packets in a separate thread
+                max_queue: maximum number of packets waiting for the writer thread
+                index: also write the sidecar index of the file (see DatIndex) when it is closed
+                index_every_n, index_every_us: sampling of the sidecar index
+                resume: state given by get_state: the file is truncated to the position of the state and the
+                        events are appended after it
+        """
+        self.filename = filename
+        self.width = width
+        self.height = height
+        self.sort_window = sort_window
+        self.n_events = 0
+        self.epoch = 0
+        self.last_ts = None
+        self.pending = None
+        self.index = None
+        if resume is None:
+            self.f = open(filename, 'wb', buffering=buffer_size)
+            write_dat_header(self.f, width, height, event_type)
+            self.offset = self.f.tell()
+            if index:
+                self.index = DatIndex(width, height, self.offset, index_every_n, index_every_us)
+        else:
+            self.f = open(filename, 'r+b', buffering=buffer_size)
+            self.f.truncate(int(resume['position']))
+            self.f.seek(int(resume['position']))
+            self.offset = read_dat_header(filename)['offset']
+            self.n_events = int(resume['n_events'])
+            self.epoch = int(resume['epoch'])
+            self.last_ts = None if resume['last_ts'] is None else int(resume['last_ts'])
+            if 'pending' in resume:
+                pending = resume['pending']
+                self.pending = (np.array(pending['ts']), np.array(pending['x']), np.array(pending['y']),
+                                np.array(pending['pol']))
+            if index:
+                self.index = build_dat_index(filename, index_every_n, index_every_us, save=False)
+        self.error = None
+        self.thread = None
+        if threaded:
+            self.queue = queue.Queue(maxsize=max_queue)
+            self.thread = threading.Thread(target=self._run, name="DatWriter", daemon=True)
+            self.thread.start()
+
+    def __enter__(self):
+        return self
 
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, ev):
+        """ Append the events of an EventBuffer
+            Args:
+                ev: EventBuffer, sorted by timestamps
+        """
+        if ev is None:
+            return
+        self.write_events(ev.ts[:ev.i], ev.x[:ev.i], ev.y[:ev.i], ev.p[:ev.i])
+
+    @traced('dat')
+    def write_events(self, ts, x, y, pol):
+        """ Append events given as arrays
+            With threaded=True, the arrays must not be modified once they have been given to the writer.
+            Args:
+                ts: timestamps (us), sorted
+                x, y: positions of the pixels
+                pol: polarities (0 or 1)
+        """
+        if self.sort_window > 0:
+            ts, x, y, pol = self._reorder(ts, x, y, pol)
+        if len(ts) > 0:
+            self._emit((ts, x, y, pol))
+
+    @traced('dat')
+    def flush(self):
+        """ Write the pending events and flush the file buffer
+            Only call it once no event older than the pending ones can arrive.
+        """
+        if self.pending is not None and len(self.pending[0]) > 0:
+            self._emit(self.pending)
+        self.pending = None
+        if self.thread is not None:
+            self.queue.join()
+        self._check_error()
+        self.f.flush()
+
+    def close(self):
+        """ Write the remaining events and close the file """
+        if self.f.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            if self.thread is not None:
+                self.queue.put(None)
+                self.thread.join()
+                self.thread = None
+            self.f.close()
+        self._check_error()
+        if self.index is not None:
+            self.index.save(dat_index_filename(self.filename))
+
+    def get_state(self):
+        """ Position of the writer, to resume the file with DatWriter(..., resume=state) after a checkpoint
+            The events given so far are written to the file, except the pending ones which are part of the state.
+            Returns:
+                dict of scalars and arrays
+        """
+        if self.thread is not None:
+            self.queue.join()
+        self._check_error()
+        self.f.flush()
+        state = {'position': self.f.tell(), 'n_events': self.n_events, 'epoch': self.epoch, 'last_ts': self.last_ts}
+        if self.pending is not None:
+            state['pending'] = {'ts': self.pending[0].copy(), 'x': self.pending[1].copy(),
+                                'y': self.pending[2].copy(), 'pol': self.pending[3].copy()}
+        return state
+
+    def _reorder(self, ts, x, y, pol):
+        """ Merge the new events with the pending ones and return the events which can be written """
+        packet, self.pending = reorder_events(self.pending, ts, x, y, pol, self.sort_window)
+        return packet
+
+    def _emit(self, packet):
+        """ Write a packet, or give it to the writer thread """
+        self._check_error()
+        if self.thread is None:
+            self._write_packet(packet)
+        else:
+            self.queue.put(packet)
+
+    @traced('dat')
+    def _write_packet(self, packet):
+        arr = pack_events(*packet, epoch=self.epoch)
+        self.f.write(arr.data)
+        self.n_events += len(packet[0])
+        if self.index is not None:
+            records = arr.reshape((-1, 2))
+            ts = unwrap_dat_ts(records, 2, self.last_ts)[0]
+            self.index.add(ts, records[:, 1] & POL_MASK)
+        self.last_ts = int(packet[0][-1])
+        self.epoch = self.last_ts >> 32
+
+    def _run(self):
+        """ Writer thread: pack and write the packets of the queue until None is received """
+        while True:
+            packet = self.queue.get()
+            try:
+                if packet is None:
+                    return
+                if self.error is None:
+                    self._write_packet(packet)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _check_error(self):
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+
+def dat_index_filename(filename):
+    """ Path of the sidecar index of a .dat file """
+    return filename + '.idx'
+
+
+class DatIndex():
+    """ Sidecar time index of a .dat file
+        Stores the timestamp of every every_n-th event and the number of the first event of every time bin of
+        every_us us, along with the statistics of the file. Timestamps are unwrapped on 64 bits and the epoch
+        markers of the file (see unwrap_dat_ts) are counted as events. It is saved next to the .dat file (see
+        dat_index_filename) and gives the events of a time window and the statistics of the file without
+        reading the payload.
+        The index can be written by DatWriter(..., index=True) or built from any sorted .dat file with
+        build_dat_index.
+    """
+    # width = 0                             # Width of the sensor
+    # height = 0                            # Height of the sensor
+    # offset = 0                            # Position of the first event in the .dat file (bytes)
+    # ev_size = 8                           # Size of an event (bytes)
+    # n_events = 0                          # Number of events
+    # n_pos = 0                             # Number of positive events
+    # t_first = 0                           # Timestamp of the first event (us)
+    # t_last = 0                            # Timestamp of the last event (us)
+    # every_n = INDEX_EVERY_N               # Number of events between two entries of block_ts
+    # every_us = INDEX_EVERY_US             # Duration of a time bin (us)
+    # t_origin = 0                          # Start of the first time bin (us)
+    # block_ts = np.zeros(0, np.uint64)     # Timestamp of the events 0, every_n, 2 * every_n...
+    # bin_start = np.zeros(0, np.int64)     # Number of the first event of each time bin
+
+    def __init__(self, width, height, offset, every_n=None, every_us=None, ev_size=8):
+        """ Create an empty index, filled with add()
+            Args:
+                width, height: size of the sensor
+                offset: position of the first event in the .dat file (bytes)
+                every_n: number of events between two timestamps of block_ts
+                every_us: duration of a time bin (us)
+                ev_size: size of an event (bytes)
+        """
+        self.width = width
+        self.height = height
+        self.offset = offset
+        self.ev_size = ev_size
+        self.every_n = INDEX_EVERY_N if every_n is None else int(every_n)
+        self.every_us = INDEX_EVERY_US if every_us is None else int(every_us)
+        self.n_events = 0
+        self.n_pos = 0
+        self.t_first = 0
+        self.t_last = 0
+        self.t_origin = 0
+        self.block_ts = np.zeros(0, dtype=np.uint64)
+        self.bin_start = np.zeros(0, dtype=np.int64)
+        self._block_ts = []
+        self._bin_start = []
+        self._n_bins = 0
+
+    def add(self, ts, pol):
+        """ Index the next events of the file
+            Args:
+                ts: timestamps (us) of the events, sorted, following the ones already added
+                pol: polarities of the events
+        """
+        if len(ts) == 0:
+            return
+        ts = np.asarray(ts, dtype=np.uint64)
+        if self.n_events == 0:
+            self.t_first = int(ts[0])
+            self.t_origin = self.t_first - self.t_first % self.every_us
+        # Timestamps of the events every_n apart
+        first = -(-self.n_events // self.every_n) * self.every_n
+        self._block_ts.append(ts[first - self.n_events::self.every_n])
+        # First event of the time bins starting before the last event
+        last_bin = (int(ts[-1]) - self.t_origin) // self.every_us
+        if last_bin >= self._n_bins:
+            edges = self.t_origin + np.arange(self._n_bins, last_bin + 1, dtype=np.uint64) * self.every_us
+            self._bin_start.append(np.searchsorted(ts, edges, side='left') + self.n_events)
+            self._n_bins = last_bin + 1
+        self.n_pos += int(np.count_nonzero(pol))
+        self.n_events += len(ts)
+        self.t_last = int(ts[-1])
+
+    def finish(self):
+        """ Concatenate the entries added so far """
+        if len(self._block_ts) > 0:
+            self.block_ts = np.concatenate([self.block_ts] + self._block_ts)
+            self._block_ts = []
+        if len(self._bin_start) > 0:
+            self.bin_start = np.concatenate([self.bin_start] + self._bin_start).astype(np.int64)
+            self._bin_start = []
+        return self
+
+    def bin_counts(self):
+        """ Number of events of each time bin """
+        self.finish()
+        return np.diff(np.append(self.bin_start, self.n_events))
+
+    def rate(self):
+        """ Event rate (ev/s) of each time bin """
+        return self.bin_counts() * 1e6 / self.every_us
+
+    def summary(self):
+        """ Statistics of the file
+            Returns:
+                dict with the size of the sensor, the number of events, the timestamps of the first and last events
+                and the mean and peak event rates (ev/s)
+        """
+        rate = self.rate()
+        duration = self.t_last - self.t_first
+        return {
+            'width': self.width,
+            'height': self.height,
+            'n_events': self.n_events,
+            'n_pos': self.n_pos,
+            'n_neg': self.n_events - self.n_pos,
+            't_first': self.t_first,
+            't_last': self.t_last,
+            'mean_rate': self.n_events * 1e6 / duration if duration > 0 else 0.0,
+            'peak_rate': float(rate.max()) if len(rate) > 0 else 0.0,
+        }
+
+    def _first_event(self, t, data):
+        """ Number of the first record whose timestamp is >= t """
+        k = (int(t) - self.t_origin) // self.every_us
+        if k < 0:
+            return 0
+        if k >= len(self.bin_start):
+            return self.n_events
+        i0 = int(self.bin_start[k])
+        i1 = int(self.bin_start[k + 1]) if k + 1 < len(self.bin_start) else self.n_events
+        ts = unwrap_dat_ts(np.array(data[i0:i1]), 2, self.t_origin + k * self.every_us)[0]
+        return i0 + int(np.searchsorted(ts, t, side='left'))
+
+    def event_range(self, t_start, t_stop, data):
+        """ Records whose timestamps are in [t_start, t_stop)
+            Only the records of the time bins of t_start and t_stop are read.
+            Args:
+                t_start: first timestamp (us)
+                t_stop: end of the window (us), None for the end of the file
+                data: records of the file, usually memory mapped (see memmap_dat_event)
+            Returns:
+                number of the first record and number of the record following the last one
+        """
+        self.finish()
+        i_start = self._first_event(t_start, data)
+        i_stop = self.n_events if t_stop is None else self._first_event(t_stop, data)
+        return i_start, max(i_start, i_stop)
+
+    def byte_range(self, t_start, t_stop, data):
+        """ Position in the .dat file (bytes) of the records whose timestamps are in [t_start, t_stop) """
+        i_start, i_stop = self.event_range(t_start, t_stop, data)
+        return self.offset + i_start * self.ev_size, self.offset + i_stop * self.ev_size
+
+    def save(self, filename):
+        """ Save the index
+            Args:
+                filename: path of the index, usually dat_index_filename(dat_filename)
+        """
+        self.finish()
+        with open(filename, 'wb') as f:
+            np.savez(f, version=INDEX_VERSION,
+                     header=np.array([self.width or 0, self.height or 0, self.offset, self.ev_size, self.n_events,
+                                      self.n_pos, self.t_first, self.t_last, self.every_n, self.every_us,
+                                      self.t_origin], dtype=np.int64),
+                     block_ts=self.block_ts, bin_start=self.bin_start)
+
+    @staticmethod
+    def load(filename):
+        """ Load an index saved with save()
+            Args:
+                filename: path of the index
+            Returns:
+                DatIndex
+        """
+        with np.load(filename) as data:
+            if int(data['version']) != INDEX_VERSION:
+                raise ValueError("Unsupported index version: " + filename)
+            h = [int(v) for v in data['header']]
+            index = DatIndex(h[0], h[1], h[2], h[8], h[9], h[3])
+            index.n_events, index.n_pos, index.t_first, index.t_last, index.t_origin = h[4], h[5], h[6], h[7], h[10]
+            index.block_ts = data['block_ts']
+            index.bin_start = data['bin_start']
+        index._n_bins = len(index.bin_start)
+        return index
+
+
+@traced('dat')
+def build_dat_index(filename, every_n=None, every_us=None, chunk_size=1 << 22, save=True):
+    """ Build the sidecar index of a sorted .dat file in one pass
+        Args:
+            filename: path of the .dat file
+            every_n: number of events between two timestamps of the index
+            every_us: duration of a time bin of the index (us)
+            chunk_size: number of events read at once
+            save: write the index next to the file
+        Returns:
+            DatIndex
+    """
+    header = read_dat_header(filename)
+    data = memmap_dat_event(filename, header)
+    pol_mask = dat_masks(header['version'])[2]
+    index = DatIndex(header['width'], header['height'], header['offset'], every_n, every_us, header['ev_size'])
+    prev_ts = None
+    for i in range(0, data.shape[0], chunk_size):
+        chunk = np.array(data[i:i + chunk_size])
+        ts = unwrap_dat_ts(chunk, header['version'], prev_ts)[0]
+        index.add(ts, chunk[:, 1] & pol_mask)
+        prev_ts = ts[-1]
+    index.finish()
+    if save:
+        index.save(dat_index_filename(filename))
+    return index
+
+
+def load_dat_index(filename, build=False):
+    """ Load the sidecar index of a .dat file
+        An index which does not match the size of the file any more is ignored.
+        Args:
+            filename: path of the .dat file
+            build: build the index if it does not exist
+        Returns:
+            DatIndex, or None if there is no valid index
+    """
+    idx_filename = dat_index_filename(filename)
+    index = None
+    if os.path.exists(idx_filename):
+        index = DatIndex.load(idx_filename)
+        if os.path.getsize(filename) != index.offset + index.n_events * index.ev_size:
+            index = None
+    if index is None and build:
+        index = build_dat_index(filename)
+    return index
+
+
+@traced('dat')
+def load_dat_window(filename, t_start, t_stop, index=None):
+    """ Load the events of a time window using the sidecar index
+        Args:
+            filename: path of the .dat file
+            t_start: first timestamp (us)
+            t_stop: end of the window (us), excluded
+            index: DatIndex of the file, loaded (or built) if None
+        Returns:
+             ts, x, y, pol numpy arrays of timestamps, positions, and polarities
+    """
+    header = read_dat_header(filename)
+    if index is None:
+        index = load_dat_index(filename, build=True)
+    data = memmap_dat_event(filename, header)
+    i_start, i_stop = index.event_range(t_start, t_stop, data)
+    return decode_dat_records(np.array(data[i_start:i_stop]), header['version'], t_start)
+
+
+def encode_evt2(ts, x, y, pol, prev_th=None):
+    """ Encode events into EVT 2.0 words
+        A time high word is inserted before every event whose 28 high bits of timestamp differ from the previous
+        event, the CD words only keep the 6 low bits of the timestamps.
+        Args:
+            ts: timestamps (us), sorted
+            x, y: positions of the pixels (< 2048)
+            pol: polarities (0 or 1)
+            prev_th: time high of the event preceding ts[0], None if it is the first event of the stream
+        Returns:
+            np.array of uint32 words
+    """
+    ts = np.asarray(ts, dtype=np.uint64)
+    n = ts.shape[0]
+    if n == 0:
+        return np.zeros(0, dtype=np.uint32)
+    if np.max(x) > EVT2_COORD_MASK or np.max(y) > EVT2_COORD_MASK:
+        raise ValueError("EVT 2.0 positions are limited to 11 bits")
+    th = (ts >> np.uint64(EVT2_TS_LOW_BITS)).astype(np.uint32) & EVT2_TIME_HIGH_MASK
+    new_th = np.empty(n, dtype=bool)
+    new_th[0] = prev_th is None or th[0] != prev_th
+    np.not_equal(th[1:], th[:-1], out=new_th[1:])
+    pos = np.arange(1, n + 1) + np.cumsum(new_th) - 1
+    words = np.empty(n + int(np.count_nonzero(new_th)), dtype=np.uint32)
+    words[pos[new_th] - 1] = (np.uint32(EVT2_TIME_HIGH) << np.uint32(28)) | th[new_th]
+    cd = np.asarray(pol, dtype=np.uint32) << np.uint32(28)
+    cd |= (ts & np.uint64(0x3F)).astype(np.uint32) << np.uint32(22)
+    cd |= np.asarray(x, dtype=np.uint32) << np.uint32(11)
+    cd |= np.asarray(y, dtype=np.uint32)
+    words[pos] = cd
+    return words
+
+
+def decode_evt2(words):
+    """ Decode EVT 2.0 words
+        The time high words going backward (28 bits overflow, every 4.7 hours) are unwrapped.
+        Words of other types (triggers, vendor words) are skipped.
+        Args:
+            words: np.array of uint32 words
+        Returns:
+             ts (uint64), x, y, pol numpy arrays of timestamps, positions, and polarities
+    """
+    words = np.asarray(words, dtype=np.uint32)
+    typ = words >> np.uint32(28)
+    is_th = typ == EVT2_TIME_HIGH
+    # Time high of each word: last time high word before it, unwrapped
+    th = (words[is_th] & EVT2_TIME_HIGH_MASK).astype(np.uint64)
+    if th.shape[0] > 1:
+        wraps = np.cumsum(np.diff(th.astype(np.int64)) < -(1 << 27))
+        th[1:] += wraps.astype(np.uint64) << np.uint64(28)
+    th = np.concatenate((np.zeros(1, dtype=np.uint64), th))
+    th_id = np.cumsum(is_th)
+    is_cd = typ <= EVT2_CD_ON
+    cd = words[is_cd]
+    ts = th[th_id[is_cd]] << np.uint64(EVT2_TS_LOW_BITS)
+    ts |= ((cd >> np.uint32(22)) & np.uint32(0x3F)).astype(np.uint64)
+    x = (cd >> np.uint32(11)) & EVT2_COORD_MASK
+    y = cd & EVT2_COORD_MASK
+    pol = typ[is_cd]
+    return ts, x, y, pol
+
+
+class Evt2Writer():
+    """ Stream events into an EVT 2.0 file (Prophesee .raw layout)
+        Events cost 4 bytes plus one time high word every 64 us of activity, instead of 8 bytes in a .dat file.
+        With compression ('zlib' or 'lzma') the words are compressed in independent chunks of chunk_size words,
+        each one stored after its compressed size (uint32) and its number of words (uint32). Compressed files can
+        only be read with load_evt2_event.
+        The time high words need sorted timestamps: as in DatWriter, sort_window (us) keeps the most recent events
+        to sort them with the next packets.
+    """
+    # filename = ""            # Path of the file
+    # width = 0                # Width of the sensor
+    # height = 0               # Height of the sensor
+    # compression = None       # None, 'zlib' or 'lzma'
+    # n_events = 0             # Number of events written in the file
+    # sort_window = 0          # Time (us) during which events are kept to be sorted with the next packets
+
+    def __init__(self, filename, width, height, compression=None, level=None, chunk_size=1 << 20, sort_window=0):
+        """ Open the file and write the header
+            Args:
+                filename: path of the file to create
+                width, height: size of the sensor
+                compression: None, 'zlib' or 'lzma'
+                level: compression level, 1 for zlib and 0 for lzma if None
+                chunk_size: number of words compressed together
+                sort_window: time (us) during which the events are kept to be sorted with the next packets
+        """
+        if compression not in EVT2_COMPRESSIONS:
+            raise ValueError("Specify a valid compression: None, 'zlib' or 'lzma'")
+        self.filename = filename
+        self.width = width
+        self.height = height
+        self.compression = compression
+        self.level = level
+        self.chunk_size = chunk_size
+        self.sort_window = sort_window
+        self.pending = None
+        self.n_events = 0
+        self.prev_th = None
+        self.words = []
+        self.n_words = 0
+        self.f = open(filename, 'wb')
+        self.f.write(bytes("% evt 2.0\n", encoding='utf8'))
+        self.f.write(bytes("% format EVT2;height={};width={}\n".format(height, width), encoding='utf8'))
+        self.f.write(bytes("% geometry {}x{}\n".format(width, height), encoding='utf8'))
+        self.f.write(bytes("% date " + str(datetime.now().replace(microsecond=0)) + '\n', encoding='utf8'))
+        if compression is not None:
+            self.f.write(bytes("% compression " + compression + '\n', encoding='utf8'))
+        self.f.write(bytes("% end\n", encoding='utf8'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, ev):
+        """ Append the events of an EventBuffer
+            Args:
+                ev: EventBuffer, sorted by timestamps
+        """
+        if ev is None:
+            return
+        self.write_events(ev.ts[:ev.i], ev.x[:ev.i], ev.y[:ev.i], ev.p[:ev.i])
+
+    @traced('dat')
+    def write_events(self, ts, x, y, pol):
+        """ Append events given as arrays
+            Args:
+                ts: timestamps (us), sorted
+                x, y: positions of the pixels
+                pol: polarities (0 or 1)
+        """
+        if self.sort_window > 0:
+            (ts, x, y, pol), self.pending = reorder_events(self.pending, ts, x, y, pol, self.sort_window)
+        self._encode(ts, x, y, pol)
+
+    def _encode(self, ts, x, y, pol):
+        if len(ts) == 0:
+            return
+        words = encode_evt2(ts, x, y, pol, self.prev_th)
+        self.prev_th = (int(ts[-1]) >> EVT2_TS_LOW_BITS) & int(EVT2_TIME_HIGH_MASK)
+        self.n_events += len(ts)
+        if self.compression is None:
+            self.f.write(words.data)
+            return
+        self.words.append(words)
+        self.n_words += words.shape[0]
+        if self.n_words >= self.chunk_size:
+            words = np.concatenate(self.words)
+            n = words.shape[0] - words.shape[0] % self.chunk_size
+            for i in range(0, n, self.chunk_size):
+                self._write_chunk(words[i:i + self.chunk_size])
+            self.words = [words[n:]]
+            self.n_words = words.shape[0] - n
+
+    def close(self):
+        """ Write the remaining events and close the file """
+        if self.f.closed:
+            return
+        if self.pending is not None:
+            self._encode(*self.pending)
+            self.pending = None
+        if self.n_words > 0:
+            self._write_chunk(np.concatenate(self.words))
+        self.words = []
+        self.n_words = 0
+        self.f.close()
+
+    def _write_chunk(self, words):
+        if self.compression == 'zlib':
+            data = zlib.compress(words.tobytes(), 1 if self.level is None else self.level)
+        else:
+            data = lzma.compress(words.tobytes(), preset=0 if self.level is None else self.level)
+        self.f.write(struct.pack("<II", len(data), words.shape[0]))
+        self.f.write(data)
+
+
+def write_event_evt2(filename, ts, x, y, pol, width=None, height=None, compression=None, level=None,
+                     chunk_size=1 << 20):
+    """ Write the events in an EVT 2.0 file, see Evt2Writer
+        Args:
+            filename: path of the file to create
+            ts: timestamps (us), sorted
+            x, y: positions of the pixels
+            pol: polarities (0 or 1)
+            width, height: size of the sensor, computed from x and y if None
+            compression: None, 'zlib' or 'lzma'
+            level: compression level
+            chunk_size: number of words compressed together
+    """
     if width is None:
         width = x.max() + 1
     if height is None:
         height = y.max() + 1
-    f.write(bytes("% Height " + str(height) + '\n', encoding='utf8'))
-    f.write(bytes("% Width " + str(width) + '\n', encoding='utf8'))
+    with Evt2Writer(filename, width, height, compression, level, chunk_size) as writer:
+        for i in range(0, len(ts), chunk_size):
+            writer.write_events(ts[i:i + chunk_size], x[i:i + chunk_size], y[i:i + chunk_size],
+                                pol[i:i + chunk_size])
+
+
+def read_evt2_header(filename):
+    """ Read the header of an EVT 2.0 file
+        Args:
+            filename: path of the file
+        Returns:
+            dict with the width, height, compression and offset (position of the first word in bytes)
+    """
+    header = {'width': None, 'height': None, 'compression': None}
+    with open(filename, 'rb') as f:
+        p = 0
+        l = f.readline()
+        while len(l) > 0 and l[0] == 37:
+            p = f.tell()
+            words = l.decode('utf8', errors='ignore')[1:].split()
+            if len(words) >= 2 and words[0] == 'format':
+                for field in words[1].split(';')[1:]:
+                    key, _, value = field.partition('=')
+                    if key in ['width', 'height']:
+                        header[key] = int(value)
+            if len(words) >= 2 and words[0] == 'compression':
+                header['compression'] = words[1]
+            if len(words) >= 1 and words[0] == 'end':
+                break
+            l = f.readline()
+    header['offset'] = p
+    return header
+
+
+def load_evt2_event(filename):
+    """ Load the events of an EVT 2.0 file, compressed or not
+        Args:
+            filename: path of the file
+        Returns:
+             ts (uint64), x, y, pol numpy arrays of timestamps, positions, and polarities
+    """
+    header = read_evt2_header(filename)
+    if header['compression'] is None:
+        return decode_evt2(np.fromfile(filename, dtype=np.uint32, offset=header['offset']))
+    if header['compression'] not in EVT2_COMPRESSIONS:
+        raise ValueError("Unsupported compression: " + header['compression'])
+    decompress = zlib.decompress if header['compression'] == 'zlib' else lzma.decompress
+    chunks = []
+    with open(filename, 'rb') as f:
+        f.seek(header['offset'], 0)
+        size = f.read(8)
+        while len(size) == 8:
+            n_bytes, n_words = struct.unpack("<II", size)
+            chunks.append(np.frombuffer(decompress(f.read(n_bytes)), dtype=np.uint32, count=n_words))
+            size = f.read(8)
+    if len(chunks) == 0:
+        return decode_evt2(np.zeros(0, dtype=np.uint32))
+    return decode_evt2(np.concatenate(chunks))
+
+
+def convert_dat_to_evt2(dat_filename, evt2_filename, compression=None, level=None, chunk_size=1 << 20):
+    """ Convert a sorted .dat file into an EVT 2.0 file, chunk by chunk
+        Args:
+            dat_filename: path of the .dat file
+            evt2_filename: path of the file to create
+            compression: None, 'zlib' or 'lzma'
+            level: compression level
+            chunk_size: number of events converted at once
+    """
+    header = read_dat_header(dat_filename)
+    data = memmap_dat_event(dat_filename, header)
+    prev_ts = None
+    with Evt2Writer(evt2_filename, header['width'], header['height'], compression, level, chunk_size) as writer:
+        for i in range(0, data.shape[0], chunk_size):
+            ts, x, y, pol = decode_dat_records(np.array(data[i:i + chunk_size]), header['version'], prev_ts)
+            writer.write_events(ts, x, y, pol)
+            if len(ts) > 0:
+                prev_ts = ts[-1]
+
+
+@traced('dat')
+def merge_dat_files(filenames, output, offsets=None, width=None, height=None, chunk_size=1 << 20, index=False):
+    """ Merge time-sorted .dat files into one sorted .dat file
+        The files are read chunk by chunk through memory maps: at each step, the events older than the last event
+        read from every file which is not finished are sorted together and appended to the output, so the memory
+        used is bounded by len(filenames) * chunk_size events.
+        Used for instance to merge the object and shadow events of examples/04_ball, or the tiles of a sensor
+        simulated in parallel.
+        Args:
+            filenames: paths of the .dat files to merge
+            output: path of the .dat file to create
+            offsets: (x, y) offset added to the positions of each file, to place the tiles in the output sensor
+            width, height: size of the output sensor, computed from the headers and offsets if None
+            chunk_size: number of events read at once from each file
+            index: also write the sidecar index of the output file
+        Returns:
+            number of events written
+    """
+    if offsets is None:
+        offsets = [(0, 0)] * len(filenames)
+    if len(offsets) != len(filenames):
+        raise ValueError("One offset is needed per file")
+    headers = [read_dat_header(f) for f in filenames]
+    if width is None or height is None:
+        if any(h['width'] is None or h['height'] is None for h in headers):
+            raise ValueError("The size of a file is missing in its header, specify width and height")
+        if width is None:
+            width = max(h['width'] + o[0] for h, o in zip(headers, offsets))
+        if height is None:
+            height = max(h['height'] + o[1] for h, o in zip(headers, offsets))
+    data = [memmap_dat_event(f, h) for f, h in zip(filenames, headers)]
+    pos = [0] * len(filenames)
+    prev_ts = [None] * len(filenames)
+    buffers = [None] * len(filenames)
+    with DatWriter(output, width, height, index=index) as writer:
+        while True:
+            # Read the next chunk of the files whose events have all been written, a chunk can be made of
+            # epoch markers only: a file is only finished once all its records have been read
+            for k in range(len(filenames)):
+                while (buffers[k] is None or len(buffers[k][0]) == 0) and pos[k] < data[k].shape[0]:
+                    chunk = np.array(data[k][pos[k]:pos[k] + chunk_size])
+                    pos[k] += chunk.shape[0]
+                    ts, x, y, pol = decode_dat_records(chunk, headers[k]['version'], prev_ts[k])
+                    ts = ts.astype(np.uint64)
+                    if len(ts) > 0:
+                        prev_ts[k] = ts[-1]
+                    if headers[k]['version'] >= 2 and chunk[-1, 1] & DAT_MARKER_MASK == DAT_MARKER_MASK:
+                        prev_ts[k] = int(chunk[-1, 1] & DAT_EPOCH_MASK) << 32
+                    buffers[k] = (ts, x + np.uint32(offsets[k][0]), y + np.uint32(offsets[k][1]), pol)
+            active = [k for k in range(len(filenames)) if buffers[k] is not None and len(buffers[k][0]) > 0]
+            if len(active) == 0:
+                break
+            # Events before the last timestamp read from the unfinished files can be written
+            unfinished = [buffers[k][0][-1] for k in active if pos[k] < data[k].shape[0]]
+            bound = min(unfinished) if len(unfinished) > 0 else None
+            packets = []
+            for k in active:
+                n = len(buffers[k][0]) if bound is None else np.searchsorted(buffers[k][0], bound, side='right')
+                packets.append(tuple(a[:n] for a in buffers[k]))
+                buffers[k] = tuple(a[n:] for a in buffers[k])
+            ts, x, y, pol = (np.concatenate([pk[i] for pk in packets]) for i in range(4))
+            ind = np.argsort(ts, kind='stable')
+            writer.write_events(ts[ind], x[ind], y[ind], pol[ind])
+    return writer.n_events
 
-    f.write(bytes(np.uint8([0])))  # Event Type
-    f.write(bytes(np.uint8([8])))  # Event length
-    arr = np.zeros(2 * ts.shape[0], dtype=np.uint32)
-    arr[::2] = ts
-    x_mask = np.uint32(0x00007FF)
-    y_mask = np.uint32(0x0FFFC000)
-    pol_mask = np.uint32(0x10000000)
-    x_shift = 0
-    y_shift = 14
-    pol_shift = 28
-    buf = np.array(x, dtype=np.uint32) << x_shift
-    arr[1::2] += x_mask & buf
-    buf = np.array(y, dtype=np.uint32) << y_shift
-    arr[1::2] += y_mask & buf
-    buf = np.array(pol, dtype=np.uint32) << pol_shift
-    arr[1::2] += pol_mask & buf
-    arr.tofile(f)
-    f.close()
 
 if __name__ == '__main__':
     ts, x, y, pol =  load_dat_event("ev_100_10_100_300_0.3_0.01.dat", start=0, stop=-1, display=True)
@@ -1,19 +1,69 @@
 # Damien JOUBERT 17-01-2020 - Updated by AvS 23-02-2024
 import numpy as np
 from event_buffer import EventBuffer
-from tqdm import tqdm
+from profiling import FrameProfiler
+from tracing import traced
+from noise_cache import FREQ, compile_noise_tables, compile_lux_noise_tables, draw_noise_delays, \
+    load_noise_tables, load_lux_noise_tables
 
-# Global variables
-# Log bin for the noise distributions
-bins = []
-for dec in range(-3, 5, 1):
-    bins.append(np.arange(10 ** dec, 10 ** (dec + 1), 10 ** dec))
-bins = np.array(bins)
-FREQ = bins.reshape(bins.shape[0] * bins.shape[1])
+# Types of images converted with lookup tables
+LUT_TYPES = [np.dtype(np.uint8), np.dtype(np.uint16)]
 
 # Noise generation methods
 NOISE_FREQ = 1     # Pixels have the same +/- noise frequency but with different phases
 NOISE_MEASURE = 2  # Pixels have a noise distribution measured in one lighting conditions
+NOISE_LUX = 3      # Pixels have noise distributions measured in several lighting conditions, used with their input
+
+# State of the sensor saved by get_state: parameters and pixel arrays
+STATE_PARAMS = ['shape', 'm_th_pos', 'm_th_neg', 'm_th_noise', 'm_latency', 'tau', 'm_jitter', 'm_bgn_pos',
+                'm_bgn_neg', 'm_bgn_pos_per', 'm_bgn_neg_per', 'ref', 'time', 'noise_model', 'tile_size', 'tile_tol',
+                'max_log_step', 'max_substeps']
+STATE_ARRAYS = ['last_v', 'cur_v', 'cur_th_pos', 'cur_th_neg', 'cur_ref', 'time_px', 'tau_p', 'bgn_pos_next',
+                'bgn_neg_next', 'bgn_cdf_pos', 'bgn_cdf_neg', 'bgn_id_pos', 'bgn_id_neg', 'bgn_lux', 'prev_img_l']
+# Arrays of the state of the pixels gathered by PixelSet
+PIXEL_ARRAYS = ['last_v', 'cur_v', 'cur_th_pos', 'cur_th_neg', 'cur_ref', 'time_px', 'tau_p']
+
+
+def is_lut_image(img):
+    """ True if the image is converted with lookup tables (uint8 or uint16) """
+    return img.dtype in LUT_TYPES
+
+
+class PixelSet:
+    """ State of a set of pixels of a DvsSensor gathered into 1-D arrays
+        The pixels simulated by an update (the active tiles, the fast pixels) are gathered into compact arrays,
+        simulated and scattered back into the arrays of the sensor, so that the other pixels are not touched. For
+        every pixel, the arrays are flat views of the arrays of the sensor and nothing is copied.
+    """
+    # flat = None                                         # Indices of the pixels in the flattened imager, or None
+    # width = 0                                           # Width of the imager
+    # last_v, cur_v, cur_th_pos, cur_th_neg, cur_ref, time_px, tau_p: state of the pixels, see DvsSensor
+
+    def __init__(self, sensor, flat=None):
+        """ Gather the state of the pixels
+            Args:
+                sensor: DvsSensor
+                flat: sorted indices of the pixels in the flattened imager, None for every pixel
+        """
+        self.flat = flat
+        self.width = sensor.shape[1]
+        for name in PIXEL_ARRAYS:
+            a = getattr(sensor, name).reshape(-1)
+            setattr(self, name, a if flat is None else a[flat])
+
+    def __len__(self):
+        return self.last_v.shape[0]
+
+    def scatter(self, sensor):
+        """ Write the state of the pixels back into the arrays of the sensor """
+        if self.flat is None:
+            return
+        for name in PIXEL_ARRAYS:
+            getattr(sensor, name).reshape(-1)[self.flat] = getattr(self, name)
+
+    def coords(self, ind):
+        """ Rows and columns of pixels given by their positions in the set """
+        return np.divmod(ind if self.flat is None else self.flat[ind], self.width)
 
 
 class DvsSensor:
@@ -39,10 +89,23 @@ class DvsSensor:
     # cur_ref      = np.zeros(shape, dtype=np.uint64)     # Time when the pixel will have to be reset
     # bgn_pos_next = np.zeros(shape, dtype=np.uint64)     # Next expected positive noise event
     # bgn_neg_next = np.zeros(shape, dtype=np.uint64)     # Next expected negative noise event
-    # bgn_hist_pos = np.zeros((1, 1, 45), dtype=float)    # Positive noise cumulative distributions
-    # bgn_hist_neg = np.zeros((1, 1, 45), dtype=float)    # Negative noise cumulative distributions
+    # bgn_cdf_pos  = np.zeros((1, 72), dtype=float)       # Positive noise cumulative distributions
+    # bgn_cdf_neg  = np.zeros((1, 72), dtype=float)       # Negative noise cumulative distributions
+    # bgn_id_pos   = np.zeros(shape, dtype=np.int32)      # Positive noise distribution of each pixel
+    # bgn_id_neg   = np.zeros(shape, dtype=np.int32)      # Negative noise distribution of each pixel
+    # bgn_lux      = np.zeros(3, dtype=float)             # Log illuminations of the noise distributions (NOISE_LUX)
     # time_px      = np.zeros(shape, dtype=np.uint64)     # Time t at the pixel (us)
     # tau_p        = np.zeros(shape, dtype=np.double)     # Time constant of each pixel (us)
+    # tile_size = 0                                       # Size of the tiles skipped when static (0: no skipping)
+    # tile_tol = 1e-4                                     # Log difference under which a pixel has converged
+    # prev_img_l   = np.zeros(shape, dtype=np.double)     # Log value of the previous input image
+    # prev_img = None                                     # Previous input image, to find the tiles which changed
+    # prev_scale = None                                   # Radiometric value of a greylevel of prev_img
+    # busy_tiles = None                                   # Tiles simulated at the next update even if static
+    # active_ratio = 1.0                                  # Ratio of tiles simulated during the last update
+    # max_log_step = 0                                    # Log change of a frame above which a pixel is sub-stepped
+    # max_substeps = 16                                   # Number of sub-steps of the fast pixels in a frame
+    # profiler = None                                     # FrameProfiler recording the updates, None if disabled
 
     def __init__(self, name):
         """ Init the sensor by creating the Blender Camera
@@ -90,6 +153,17 @@ class DvsSensor:
         self.time_px = np.zeros(self.shape, dtype=np.uint64)
         self.tau_p = np.zeros(self.shape, dtype=np.double)
         self.cur_ref[:] = np.iinfo(np.uint64).max
+        self.luts = {}
+        self.tile_size = 0
+        self.tile_tol = 1e-4
+        self.prev_img_l = None
+        self.prev_img = None
+        self.prev_scale = None
+        self.busy_tiles = None
+        self.active_ratio = 1.0
+        self.max_log_step = 0
+        self.max_substeps = 16
+        self.profiler = None
         self.init_bgn()
         self.init_thresholds()
         self.time = 0
@@ -103,61 +177,55 @@ class DvsSensor:
         self.bgn_pos_next = np.array(np.random.randint(0, self.m_bgn_pos_per, self.shape), dtype=np.uint64)
         self.bgn_neg_next = np.array(np.random.randint(0, self.m_bgn_neg_per, self.shape), dtype=np.uint64)
 
-    def init_bgn_hist(self, filename_noise_pos, filename_noise_neg):
+    def init_bgn_hist(self, filename_noise_pos, filename_noise_neg, seed=None, cache_dir=None):
         """ Load measured distributions of the noise,
             Pick randomly one noise distribution for each pixel and Initialise also randomly the phases of the
             background noise
+            With a seed, the tables are compiled once and loaded from a cache shared by the processes, see
+            noise_cache.load_noise_tables.
             Args:
                 filename_noise_pos: path of the positive noise's filename
                 filename_noise_neg: path of the negative noise's filename
+                seed: seed of the random draws of the tables, None to draw them with np.random without caching them
+                cache_dir: directory of the cache, noise_cache.NOISE_CACHE_DIR if None
             """
         self.noise_model = NOISE_MEASURE
-        noise_pos = np.load(filename_noise_pos)
-        noise_pos = np.reshape(noise_pos, (noise_pos.shape[0] * noise_pos.shape[1], noise_pos.shape[2]))
-        if len(noise_pos) == 0:
-            print(filename_noise_pos, " is not correct")
-            return
-        noise_neg = np.load(filename_noise_neg)
-        noise_neg = np.reshape(noise_neg, (noise_neg.shape[0] * noise_neg.shape[1], noise_neg.shape[2]))
-        if len(noise_neg) == 0:
-            print(filename_noise_neg, " is not correct")
-            return
-        
-        # Load histogram and Update next noise event
-        self.bgn_hist_pos = np.zeros((self.shape[0] * self.shape[1], 72), dtype=float)
-        self.bgn_hist_neg = np.zeros((self.shape[0] * self.shape[1], 72), dtype=float)
-        self.bgn_pos_next = np.zeros((self.shape[0], self.shape[1]), dtype=np.uint64)
-        self.bgn_neg_next = np.zeros((self.shape[0], self.shape[1]), dtype=np.uint64)
-
-        # Pick two spectra for each pixel (one for ON and one for OFF events)
-        id_n = np.random.uniform(0, noise_neg.shape[0], size=(self.shape[0] * self.shape[1])).astype(int)
-        id_p = np.random.uniform(0, noise_pos.shape[0], size=(self.shape[0] * self.shape[1])).astype(int)
-        self.bgn_hist_pos = noise_pos[id_p, :]
-        self.bgn_hist_neg = noise_neg[id_n, :]
-
-        # Normalise noise spectra
-        s_p = np.sum(self.bgn_hist_pos, axis=1)
-        s_n = np.sum(self.bgn_hist_neg, axis=1)
-        id_p = np.where(s_p == 0)
-        self.bgn_hist_pos[id_p, 0] = 1
-        id_n = np.where(s_n == 0)
-        self.bgn_hist_neg[id_n, 0] = 1
-        id_p = np.where(s_p > 0)
-        self.bgn_hist_pos[id_p, :] = self.bgn_hist_pos[id_p, :] / \
-                                     np.repeat(self.bgn_hist_pos[id_p, -2].reshape((1, id_p[0].shape[0], 1)),
-                                               self.bgn_hist_pos.shape[1],
-                                               axis=2)
-        id_n = np.where(s_n > 0)
-        self.bgn_hist_neg[id_n, :] = self.bgn_hist_neg[id_n, :] / \
-                                     np.repeat(self.bgn_hist_neg[id_n, -2].reshape((1, id_n[0].shape[0], 1)),
-                                               self.bgn_hist_neg.shape[1],
-                                               axis=2)
-
+        if seed is None:
+            tables = compile_noise_tables(filename_noise_pos, filename_noise_neg, self.shape)
+        else:
+            tables = load_noise_tables(filename_noise_pos, filename_noise_neg, self.shape, seed, cache_dir)
+        self.bgn_cdf_pos = tables['cdf_pos']
+        self.bgn_cdf_neg = tables['cdf_neg']
+        self.bgn_id_pos = tables['id_pos']
+        self.bgn_id_neg = tables['id_neg']
         # Draw the next noise event time for each pixel
-        for x in tqdm(range(0, self.shape[0], 1), desc="Noise Init"):
-            for y in range(0, self.shape[1], 1):
-                self.bgn_pos_next[x, y] = np.uint64(self.get_next_noise(x, y, 1) * np.random.uniform(0, 1))
-                self.bgn_neg_next[x, y] = np.uint64(self.get_next_noise(x, y, 0) * np.random.uniform(0, 1))
+        self.bgn_pos_next = np.array(tables['next_pos'], dtype=np.uint64)
+        self.bgn_neg_next = np.array(tables['next_neg'], dtype=np.uint64)
+
+    def init_bgn_lux(self, levels, seed=None, cache_dir=None):
+        """ Load distributions of the noise measured in several lighting conditions
+            Each pixel picks randomly one distribution of each level. Every noise event is drawn from the
+            distribution of one of the two levels surrounding the current illumination of the pixel, picked with a
+            probability linear in the log domain: the noise of the dark regions of the scene follows the noise
+            measured in the dark. The input images are assumed to be in lux. The phases of the noise are drawn with
+            the first image (init_image).
+            Args:
+                levels: list of (lux, filename_noise_pos, filename_noise_neg), e.g. noise_cache.lux_noise_files
+                seed: seed of the random draws of the tables, None to draw them with np.random without caching them
+                cache_dir: directory of the cache, noise_cache.NOISE_CACHE_DIR if None
+        """
+        self.noise_model = NOISE_LUX
+        if seed is None:
+            tables = compile_lux_noise_tables(levels, self.shape)
+        else:
+            tables = load_lux_noise_tables(levels, self.shape, seed, cache_dir)
+        self.bgn_lux = np.log(tables['lux'] + 1)
+        self.bgn_cdf_pos = tables['cdf_pos']
+        self.bgn_cdf_neg = tables['cdf_neg']
+        self.bgn_id_pos = tables['id_pos']
+        self.bgn_id_neg = tables['id_neg']
+        self.bgn_pos_next = np.zeros(self.shape, dtype=np.uint64)
+        self.bgn_neg_next = np.zeros(self.shape, dtype=np.uint64)
 
     def init_thresholds(self):
         """ Initialise the thresholds of the comparators
@@ -168,21 +236,224 @@ class DvsSensor:
         self.cur_th_neg = np.clip(np.array(np.random.normal(self.m_th_neg, self.m_th_noise, self.shape),
                                            dtype=np.double), -1000, 0)
 
-    def init_image(self, img):
+    def init_image(self, img, scale=None):
         """ Initialise the first flux values of the sensor
         Args:
             img: image whose greylevel corresponds to a radiometric value
             It is assumed the maximum radiometric value is 1e6
+            scale: radiometric value of a greylevel of 1 for uint8 and uint16 images (1 if None), see get_luts
         """
         if img.shape[1] != self.shape[1] or img.shape[0] != self.shape[0]:
             print("Error: the size of the image doesn't match with the sensor ")
             return
-        self.last_v = np.log(img + 1)
-        self.cur_v = np.log(img + 1)
-        self.tau_p = self.tau * 1e3 / (img + 1)
+        if is_lut_image(img):
+            log_lut, tau_lut = self.get_luts(img.dtype, scale)
+            self.last_v = log_lut[img]
+            self.cur_v = self.last_v.copy()
+            self.tau_p = tau_lut[img]
+        else:
+            if scale is not None:
+                img = img * scale
+            self.last_v = np.log(img + 1)
+            self.cur_v = np.log(img + 1)
+            self.tau_p = self.tau * 1e3 / (img + 1)
+        self.prev_img_l = self.last_v.copy()
+        self.prev_img = None
         self.time_px[:, :] = 0
         self.time = 0
+        if self.noise_model == NOISE_LUX:
+            # Draw the next noise event time for each pixel, from its illumination
+            ind = np.nonzero(np.ones(self.shape, dtype=bool))
+            self.bgn_pos_next = np.uint64(self.get_next_noise_array(ind, 1, self.last_v).reshape(self.shape) *
+                                          np.random.uniform(0, 1, self.shape))
+            self.bgn_neg_next = np.uint64(self.get_next_noise_array(ind, 0, self.last_v).reshape(self.shape) *
+                                          np.random.uniform(0, 1, self.shape))
+
+    def get_state(self):
+        """ Copy of the state of the sensor: parameters, pixel arrays, time and state of the random generator
+            Returns:
+                dict of scalars and arrays, see set_state and checkpoint.save_checkpoint
+        """
+        state = {name: getattr(self, name) for name in STATE_PARAMS}
+        for name in STATE_ARRAYS:
+            if getattr(self, name, None) is not None:
+                state[name] = np.array(getattr(self, name))
+        rng = np.random.get_state()
+        state['rng'] = {'name': rng[0], 'keys': rng[1], 'pos': rng[2], 'has_gauss': rng[3], 'cached_gaussian': rng[4]}
+        return state
+
+    def set_state(self, state):
+        """ Restore a state given by get_state, initCamera and the noise initialisation are not needed
+            The arrays are used as they are, so that the arrays of a checkpoint loaded with memory mapping
+            (copy-on-write) are only read when they are used.
+            Args:
+                state: dict given by get_state or checkpoint.load_checkpoint
+        """
+        for name in STATE_PARAMS:
+            setattr(self, name, state[name])
+        self.shape = tuple(self.shape)
+        self.m_bgn_pos_per = np.uint64(self.m_bgn_pos_per)
+        self.m_bgn_neg_per = np.uint64(self.m_bgn_neg_per)
+        self.prev_img_l = None
+        for name in STATE_ARRAYS:
+            if name in state:
+                # The pixels are updated through flat views of the arrays (see PixelSet)
+                setattr(self, name, np.ascontiguousarray(state[name]))
+        self.prev_img = None
+        self.prev_scale = None
+        self.busy_tiles = None
+        self.luts = {}
+        self.active_ratio = 1.0
+        if not hasattr(self, 'profiler'):
+            self.profiler = None
+        rng = state['rng']
+        np.random.set_state((rng['name'], np.asarray(rng['keys'], dtype=np.uint32), int(rng['pos']),
+                             int(rng['has_gauss']), float(rng['cached_gaussian'])))
+
+    def set_tile_skipping(self, tile_size=32, tol=1e-4):
+        """ Skip the static regions of the scene during the updates
+            The imager is divided into tiles of tile_size x tile_size pixels. A tile is active if one of its pixels
+            received a different input since the previous frame, or if at the end of the previous update one of its
+            pixels was in its refractory period, had not converged to its input yet (|log input - voltage| > tol) or
+            was about to cross a threshold. The pixels of the active tiles are gathered and only them are converted
+            and simulated, the other pixels are not touched: the cost of an update grows with the activity of the
+            scene rather than with the resolution. The input is still compared with the previous one and the noise
+            is still generated on the whole imager, with one comparison per pixel.
+            Args:
+                tile_size: size of the tiles (pixels), 0 to simulate every pixel at each update
+                tol: log difference under which a pixel has converged to its input
+        """
+        self.tile_size = int(tile_size)
+        self.tile_tol = tol
+        self.prev_img = None
+        self.busy_tiles = None
+
+    def get_active_pixels(self, img, scale=None):
+        """ Pixels of the tiles which have to be simulated during the update, see set_tile_skipping
+            Args:
+                img: new input image
+                scale: radiometric value of a greylevel of 1 of the image
+            Returns:
+                sorted indices of the pixels in the flattened imager, None if every pixel is simulated
+        """
+        self.active_ratio = 1.0
+        if self.tile_size <= 0:
+            return None
+        prev = self.prev_img
+        if prev is None or prev.shape != img.shape or prev.dtype != img.dtype or self.prev_scale != scale or \
+                self.busy_tiles is None or self.prev_img_l is None:
+            self.prev_img = np.array(img)
+            self.prev_scale = scale
+            return None
+        tiles = self.get_tiles(img != prev) | self.busy_tiles
+        np.copyto(prev, img)
+        n_active = np.count_nonzero(tiles)
+        self.active_ratio = n_active / tiles.size
+        if n_active == tiles.size:
+            return None
+        ts = self.tile_size
+        h, w = self.shape
+        ty, tx = np.nonzero(tiles)
+        rows = ty[:, None] * ts + np.arange(ts)
+        cols = tx[:, None] * ts + np.arange(ts)
+        flat = rows[:, :, None] * w + cols[:, None, :]
+        inside = (rows < h)[:, :, None] & (cols < w)[:, None, :]
+        return np.sort(flat[inside])
+
+    def get_tiles(self, mask):
+        """ Tiles containing at least one pixel of a boolean array of the shape of the imager """
+        h, w = self.shape
+        rows = np.logical_or.reduceat(mask, np.arange(0, h, self.tile_size), axis=0)
+        return np.logical_or.reduceat(rows, np.arange(0, w, self.tile_size), axis=1)
+
+    def set_busy_tiles(self, flat, img_l, lit):
+        """ Find the tiles to simulate at the next update even if their input does not change, see
+            set_tile_skipping
+            Args:
+                flat: pixels simulated during the update (see get_active_pixels), None for every pixel
+                img_l, lit: log input of these pixels and pixels whose input is > 0
+        """
+        px = PixelSet(self, flat)
+        # Change of voltage of the pixels which have converged to their input at the next update
+        dif = np.where(lit, img_l, 0) - px.last_v
+        busy = (lit & (np.abs(img_l - px.cur_v) > self.tile_tol)) | (px.cur_ref != np.iinfo(np.uint64).max) | \
+               (dif > px.cur_th_pos) | (dif < px.cur_th_neg)
+        if flat is None:
+            self.busy_tiles = self.get_tiles(busy.reshape(self.shape))
+            return
+        ts = self.tile_size
+        w = self.shape[1]
+        nw = -(-w // ts)
+        self.busy_tiles = np.zeros((-(-self.shape[0] // ts), nw), dtype=bool)
+        flat = flat[busy]
+        self.busy_tiles.reshape(-1)[(flat // w) // ts * nw + (flat % w) // ts] = True
+
+    def set_substeps(self, max_log_step=0.1, max_substeps=16):
+        """ Sub-step in time the pixels whose input changes quickly
+            A pixel whose log input changes by more than max_log_step between two frames is simulated in
+            max_substeps sub-steps, its input being interpolated linearly in the log domain between the two frames.
+            The events of fast motions are then generated as with a video of max_substeps times the frame rate,
+            without simulating the whole imager at this frame rate: the fast pixels are gathered once per frame and
+            only them are sub-stepped.
+            The latency of an event is counted from the beginning of the sub-step where the pixel crosses its
+            threshold, so the number of sub-steps sets the timing resolution of the events: fewer sub-steps than the
+            frame rate multiplier they approximate shift the events towards the beginning of the frames (see
+            benchmarks/validate.py). The pixels under max_log_step keep the timing of the frames.
+            Args:
+                max_log_step: log change of a frame above which a pixel is sub-stepped, 0 to disable the sub-steps
+                max_substeps: number of sub-steps of the fast pixels in a frame
+        """
+        self.max_log_step = max_log_step
+        self.max_substeps = max(1, int(max_substeps))
 
+    def set_profiling(self, enabled=True, max_frames=None):
+        """ Record the duration of the stages of each update and its counters, see profiling.FrameProfiler
+            Args:
+                enabled: False to remove the profiler
+                max_frames: number of frames kept, all of them if None
+            Returns:
+                FrameProfiler, None if disabled
+        """
+        self.profiler = FrameProfiler(max_frames) if enabled else None
+        return self.profiler
+
+    def get_fast_pixels(self, img_l, lit, flat=None):
+        """ Pixels which have to be sub-stepped during the update, see set_substeps
+            Args:
+                img_l: log value of the new input of the pixels simulated
+                lit: pixels simulated whose input is > 0, the only ones which can be sub-stepped
+                flat: pixels simulated (see get_active_pixels), None for every pixel
+            Returns:
+                positions of the fast pixels in img_l (None if there is none), and the number of sub-steps
+        """
+        if self.max_log_step <= 0 or self.max_substeps <= 1 or self.prev_img_l is None:
+            return None, 1
+        prev_l = self.prev_img_l.reshape(-1)
+        step = np.abs(img_l - (prev_l if flat is None else prev_l[flat]))
+        fast = np.flatnonzero(lit & (step > self.max_log_step))
+        if len(fast) == 0:
+            return None, 1
+        return fast, self.max_substeps
+
+    def get_luts(self, dtype, scale=None):
+        """ Lookup tables of the log conversion and of the time constants for uint8 and uint16 images
+            There are only 256 or 65536 greylevels: the log and the time constants of the pixels are read from tables
+            computed once for each type, scale and tau, instead of being computed for every pixel.
+            Args:
+                dtype: type of the images, np.uint8 or np.uint16
+                scale: radiometric value of a greylevel of 1 (1 if None)
+            Returns:
+                log_lut: log(greylevel * scale + 1)
+                tau_lut: time constant (us) of a pixel receiving greylevel * scale
+        """
+        scale = 1.0 if scale is None else float(scale)
+        key = (np.dtype(dtype).str, scale, self.tau)
+        if key not in self.luts:
+            flux = np.arange(np.iinfo(dtype).max + 1, dtype=np.double) * scale
+            self.luts[key] = (np.log(flux + 1), self.tau * 1e3 / (flux + 1))
+        return self.luts[key]
+
+    @traced('sensor')
     def check_noise(self, dt, img_l):
         """ Generate event packet of noise
             Check if the time at each pixel crossed a next noise event threshold during the update
@@ -211,10 +482,11 @@ class DvsSensor:
         pk_noise.sort()
         return pk_noise
 
+    @traced('sensor')
     def check_noise_hist(self, dt, img_l):
         """ Generate event packet of noise
             Check if the time at each pixel crossed a next noise event threshold during the update
-            This method uses a measured noise distribution for each pixel
+            This method uses measured noise distributions for each pixel (NOISE_MEASURE and NOISE_LUX)
             Args:
                   dt: delay between two updates (us)
                   img_l: logarithmic value of the input image
@@ -229,17 +501,13 @@ class DvsSensor:
             self.time_px[ind_pos_noise] = self.bgn_pos_next[ind_pos_noise]
             self.cur_v[ind_pos_noise] = img_l[ind_pos_noise]
             self.last_v[ind_pos_noise] = img_l[ind_pos_noise]
-            for i in range(0, len(ind_pos_noise[0]), 1):
-                self.bgn_pos_next[ind_pos_noise[0][i], ind_pos_noise[1][i]] += \
-                    self.get_next_noise(ind_pos_noise[1][i], ind_pos_noise[0][i], 1)
+            self.bgn_pos_next[ind_pos_noise] += self.get_next_noise_array(ind_pos_noise, 1, img_l)
         if len(ind_neg_noise[0]) > 0:
             pk_noise.add_array(self.bgn_neg_next[ind_neg_noise], ind_neg_noise[0], ind_neg_noise[1], 0)
             self.time_px[ind_neg_noise] = self.bgn_neg_next[ind_neg_noise]
             self.cur_v[ind_neg_noise] = img_l[ind_neg_noise]
             self.last_v[ind_neg_noise] = img_l[ind_neg_noise]
-            for i in range(0, len(ind_neg_noise[0]), 1):
-                self.bgn_neg_next[ind_neg_noise[0][i], ind_neg_noise[1][i]] += \
-                    self.get_next_noise(ind_neg_noise[1][i], ind_neg_noise[0][i], 0)
+            self.bgn_neg_next[ind_neg_noise] += self.get_next_noise_array(ind_neg_noise, 0, img_l)
         pk_noise.sort()
         return pk_noise
 
@@ -253,14 +521,42 @@ class DvsSensor:
                 the delay of the next noise event in us
         """
         val = np.random.uniform(0, 1)
-        pos = y * self.shape[0] + x
         if pol == 1:
-            ind = np.where(self.bgn_hist_pos[pos, :] >= val)
-            next = FREQ[ind[0][0]]
+            return draw_noise_delays(self.bgn_cdf_pos, self.bgn_id_pos[y, x], val)[0]
+        return draw_noise_delays(self.bgn_cdf_neg, self.bgn_id_neg[y, x], val)[0]
+
+    def get_next_noise_array(self, ind, pol, img_l):
+        """ Delays of the next noise events of several pixels, see get_next_noise
+            Args:
+                ind: coordinates (rows, columns) of the pixels
+                pol: polarity of the noise
+                img_l: log value of the input image, used by the NOISE_LUX model
+            Returns:
+                np.array of the delays in us
+        """
+        if pol == 1:
+            cdf, ids = self.bgn_cdf_pos, self.bgn_id_pos
         else:
-            ind = np.where(self.bgn_hist_neg[pos, :] >= val)
-            next = FREQ[ind[0][0]]
-        return np.uint64(1e6 / next)
+            cdf, ids = self.bgn_cdf_neg, self.bgn_id_neg
+        val = np.random.uniform(0, 1, len(ind[0]))
+        if self.noise_model == NOISE_LUX:
+            ind = (self.get_lux_level(img_l[ind]),) + tuple(ind)
+        return draw_noise_delays(cdf, ids[ind], val)
+
+    def get_lux_level(self, img_l):
+        """ Pick the noise distribution used by pixels in the NOISE_LUX model
+            One of the two levels surrounding the illumination of each pixel is picked, with a probability linear in
+            the log domain. The first and last levels are used below and above the measured illuminations.
+            Args:
+                img_l: log value of the input of the pixels
+            Returns:
+                np.array of the levels
+        """
+        if len(self.bgn_lux) == 1:
+            return np.zeros(len(img_l), dtype=int)
+        k = np.clip(np.searchsorted(self.bgn_lux, img_l) - 1, 0, len(self.bgn_lux) - 2)
+        w = np.clip((img_l - self.bgn_lux[k]) / (self.bgn_lux[k + 1] - self.bgn_lux[k]), 0, 1)
+        return k + (np.random.uniform(0, 1, len(img_l)) < w)
 
     def get_latency(self, time_end, last_v, cur_th, cur_v, img_l, time_px):
         """ Obtain the latency of the pixel
@@ -296,161 +592,295 @@ class DvsSensor:
         t_ev = np.random.normal(self.m_latency - tau_p*np.log(1 - amp), jit)
         return np.uint64(np.clip(t_ev, 0, 10000))
 
-    def update(self, img, dt):
-        """ Update the sensor with a nef irradiance's frame
-            Follow the ICNS model
+    @traced('sensor')
+    def _integrate(self, pk, px, img_l, lit, t_end, reset=False):
+        """ Generate the events of a set of pixels until t_end and update their voltages
             Args:
-                img: radiometric value in the focal plane
-                dt: delay between the frame and the last one (us)
-            Returns:
-                EventBuffer of the created events
-             """
-        if img.shape[1] != self.shape[1] or img.shape[0] != self.shape[0]:
-            print("Error: the size of the image doesn't match with the sensor ")
-            return
-
-        # Convert in the log domain
-        img_l = np.array(img, dtype=np.double)
-        ind = np.where(img > 0)
-        if len(ind[0]) == 0:
-            print("ERROR: update: flux image with only zeros")
-            return
-        img_l[ind] = np.log(img[ind] + 1)
-
-        # Update time constants - self.tau defined at 1 klux
-        self.tau_p[ind] = self.tau * 1e3 / (img[ind] + 1)
-
-        # Update refractory and reset pixels
-        ind_ref = np.where(self.cur_ref < self.time + dt)
-        px_delta_ref = np.array(self.cur_ref[ind_ref] - self.time, dtype=float)
-        if len(ind_ref[0]) > 0:
-            # Calculate voltage at the reset time (end of refractory period)
-            self.last_v[ind_ref] = self.cur_v[ind_ref] + (img_l[ind_ref] - self.cur_v[ind_ref]) * \
-                                (1 - np.exp(-px_delta_ref / self.tau_p[ind_ref]))
-            # End the refractory period
-            self.time_px[ind_ref] = self.cur_ref[ind_ref]
-            self.cur_ref[ind_ref] = np.iinfo(np.uint64).max
-            # And update the reference voltage for these pixels
-            self.cur_v[ind_ref] = self.last_v[ind_ref]
-
-        # Get noise events and reset pixels
-        if self.noise_model == NOISE_FREQ:
-            pk_noise = self.check_noise(dt, img_l)
-        else:
-            pk_noise = self.check_noise_hist(dt, img_l)
+                pk: EventBuffer receiving the events
+                px: PixelSet of the pixels simulated, its arrays are updated
+                img_l: log value of the input of the pixels
+                lit: pixels whose voltage follows the input (input > 0)
+                t_end: end of the integration (us)
+                reset: end the refractory periods finishing before t_end first
+        """
+        if reset:
+            ind_ref = np.flatnonzero(px.cur_ref < t_end)
+            if len(ind_ref) > 0:
+                px_delta_ref = np.array(px.cur_ref[ind_ref] - px.time_px[ind_ref], dtype=float)
+                px.last_v[ind_ref] = px.cur_v[ind_ref] + (img_l[ind_ref] - px.cur_v[ind_ref]) * \
+                                     (1 - np.exp(-px_delta_ref / px.tau_p[ind_ref]))
+                px.time_px[ind_ref] = px.cur_ref[ind_ref]
+                px.cur_ref[ind_ref] = np.iinfo(np.uint64).max
+                px.cur_v[ind_ref] = px.last_v[ind_ref]
 
         # Calculate voltage change at the end of the frame
-        px_delta_t = np.array(self.time + dt - self.time_px[ind], dtype=float)
-        target = np.zeros(img_l.shape) 
-        target[ind] = self.cur_v[ind] + (img_l[ind] - self.cur_v[ind]) * \
-                    (1 - np.exp(-px_delta_t / self.tau_p[ind]))  
-        dif = target - self.last_v
+        ind = np.flatnonzero(lit)
+        px_delta_t = np.array(t_end - px.time_px[ind], dtype=float)
+        target = np.zeros(len(px))
+        target[ind] = px.cur_v[ind] + (img_l[ind] - px.cur_v[ind]) * (1 - np.exp(-px_delta_t / px.tau_p[ind]))
+        dif = target - px.last_v
 
         # Check in which pixels the change is larger than the thresholds
-        ind_pos = np.where((dif > self.cur_th_pos) & (self.cur_ref == np.iinfo(np.uint64).max))
-        ind_neg = np.where((dif < self.cur_th_neg) & (self.cur_ref == np.iinfo(np.uint64).max))
+        idle = px.cur_ref == np.iinfo(np.uint64).max
+        ind_pos = np.flatnonzero((dif > px.cur_th_pos) & idle)
+        ind_neg = np.flatnonzero((dif < px.cur_th_neg) & idle)
 
         # Generate events for these pixels
-        pk = EventBuffer(0)
-        while len(ind_pos[0]) + len(ind_neg[0]) > 0:
-            pk.increase(len(ind_pos[0]) + len(ind_neg[0]))
+        rounds = 0
+        while len(ind_pos) + len(ind_neg) > 0:
+            rounds += 1
+            pk.increase(len(ind_pos) + len(ind_neg))
 
             # ON events
-            if len(ind_pos[0]) > 0:
+            if len(ind_pos) > 0:
                 # Get event times
                 # Use this for first order interpolation
                 t_event = self.get_latency_tau(
-                    self.last_v[ind_pos] + self.cur_th_pos[ind_pos], 
-                    self.cur_v[ind_pos], 
-                    img_l[ind_pos], 
-                    self.tau_p[ind_pos]
+                    px.last_v[ind_pos] + px.cur_th_pos[ind_pos],
+                    px.cur_v[ind_pos],
+                    img_l[ind_pos],
+                    px.tau_p[ind_pos]
                 )
                 # Or this for linear interpolation
-                # t_event = self.get_latency(self.time + dt, 
-                #                            self.last_v[ind_pos], 
-                #                            self.cur_th_pos[ind_pos], 
-                #                            self.cur_v[ind_pos], 
-                #                            img_l[ind_pos], 
-                #                            self.time_px[ind_pos]
+                # t_event = self.get_latency(t_end,
+                #                            px.last_v[ind_pos],
+                #                            px.cur_th_pos[ind_pos],
+                #                            px.cur_v[ind_pos],
+                #                            img_l[ind_pos],
+                #                            px.time_px[ind_pos]
                 # )
                 # Add to the event buffer
-                pk.add_array(self.time_px[ind_pos] + t_event, ind_pos[0], ind_pos[1], 1)
+                y, x = px.coords(ind_pos)
+                pk.add_array(px.time_px[ind_pos] + t_event, y, x, 1)
                 # Update the threshold with noise
-                self.cur_th_pos[ind_pos] = np.clip(
-                    np.random.normal(self.m_th_pos, self.m_th_noise, len(ind_pos[0])), 
-                    0, 
+                px.cur_th_pos[ind_pos] = np.clip(
+                    np.random.normal(self.m_th_pos, self.m_th_noise, len(ind_pos)),
+                    0,
                     1000
                 )
                 # Start the refractory period for those pixels that fired
-                self.cur_ref[ind_pos] = self.time_px[ind_pos] + t_event + self.ref
+                px.cur_ref[ind_pos] = px.time_px[ind_pos] + t_event + self.ref
 
             # OFF events
-            if len(ind_neg[0]) > 0:
+            if len(ind_neg) > 0:
                 # Get event times
                 # Use this for first order interpolation
                 t_event = self.get_latency_tau(
-                    self.last_v[ind_neg] + self.cur_th_neg[ind_neg], 
-                    self.cur_v[ind_neg], 
-                    img_l[ind_neg], 
-                    self.tau_p[ind_neg]
+                    px.last_v[ind_neg] + px.cur_th_neg[ind_neg],
+                    px.cur_v[ind_neg],
+                    img_l[ind_neg],
+                    px.tau_p[ind_neg]
                 )
                 # Or this for linear interpolation
-                # t_event = self.get_latency(self.time + dt, 
-                #                            self.last_v[ind_neg], 
-                #                            self.cur_th_neg[ind_neg], 
-                #                            self.cur_v[ind_neg], 
-                #                            img_l[ind_neg], 
-                #                            self.time_px[ind_neg]
+                # t_event = self.get_latency(t_end,
+                #                            px.last_v[ind_neg],
+                #                            px.cur_th_neg[ind_neg],
+                #                            px.cur_v[ind_neg],
+                #                            img_l[ind_neg],
+                #                            px.time_px[ind_neg]
                 # )
                 # Add to the event buffer
-                pk.add_array(self.time_px[ind_neg] + t_event, ind_neg[0], ind_neg[1], 0)
+                y, x = px.coords(ind_neg)
+                pk.add_array(px.time_px[ind_neg] + t_event, y, x, 0)
                 # Update the threshold with noise
-                self.cur_th_neg[ind_neg] = np.clip(
-                    np.random.normal(self.m_th_neg, self.m_th_noise, len(ind_neg[0])), 
-                    -1000, 
+                px.cur_th_neg[ind_neg] = np.clip(
+                    np.random.normal(self.m_th_neg, self.m_th_noise, len(ind_neg)),
+                    -1000,
                     0
                 )
                 # Start the refractory period for those pixels that fired
-                self.cur_ref[ind_neg] = self.time_px[ind_neg] + t_event + self.ref
+                px.cur_ref[ind_neg] = px.time_px[ind_neg] + t_event + self.ref
 
             # Check if any of these refractory periods finish before the end of the frame
-            ind_ref = np.where(self.cur_ref < self.time + dt)
-            px_delta_ref = np.array(self.cur_ref[ind_ref]-self.time_px[ind_ref], dtype=float)
-            if len(ind_ref[0]) > 0:
+            ind_ref = np.flatnonzero(px.cur_ref < t_end)
+            if len(ind_ref) > 0:
                 # Calculate voltage at the reset time (end of refractory period)
-                self.last_v[ind_ref] = self.cur_v[ind_ref] + (img_l[ind_ref] - self.cur_v[ind_ref]) * \
-                                       (1 - np.exp(-px_delta_ref / self.tau_p[ind_ref]))
+                px_delta_ref = np.array(px.cur_ref[ind_ref] - px.time_px[ind_ref], dtype=float)
+                px.last_v[ind_ref] = px.cur_v[ind_ref] + (img_l[ind_ref] - px.cur_v[ind_ref]) * \
+                                     (1 - np.exp(-px_delta_ref / px.tau_p[ind_ref]))
                 # End the refractory period
-                self.time_px[ind_ref] = self.cur_ref[ind_ref]
-                self.cur_ref[ind_ref] = np.iinfo(np.uint64).max
+                px.time_px[ind_ref] = px.cur_ref[ind_ref]
+                px.cur_ref[ind_ref] = np.iinfo(np.uint64).max
                 # And update the reference voltage for these pixels
-                self.cur_v[ind_ref] = self.last_v[ind_ref]
-
-            # Now check if there are any new threshold crossings since the previous event
-            dif = np.zeros((self.shape[0], self.shape[1]))
-            px_delta_ref = np.array(self.time + dt - self.time_px[ind_ref], dtype=float)
-            target[ind_ref] = self.cur_v[ind_ref] + (img_l[ind_ref] - self.cur_v[ind_ref]) * \
-                                (1 - np.exp(-px_delta_ref / self.tau_p[ind_ref]))
-            dif[ind_ref] = target[ind_ref] - self.last_v[ind_ref]
-            ind_pos = np.where(dif > self.cur_th_pos)
-            ind_neg = np.where(dif < self.cur_th_neg)
+                px.cur_v[ind_ref] = px.last_v[ind_ref]
+
+            # Now check if there are any new threshold crossings since the previous event, only the pixels whose
+            # refractory period ended can cross
+            px_delta_ref = np.array(t_end - px.time_px[ind_ref], dtype=float)
+            target[ind_ref] = px.cur_v[ind_ref] + (img_l[ind_ref] - px.cur_v[ind_ref]) * \
+                              (1 - np.exp(-px_delta_ref / px.tau_p[ind_ref]))
+            dif = target[ind_ref] - px.last_v[ind_ref]
+            ind_pos = ind_ref[dif > px.cur_th_pos[ind_ref]]
+            ind_neg = ind_ref[dif < px.cur_th_neg[ind_ref]]
             # Repeat this loop until no more threshold crossings are found
+        if self.profiler is not None:
+            self.profiler.count('rounds', rounds)
 
         # Update pixel voltages at end of frame
-        px_delta_t = np.array(self.time + dt - self.time_px[ind], dtype=float)
-        self.cur_v[ind] = self.cur_v[ind] + (img_l[ind] - self.cur_v[ind]) * \
-                                (1 - np.exp(-px_delta_t / self.tau_p[ind]))
+        px_delta_t = np.array(t_end - px.time_px[ind], dtype=float)
+        px.cur_v[ind] = px.cur_v[ind] + (img_l[ind] - px.cur_v[ind]) * (1 - np.exp(-px_delta_t / px.tau_p[ind]))
+
+    @traced('sensor')
+    def update(self, img, dt, scale=None):
+        """ Update the sensor with a nef irradiance's frame
+            Follow the ICNS model
+            Only the pixels of the active tiles are simulated (see set_tile_skipping) and the fast pixels are
+            sub-stepped (see set_substeps): their state is gathered into compact arrays (see PixelSet), so that
+            the cost of an update follows the number of pixels simulated.
+            Args:
+                img: radiometric value in the focal plane
+                dt: delay between the frame and the last one (us)
+                scale: radiometric value of a greylevel of 1 (1 if None). uint8 and uint16 images are converted
+                       with lookup tables, see get_luts
+            Returns:
+                EventBuffer of the created events
+             """
+        if img.shape[1] != self.shape[1] or img.shape[0] != self.shape[0]:
+            print("Error: the size of the image doesn't match with the sensor ")
+            return
+        prof = self.profiler
+        if prof is not None:
+            prof.start(self.time, dt)
+
+        # Pixels simulated: the pixels of the active tiles, every pixel if None
+        flat = self.get_active_pixels(img, scale)
+        img_px = img.reshape(-1)
+        if flat is not None:
+            img_px = img_px[flat]
+        if self.tile_size > 0:
+            # The pixels of the inactive tiles have converged to their input and their time is not updated, the
+            # pixels simulated restart from the beginning of the frame
+            self.time_px.reshape(-1)[slice(None) if flat is None else flat] = self.time
+
+        if prof is not None:
+            prof.stage('tiles')
+
+        # Convert in the log domain
+        if is_lut_image(img):
+            log_lut, tau_lut = self.get_luts(img.dtype, scale)
+            lit = img_px > 0
+            if flat is None and not lit.any():
+                print("ERROR: update: flux image with only zeros")
+                return
+            img_l = log_lut[img_px]
+            # Update time constants - self.tau defined at 1 klux
+            tau_px = tau_lut[img_px[lit]]
+        else:
+            if scale is not None:
+                img_px = img_px * scale
+            img_l = np.array(img_px, dtype=np.double)
+            lit = img_px > 0
+            if flat is None and not lit.any():
+                print("ERROR: update: flux image with only zeros")
+                return
+            img_l[lit] = np.log(img_px[lit] + 1)
+
+            # Update time constants - self.tau defined at 1 klux
+            tau_px = self.tau * 1e3 / (img_px[lit] + 1)
+        self.tau_p.reshape(-1)[np.flatnonzero(lit) if flat is None else flat[lit]] = tau_px
+
+        # Find the fast pixels, then keep the log input for the noise and the next update
+        fast, n_sub = self.get_fast_pixels(img_l, lit, flat)
+        if fast is not None:
+            fast_flat = fast if flat is None else flat[fast]
+            prev_l = self.prev_img_l.reshape(-1)[fast_flat]
+        if flat is None:
+            self.prev_img_l = img_l.reshape(self.shape)
+        else:
+            self.prev_img_l.reshape(-1)[flat] = img_l
+
+        if prof is not None:
+            prof.stage('convert')
+
+        # Update refractory and reset pixels
+        t_frame = self.time + dt
+        cur_ref = self.cur_ref.reshape(-1)
+        ended = (cur_ref if flat is None else cur_ref[flat]) < t_frame
+        if fast is not None:
+            ended[fast] = False
+        ind_ref = np.flatnonzero(ended) if flat is None else flat[ended]
+        if len(ind_ref) > 0:
+            last_v, cur_v = self.last_v.reshape(-1), self.cur_v.reshape(-1)
+            img_ref = self.prev_img_l.reshape(-1)[ind_ref]
+            px_delta_ref = np.array(cur_ref[ind_ref] - self.time, dtype=float)
+            # Calculate voltage at the reset time (end of refractory period)
+            last_v[ind_ref] = cur_v[ind_ref] + (img_ref - cur_v[ind_ref]) * \
+                              (1 - np.exp(-px_delta_ref / self.tau_p.reshape(-1)[ind_ref]))
+            # End the refractory period
+            self.time_px.reshape(-1)[ind_ref] = cur_ref[ind_ref]
+            cur_ref[ind_ref] = np.iinfo(np.uint64).max
+            # And update the reference voltage for these pixels
+            cur_v[ind_ref] = last_v[ind_ref]
+
+        if prof is not None:
+            prof.stage('refractory')
+
+        # Get noise events and reset pixels
+        if self.noise_model == NOISE_FREQ:
+            pk_noise = self.check_noise(dt, self.prev_img_l)
+        else:
+            pk_noise = self.check_noise_hist(dt, self.prev_img_l)
+
+        if prof is not None:
+            prof.stage('noise')
+
+        pk = EventBuffer(0)
+        if fast is not None:
+            # Fast pixels reset by noise are reset to the new input, they are not sub-stepped: as the other pixels,
+            # their refractory period ends if it finishes during the frame, and goes on otherwise
+            noisy = self.time_px.reshape(-1)[fast_flat] != self.time
+            if noisy.any():
+                ind_ref = fast_flat[noisy]
+                cur_ref[ind_ref[cur_ref[ind_ref] < t_frame]] = np.iinfo(np.uint64).max
+                fast, fast_flat, prev_l = fast[~noisy], fast_flat[~noisy], prev_l[~noisy]
+            # Sub-step the fast pixels, with an input interpolated in the log domain. They reach the end of the
+            # frame without pending crossing, so that integrating them again until the end of the frame with the
+            # other pixels leaves them as they are
+            px = PixelSet(self, fast_flat)
+            on = np.ones(len(px), dtype=bool)
+            for k in range(1, n_sub + 1):
+                img_k = prev_l + (img_l[fast] - prev_l) * (k / n_sub)
+                px.tau_p[:] = self.tau * 1e3 * np.exp(-img_k)
+                t_end = self.time + (dt * k) // n_sub
+                self._integrate(pk, px, img_k, on, t_end, reset=True)
+                px.time_px[:] = t_end
+            px.scatter(self)
+            if prof is not None:
+                prof.count('n_substeps', n_sub)
+                prof.count('n_fast', len(fast))
+        if prof is not None:
+            prof.stage('substeps')
+
+        px = PixelSet(self, flat)
+        self._integrate(pk, px, img_l, lit, t_frame)
+        px.scatter(self)
+        if prof is not None:
+            prof.stage('integrate')
 
         # Update simulation time
         self.time += dt
-        self.time_px[:] = self.time
+        if flat is None:
+            self.time_px[:] = self.time
+        else:
+            self.time_px.reshape(-1)[flat] = self.time
+        if self.tile_size > 0:
+            self.set_busy_tiles(flat, img_l, lit)
+            if prof is not None:
+                prof.stage('tiles')
 
         # Merge noise and signal events and sort by time
         pk_end = EventBuffer(0)
         pk_end.merge(pk, pk_noise)
         pk_end.sort()
-        
-        return pk_end
-
-
+        if prof is not None:
+            prof.stage('merge')
+            n_on = int(np.count_nonzero(pk.p[:pk.i]))
+            n_noise_on = int(np.count_nonzero(pk_noise.p[:pk_noise.i]))
+            prof.count('signal_on', n_on)
+            prof.count('signal_off', pk.i - n_on)
+            prof.count('noise_on', n_noise_on)
+            prof.count('noise_off', pk_noise.i - n_noise_on)
+            prof.set('active_ratio', self.active_ratio)
+            prof.end()
 
+        return pk_end
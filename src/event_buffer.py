@@ -1,6 +1,7 @@
 import numpy
 import numpy as np
 from dat_files import write_event_dat
+from tracing import traced
 
 
 class EventBuffer():
@@ -55,6 +56,22 @@ class EventBuffer():
         self.p = p
         self.ts = ts
 
+    def get_state(self):
+        """ Copy of the buffer, see set_state
+            The whole arrays are kept, not only the first i events, since remove_row looks at all of them.
+        """
+        return {'ts': self.ts.copy(), 'x': self.x.copy(), 'y': self.y.copy(), 'p': self.p.copy(), 'i': self.i}
+
+    def set_state(self, state):
+        """ Replace the content of the buffer by the one given by get_state """
+        n = len(state['ts'])
+        self.__init__(n)
+        self.ts[:n] = state['ts']
+        self.x[:n] = state['x']
+        self.y[:n] = state['y']
+        self.p[:n] = state['p']
+        self.i = int(state['i'])
+
     def remove_time(self, t_min, t_max):
         """
             Only keep events between t_min and t_max
@@ -105,6 +122,7 @@ class EventBuffer():
         self.p = np.delete(self.p, ind)
         self.i -= ind[0].shape[0]
 
+    @traced('event_buffer')
     def increase_ev(self, ev):
         """ Extend the event buffer with another event buffer
             If ev can be inserted into self, ev inserted, if not, increase the size of a buffer to original
@@ -152,6 +170,7 @@ class EventBuffer():
             self.p[i1] = ep.p[i2]
             self.i = i1 + 1
 
+    @traced('event_buffer')
     def merge(self, ep1, ep2):
         """ Resize the EventBuffer and merge into the two EventBuffers ep1 nd ep2, sorted by their timestamps
             Args:
@@ -176,6 +195,7 @@ class EventBuffer():
                     i2 += 1
         self.i = ep1.i + ep2.i
 
+    @traced('event_buffer')
     def sort(self):
         """ Sort the EventBuffer according to its timestamp """
         ind = np.argsort(self.ts[:self.i])
@@ -219,6 +239,7 @@ class EventBuffer():
             self.p[self.i:self.i + s] = p
             self.i += s
 
+    @traced('event_buffer')
     def write(self, filename, width=None, height=None):
         """ Write the events into a .dat file
             Args:
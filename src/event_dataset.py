@@ -0,0 +1,208 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from dat_files import load_dat_index, read_dat_header, memmap_dat_event, decode_dat_records
+from representations import TimeSurface, count_image, voxel_grid
+
+# Representations of the windows
+REPR_EVENTS = None           # Events (ts, x, y, p)
+REPR_COUNT = 'count'         # Count images (2, height, width), see representations.count_image
+REPR_VOXEL = 'voxel'         # Voxel grids (n_bins, height, width), see representations.voxel_grid
+REPR_TIMESURFACE = 'timesurface'  # Time surfaces (2, height, width) at the end of the window, see TimeSurface
+
+_worker = {}  # State of the loading processes
+
+
+class EventDataset():
+    """ Windows of events of a directory of .dat files
+        The windows have a fixed duration (window_us) or a fixed number of records (window_n). They are found
+        with the sidecar index of each file (built if it does not exist, see load_dat_index) and read from the
+        memory-mapped files: only the records of a window are read. The windows can be accessed randomly or
+        loaded in the background by a pool of processes:
+
+            dataset = EventDataset("outputs/", window_us=50000, representation=REPR_VOXEL, n_bins=5)
+            x = dataset[12]
+            for x in dataset.iterate(shuffle=True, n_workers=4):
+                ...
+
+        A window is (number of the file, start), the start being a timestamp (us) for windows of fixed duration
+        and the number of the first record for windows of fixed number of records.
+    """
+    # filenames = []           # Paths of the .dat files
+    # indexes = []             # DatIndex of each file
+    # window_us = None         # Duration of the windows (us)
+    # window_n = None          # Number of records of the windows, if window_us is None
+    # width = 0                # Width of the sensor
+    # height = 0               # Height of the sensor
+    # representation = None    # Representation of the windows: REPR_EVENTS, REPR_COUNT, REPR_VOXEL or REPR_TIMESURFACE
+    # transform = None         # Function applied to the windows after the representation
+    # windows = np.zeros((0, 2), np.int64)  # Consecutive windows of all the files: number of the file and start
+
+    def __init__(self, path, window_us=None, window_n=None, representation=REPR_EVENTS, n_bins=5, tau=None,
+                 transform=None, width=None, height=None, extension='.dat'):
+        """ Index the files of the dataset
+            Args:
+                path: directory of the .dat files, or list of paths of .dat files
+                window_us: duration of the windows (us)
+                window_n: number of records of the windows, if window_us is None. The epoch markers of the files
+                          are records, a window containing one has one event less
+                representation: REPR_EVENTS, REPR_COUNT, REPR_VOXEL or REPR_TIMESURFACE
+                n_bins: number of temporal bins of the voxel grids
+                tau: decay of the time surfaces (us), a third of the window if None
+                transform: function applied to each window after the representation, e.g. normalisation
+                width, height: size of the sensor, read from the headers of the files if None
+                extension: extension of the files of the directory
+        """
+        if window_us is None and window_n is None:
+            raise ValueError("window_us or window_n has to be given")
+        if isinstance(path, str):
+            self.filenames = sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(extension))
+        else:
+            self.filenames = list(path)
+        if len(self.filenames) == 0:
+            raise IOError("No {} file in {}".format(extension, path))
+        self.window_us = None if window_us is None else int(window_us)
+        self.window_n = None if window_n is None else int(window_n)
+        self.representation = representation
+        self.n_bins = n_bins
+        self.tau = tau
+        self.transform = transform
+        self.indexes = [load_dat_index(f, build=True) for f in self.filenames]
+        self.width = self.indexes[0].width if width is None else width
+        self.height = self.indexes[0].height if height is None else height
+        if representation is not REPR_EVENTS and (self.width is None or self.height is None):
+            raise ValueError("The size of the sensor is not in the header of {}".format(self.filenames[0]))
+        windows = []
+        for i, index in enumerate(self.indexes):
+            if index.n_events == 0:
+                continue
+            if self.window_us is not None:
+                starts = np.arange(index.t_first, index.t_last + 1, self.window_us, dtype=np.int64)
+            else:
+                starts = np.arange(0, index.n_events - self.window_n + 1, self.window_n, dtype=np.int64)
+            windows.append(np.stack([np.full(len(starts), i, dtype=np.int64), starts], axis=1))
+        self.windows = np.concatenate(windows) if len(windows) > 0 else np.zeros((0, 2), dtype=np.int64)
+        self._files = {}
+
+    def __len__(self):
+        return len(self.windows)
+
+    def __getitem__(self, k):
+        return self.load(*self.windows[k])
+
+    def __getstate__(self):
+        # The memory maps are opened again by each process
+        state = self.__dict__.copy()
+        state['_files'] = {}
+        return state
+
+    def random_windows(self, n, seed=None):
+        """ Windows starting anywhere in the files
+            The files are drawn proportionally to their duration (or number of records).
+            Args:
+                n: number of windows
+                seed: seed of the draws, the global generator if None
+            Returns:
+                array (n, 2) of windows, for load or iterate
+        """
+        rng = np.random if seed is None else np.random.RandomState(seed)
+        if self.window_us is not None:
+            lo = np.array([index.t_first for index in self.indexes], dtype=np.int64)
+            hi = np.array([index.t_last + 1 - self.window_us for index in self.indexes], dtype=np.int64)
+            weight = np.array([index.t_last + 1 - index.t_first if index.n_events > 0 else 0
+                               for index in self.indexes], dtype=float)
+        else:
+            lo = np.zeros(len(self.indexes), dtype=np.int64)
+            hi = np.array([index.n_events - self.window_n for index in self.indexes], dtype=np.int64)
+            weight = np.where(hi >= 0, [index.n_events for index in self.indexes], 0).astype(float)
+        if weight.sum() == 0:
+            raise ValueError("No window in the dataset")
+        files = rng.choice(len(self.indexes), size=n, p=weight / weight.sum())
+        starts = lo[files] + (rng.uniform(0, 1, n) * (np.maximum(hi[files], lo[files]) - lo[files] + 1)).astype(np.int64)
+        return np.stack([files, starts], axis=1)
+
+    def load(self, i, start):
+        """ Load a window
+            Args:
+                i: number of the file
+                start: first timestamp (us) of the window, or number of its first record if window_us is None
+            Returns:
+                the window in its representation, after transform
+        """
+        filename = self.filenames[i]
+        if filename not in self._files:
+            header = read_dat_header(filename)
+            self._files[filename] = (header, memmap_dat_event(filename, header))
+        header, data = self._files[filename]
+        index = self.indexes[i]
+        if self.window_us is not None:
+            t_start, t_stop = int(start), int(start) + self.window_us
+            i_start, i_stop = index.event_range(t_start, t_stop, data)
+            ev = decode_dat_records(np.array(data[i_start:i_stop]), header['version'], t_start)
+        else:
+            i_start, i_stop = int(start), int(start) + self.window_n
+            # Timestamp of an earlier record to unwrap the timestamps of the window
+            prev_ts = int(index.block_ts[i_start // index.every_n]) if len(index.block_ts) > 0 else None
+            ev = decode_dat_records(np.array(data[i_start:i_stop]), header['version'], prev_ts)
+            t_start = int(ev[0][0]) if len(ev[0]) > 0 else 0
+            t_stop = int(ev[0][-1]) + 1 if len(ev[0]) > 0 else 0
+        sample = self._represent(ev, t_start, t_stop)
+        return sample if self.transform is None else self.transform(sample)
+
+    def iterate(self, windows=None, shuffle=False, seed=None, n_workers=0, windows_per_task=8):
+        """ Load windows in order, in the background by a pool of processes
+            Args:
+                windows: array (n, 2) of windows, all the consecutive windows of the dataset if None
+                shuffle: load the windows in a random order
+                seed: seed of the shuffling, the global generator if None
+                n_workers: number of processes, 0 to load in the calling process
+                windows_per_task: number of windows loaded by a task
+            Yields:
+                windows in their representation, after transform
+        """
+        windows = self.windows if windows is None else np.asarray(windows, dtype=np.int64)
+        if shuffle:
+            rng = np.random if seed is None else np.random.RandomState(seed)
+            windows = windows[rng.permutation(len(windows))]
+        tasks = [windows[k:k + windows_per_task] for k in range(0, len(windows), windows_per_task)]
+        if n_workers <= 0:
+            for task in tasks:
+                for i, start in task:
+                    yield self.load(i, start)
+            return
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(self,)) as pool:
+            pending = deque()
+            for task in tasks:
+                pending.append(pool.submit(_load_task, task))
+                if len(pending) >= 2 * n_workers:
+                    for sample in pending.popleft().result():
+                        yield sample
+            while len(pending) > 0:
+                for sample in pending.popleft().result():
+                    yield sample
+
+    def _represent(self, ev, t_start, t_stop):
+        """ Representation of the events of a window """
+        if self.representation is REPR_EVENTS:
+            return ev
+        if self.representation == REPR_COUNT:
+            return count_image(ev, self.width, self.height)
+        if self.representation == REPR_VOXEL:
+            return voxel_grid(ev, self.width, self.height, self.n_bins, t_start, t_stop)
+        if self.representation == REPR_TIMESURFACE:
+            surface = TimeSurface(self.width, self.height, (t_stop - t_start) / 3 if self.tau is None else self.tau)
+            surface.update(ev)
+            return surface.render(t_stop)
+        raise ValueError("Unknown representation {}".format(self.representation))
+
+
+def _init_worker(dataset):
+    """ Keep the dataset in the process, its files are mapped once per process """
+    _worker['dataset'] = dataset
+
+
+def _load_task(windows):
+    """ Load windows of the dataset """
+    dataset = _worker['dataset']
+    return [dataset.load(i, start) for i, start in windows]
@@ -1,5 +1,7 @@
+import threading
 import numpy as np
 import cv2
+from tracing import get_tracer, traced
 
 
 class EventDisplay():
@@ -14,15 +16,28 @@ class EventDisplay():
     render = 0  # 0: binary image, 1: ts
     render_tau = 40000  # tau decay of the time surface (us)
     display_time = True
+    threaded = False  # Render and show the frames in a separate thread
+    headless = False  # Do not open a window, the frames are only given to on_frame
+    on_frame = None  # Function called with each rendered frame and its time (us)
+    dropped = 0  # Number of frames dropped because the display thread was late
+    shown = False  # A window was opened to show a frame
 
-    def __init__(self, name, dx, dy, frametime, render=0):
+    def __init__(self, name, dx, dy, frametime, render=0, threaded=False, headless=False, on_frame=None):
         """ Initialize the Display by reseting the internal timer of the structure and providing the right size of
             buffers
+            With threaded=True, update only copies the surfaces into a mailbox holding the latest snapshot, and a
+            display thread renders and shows it: a snapshot which was not displayed before the next one is dropped,
+            so the display never slows the simulation down. The windows of OpenCV may have to stay in the main
+            thread on some platforms (macOS). With headless=True, no window is opened and the frames are only
+            rendered if on_frame is given.
             Args:
                 name: name of the windows
                 dy dx: size of the data
                 frametime: delay between two frames (us)
                 render: rendering method: 0 = binary, 1 = timesurface
+                threaded: render and show the frames in a separate thread
+                headless: do not open a window
+                on_frame: function called with each rendered frame (BGR image) and its time (us)
             """
         self.name = name
         self.time = 0
@@ -33,6 +48,21 @@ class EventDisplay():
         self.im = np.zeros((int(dy), int(dx), 3), dtype=np.uint8)
         self.render = 0
         self.render_tau = 3 * frametime
+        self.threaded = threaded
+        self.headless = headless
+        self.on_frame = on_frame
+        self.dropped = 0
+        self.shown = False
+        self.thread = None
+        if threaded:
+            # Snapshots of (time, time surface, polarity surface): one being written, one waiting in the mailbox and
+            # one being displayed
+            self.free = [(0, self.time_surface.copy(), self.pol_surface.copy()) for _ in range(3)]
+            self.mailbox = None
+            self.closing = False
+            self.cond = threading.Condition()
+            self.thread = threading.Thread(target=self._run, name="EventDisplay", daemon=True)
+            self.thread.start()
 
     def reset(self):
         """ Reset timers and buffers to 0 """
@@ -41,6 +71,7 @@ class EventDisplay():
         self.time_surface[:] = 0
         self.pol_surface[:] = 0
 
+    @traced('display')
     def update(self, pk, dt):
         """  During the time dt, the EventBuffer was created. This function adds these events to the structure and
             triggers a display if needed
@@ -54,17 +85,82 @@ class EventDisplay():
         self.last_frame += dt
         if self.last_frame > self.frametime:
             self.last_frame = 0
-            self.im[:] = 125
-            if self.render == 0:
-                ind = np.where((self.time_surface > self.time - self.frametime) & (self.time_surface <= self.time))
-                self.im[:, :, 0][ind] = self.pol_surface[ind]*255
-                self.im[:, :, 1][ind] = self.pol_surface[ind]*255
-                self.im[:, :, 2][ind] = self.pol_surface[ind]*255
-            if self.render == 1:
-                self.im[:, :, 0] = (self.pol_surface * 2 - 1) * 125 * np.exp(-(self.time - self.time_surface.astype(np.double)) / self.render_tau)
-            if self.display_time: self.im = cv2.putText(self.im, '{} s'.format(self.time / 1e6), (0, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 255))
-            cv2.imshow(self.name, self.im)
-            cv2.waitKey(10)
+            if self.headless and self.on_frame is None:
+                return
+            if self.threaded:
+                self._post()
+            else:
+                self._show(self.render_frame(self.time_surface, self.pol_surface, self.time), self.time, 10)
 
+    @traced('display')
+    def render_frame(self, time_surface, pol_surface, time):
+        """ Render the surfaces into self.im
+            Args:
+                time_surface: timestamp of the last event of each pixel (us)
+                pol_surface: polarity of the last event of each pixel
+                time: time of the frame (us)
+            Returns:
+                the rendered image
+        """
+        self.im[:] = 125
+        if self.render == 0:
+            ind = np.where((time_surface > time - self.frametime) & (time_surface <= time))
+            self.im[:, :, 0][ind] = pol_surface[ind]*255
+            self.im[:, :, 1][ind] = pol_surface[ind]*255
+            self.im[:, :, 2][ind] = pol_surface[ind]*255
+        if self.render == 1:
+            self.im[:, :, 0] = (pol_surface * 2 - 1) * 125 * np.exp(-(time - time_surface.astype(np.double)) / self.render_tau)
+        if self.display_time: self.im = cv2.putText(self.im, '{} s'.format(time / 1e6), (0, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 255))
+        return self.im
+
+    def close(self):
+        """ Stop the display thread and close the window """
+        if self.thread is not None:
+            with self.cond:
+                self.closing = True
+                self.cond.notify()
+            self.thread.join()
+            self.thread = None
+        if self.shown:
+            cv2.destroyWindow(self.name)
+            self.shown = False
+
+    @traced('display')
+    def _show(self, im, time, wait):
+        """ Give a rendered frame to on_frame and show it """
+        if self.on_frame is not None:
+            self.on_frame(im, time)
+        if not self.headless:
+            cv2.imshow(self.name, im)
+            self.shown = True
+            cv2.waitKey(wait)
 
+    def _post(self):
+        """ Copy the surfaces into a free snapshot and put it into the mailbox, dropping the one waiting there """
+        with self.cond:
+            snapshot = self.free.pop()
+        np.copyto(snapshot[1], self.time_surface)
+        np.copyto(snapshot[2], self.pol_surface)
+        with self.cond:
+            if self.mailbox is not None:
+                self.free.append(self.mailbox)
+                self.dropped += 1
+                tracer = get_tracer()
+                if tracer is not None:
+                    tracer.instant('EventDisplay.dropped', 'display')
+            self.mailbox = (self.time, snapshot[1], snapshot[2])
+            self.cond.notify()
 
+    def _run(self):
+        """ Display thread: render and show the latest snapshot of the mailbox """
+        while True:
+            with self.cond:
+                while self.mailbox is None and not self.closing:
+                    self.cond.wait()
+                if self.mailbox is None:
+                    return
+                snapshot = self.mailbox
+                self.mailbox = None
+            self._show(self.render_frame(snapshot[1], snapshot[2], snapshot[0]), snapshot[0], 1)
+            with self.cond:
+                self.free.append(snapshot)
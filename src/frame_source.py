@@ -0,0 +1,368 @@
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+from tracing import traced
+
+# Conversion of the decoded frames into a single channel
+CONVERT_GRAY = 'gray'  # cv2.COLOR_BGR2GRAY
+CONVERT_LUV = 'luv'    # L channel of cv2.COLOR_RGB2LUV, as in examples/00_video_2_events
+CONVERT_NONE = None    # The frames already have a single channel
+
+IRRADIANCE_SCALE = 1e4 / 255.0  # Greylevel 255 = 1e4, representing 10 klux
+
+# Interpolation of intermediate frames
+INTERP_LOG = 'log'    # Linear in the log domain
+INTERP_FLOW = 'flow'  # Motion-compensated with the Farneback optical flow
+
+
+class FrameSource():
+    """ Source of irradiance frames decoded in the background
+        Frames are decoded and converted to irradiance by worker threads into a bounded pool of preallocated
+        buffers, so that the sensor does not wait for the decoding of the next frame. Iterating over the source
+        returns the frames in order:
+
+            source = VideoSource("video.mp4")
+            dvs.init_image(next(source))
+            for im in source:
+                ev = dvs.update(im, dt)
+
+        A frame is only valid until the next one is requested, its buffer is then reused: copy it to keep it.
+        With scale=None and dtype=np.uint8 (or np.uint16), the greylevels are returned as they are and the sensor
+        converts them with lookup tables: dvs.update(im, dt, scale=IRRADIANCE_SCALE).
+        Subclasses implement _items() and _decode().
+    """
+    # width = 0              # Width of the frames
+    # height = 0             # Height of the frames
+    # convert = 'gray'       # Conversion of the decoded frames into a single channel
+    # scale = 1e4 / 255      # Irradiance of a greylevel of 1
+    # n_frames = 0           # Number of frames returned so far
+
+    def __init__(self, width, height, convert=CONVERT_GRAY, scale=IRRADIANCE_SCALE, dtype=np.float64,
+                 n_buffers=None, n_workers=1, prefetch=True):
+        """ Initialise the buffers of the source, the decoding starts at the first frame requested
+            Args:
+                width, height: size of the frames
+                convert: 'gray', 'luv' or None, conversion of the decoded frames into a single channel
+                scale: irradiance of a greylevel of 1, None to copy the greylevels as they are
+                dtype: type of the frames, e.g. np.uint8 with scale=None
+                n_buffers: number of preallocated frames, n_workers + 2 if None
+                n_workers: number of threads decoding frames concurrently, if the source allows it
+                prefetch: decode in the background, if False frames are decoded when they are requested
+        """
+        self.width = int(width)
+        self.height = int(height)
+        self.convert = convert
+        self.scale = scale
+        self.dtype = np.dtype(dtype)
+        self.n_workers = max(1, n_workers)
+        self.n_buffers = self.n_workers + 2 if n_buffers is None else max(n_buffers, self.n_workers + 1)
+        self.prefetch = prefetch
+        self.n_frames = 0
+        self.buffers = [np.zeros((self.height, self.width), dtype=self.dtype) for _ in range(self.n_buffers)]
+        self.free = queue.Queue()
+        self.filled = queue.Queue()
+        for buf in self.buffers:
+            self.free.put(buf)
+        self.current = None
+        self.thread = None
+        self.items = None
+        self.closing = False
+        self.done = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    @traced('source')
+    def __next__(self):
+        """ Return the next irradiance frame, the previous one is given back to the pool """
+        if self.done:
+            raise StopIteration
+        if self.current is not None:
+            self.free.put(self.current)
+            self.current = None
+        if not self.prefetch:
+            return self._next_sync()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+            self.thread.start()
+        buf = self.filled.get()
+        if isinstance(buf, Exception):
+            self.done = True
+            raise buf
+        if buf is None:
+            self.done = True
+            raise StopIteration
+        self.current = buf
+        self.n_frames += 1
+        return buf
+
+    def close(self):
+        """ Stop the decoding and release the source """
+        self.closing = True
+        self.done = True
+        self.free.put(None)
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self._release()
+
+    def _next_sync(self):
+        """ Decode the next frame in the calling thread """
+        if self.items is None:
+            self.items = iter(self._items())
+        try:
+            item = next(self.items)
+        except StopIteration:
+            self.done = True
+            raise
+        buf = self.free.get()
+        self._load(item, buf)
+        self.current = buf
+        self.n_frames += 1
+        return buf
+
+    def _run(self):
+        """ Worker thread: decode the frames into free buffers, with a pool of threads if n_workers > 1 """
+        pool = ThreadPoolExecutor(max_workers=self.n_workers) if self.n_workers > 1 else None
+        pending = deque()
+        try:
+            for item in self._items():
+                buf = self.free.get()
+                if buf is None or self.closing:
+                    break
+                if pool is None:
+                    self._load(item, buf)
+                    self.filled.put(buf)
+                    continue
+                pending.append((pool.submit(self._load, item, buf), buf))
+                if len(pending) >= self.n_workers:
+                    future, buf = pending.popleft()
+                    future.result()
+                    self.filled.put(buf)
+            while len(pending) > 0:
+                future, buf = pending.popleft()
+                future.result()
+                self.filled.put(buf)
+        except Exception as e:
+            self.filled.put(e)
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True, cancel_futures=True)
+            self.filled.put(None)
+
+    @traced('source')
+    def _load(self, item, buf):
+        """ Decode an item and convert it to irradiance into buf """
+        frame = self._decode(item)
+        if frame is None:
+            raise IOError("Cannot decode frame {}".format(item if isinstance(item, str) else ""))
+        if frame.ndim == 3 and self.convert == CONVERT_GRAY:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        elif frame.ndim == 3 and self.convert == CONVERT_LUV:
+            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2LUV)[:, :, 0]
+        if frame.shape != buf.shape:
+            raise ValueError("Frame of shape {} in a source of shape {}".format(frame.shape, buf.shape))
+        if self.scale is None:
+            buf[:] = frame
+        else:
+            np.multiply(frame, self.scale, out=buf, casting='unsafe')
+
+    def _items(self):
+        """ Items to decode, in order (frames, filenames...) """
+        raise NotImplementedError
+
+    def _decode(self, item):
+        """ Decode an item into an image """
+        return item
+
+    def _release(self):
+        """ Release the resources of the source """
+        pass
+
+
+class VideoSource(FrameSource):
+    """ Frames of a video, decoded by cv2.VideoCapture in a background thread """
+
+    def __init__(self, filename, skip=0, max_frames=None, convert=CONVERT_GRAY, scale=IRRADIANCE_SCALE,
+                 dtype=np.float64, n_buffers=None, prefetch=True):
+        """ Open the video
+            Args:
+                filename: path of the video, or an opened cv2.VideoCapture
+                skip: number of frames skipped at the beginning of the video
+                max_frames: maximum number of frames returned, None for the whole video
+                See FrameSource for the other arguments
+        """
+        self.cap = filename if isinstance(filename, cv2.VideoCapture) else cv2.VideoCapture(filename)
+        if not self.cap.isOpened():
+            raise IOError("Cannot open the video {}".format(filename))
+        self.skip = skip
+        self.max_frames = max_frames
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        super().__init__(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH), self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT),
+                         convert, scale, dtype, n_buffers, 1, prefetch)
+
+    def _items(self):
+        for i in range(self.skip):
+            if not self.cap.grab():
+                return
+        i = 0
+        while self.max_frames is None or i < self.max_frames:
+            ret, im = self.cap.read()
+            if not ret or im is None:
+                return
+            yield im
+            i += 1
+
+    def _release(self):
+        self.cap.release()
+
+
+class ImageDirSource(FrameSource):
+    """ Frames stored as images in a directory (or a list of files), decoded by cv2.imread in parallel """
+
+    def __init__(self, path, extensions=('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp'),
+                 convert=CONVERT_GRAY, scale=IRRADIANCE_SCALE, dtype=np.float64, n_buffers=None, n_workers=2,
+                 prefetch=True):
+        """ List the images, sorted by name
+            Args:
+                path: directory of the images, or list of the paths of the images
+                extensions: extensions of the images kept in the directory
+                See FrameSource for the other arguments
+        """
+        if isinstance(path, str):
+            self.files = sorted(os.path.join(path, f) for f in os.listdir(path)
+                                if f.lower().endswith(tuple(extensions)))
+        else:
+            self.files = list(path)
+        if len(self.files) == 0:
+            raise IOError("No image found in {}".format(path))
+        self.flag = cv2.IMREAD_GRAYSCALE if convert == CONVERT_GRAY else cv2.IMREAD_UNCHANGED
+        im = cv2.imread(self.files[0], self.flag)
+        if im is None:
+            raise IOError("Cannot read {}".format(self.files[0]))
+        super().__init__(im.shape[1], im.shape[0], convert, scale, dtype, n_buffers, n_workers, prefetch)
+
+    def __len__(self):
+        return len(self.files)
+
+    def _items(self):
+        return self.files
+
+    def _decode(self, item):
+        return cv2.imread(item, self.flag)
+
+
+class ArraySource(FrameSource):
+    """ Frames given as arrays (list, generator or array of shape (n, height, width[, 3])) """
+
+    def __init__(self, frames, width=None, height=None, convert=CONVERT_NONE, scale=1.0, dtype=np.float64,
+                 n_buffers=None, prefetch=True):
+        """ Args:
+                frames: sequence of frames, greylevels or already irradiance (scale=1.0, default)
+                width, height: size of the frames, taken from the first frame if frames has a shape
+                See FrameSource for the other arguments
+        """
+        self.frames = frames
+        if width is None or height is None:
+            height, width = np.shape(frames)[1:3]
+        super().__init__(width, height, convert, scale, dtype, n_buffers, 1, prefetch)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def _items(self):
+        return self.frames
+
+
+class InterpolatedSource(FrameSource):
+    """ Frames of a source with n intermediate frames generated between two consecutive frames
+        The intermediate frames are interpolated in the background when they are requested, they are never stored.
+        The time between two frames given to the sensor becomes dt / (n_interp + 1):
+
+            source = InterpolatedSource(ImageDirSource("frames"), n_interp=3)
+            pipeline = SimulationPipeline(source, dvs, 1e6 / (fps * 4))
+    """
+    # source = None          # Source of the frames, whose frames are interpolated
+    # n_interp = 1           # Number of frames inserted between two frames of the source
+    # method = 'log'         # INTERP_LOG or INTERP_FLOW
+
+    def __init__(self, source, n_interp=1, method=None, scale=None, dtype=np.float64, n_buffers=None,
+                 n_workers=1, prefetch=True, width=None, height=None):
+        """ Args:
+                source: frame source, or iterator over frames of the same size (width and height have to be given)
+                n_interp: number of frames inserted between two frames of the source
+                method: INTERP_LOG (default) to interpolate linearly in the log domain, or INTERP_FLOW to move the
+                        frames along the Farneback optical flow between them
+                scale: irradiance of a greylevel of 1 of the frames of the source, 1 if None
+                width, height: size of the frames, source.width and source.height if None
+                See FrameSource for the other arguments, the frames are irradiance
+        """
+        width = getattr(source, 'width', None) if width is None else width
+        height = getattr(source, 'height', None) if height is None else height
+        if width is None or height is None:
+            raise ValueError("The size of the frames has to be given for a source without width and height")
+        self.source = source
+        self.n_interp = max(0, int(n_interp))
+        self.method = INTERP_LOG if method is None else method
+        if self.method not in (INTERP_LOG, INTERP_FLOW):
+            raise ValueError("Unknown interpolation method {}".format(method))
+        self.src_scale = 1.0 if scale is None else scale
+        self.grid = None
+        super().__init__(width, height, CONVERT_NONE, 1.0, dtype, n_buffers, n_workers, prefetch)
+
+    def _items(self):
+        prev = None
+        for im in self.source:
+            # Copy of the frame, the buffer of a frame source is reused for its next frame
+            im = np.multiply(im, self.src_scale, dtype=np.float64)
+            if self.n_interp == 0:
+                yield im, None, None, 0.0
+                continue
+            cur = np.log1p(im)
+            if prev is not None:
+                flow = self._flow(prev, cur) if self.method == INTERP_FLOW else None
+                for k in range(1, self.n_interp + 1):
+                    yield prev, cur, flow, k / (self.n_interp + 1)
+            # The frames of the source are returned as they are
+            yield im, None, None, 0.0
+            prev = cur
+
+    def _decode(self, item):
+        l0, l1, flow, t = item
+        if l1 is None:
+            return l0
+        if flow is None:
+            img_l = l0 + (l1 - l0) * t
+        else:
+            # Sample the first frame backwards and the second frame forwards along the flow
+            gx, gy = self.grid
+            w0 = cv2.remap(l0, gx - t * flow[:, :, 0], gy - t * flow[:, :, 1], cv2.INTER_LINEAR,
+                           borderMode=cv2.BORDER_REPLICATE)
+            w1 = cv2.remap(l1, gx + (1 - t) * flow[:, :, 0], gy + (1 - t) * flow[:, :, 1], cv2.INTER_LINEAR,
+                           borderMode=cv2.BORDER_REPLICATE)
+            img_l = (1 - t) * w0 + t * w1
+        return np.expm1(img_l)
+
+    def _flow(self, l0, l1):
+        """ Dense optical flow (pixels) from the log frame l0 to the log frame l1 """
+        if self.grid is None:
+            self.grid = np.meshgrid(np.arange(self.width, dtype=np.float32),
+                                    np.arange(self.height, dtype=np.float32))
+        m = max(float(l0.max()), float(l1.max()), 1e-6)
+        a = np.uint8(np.clip(l0 * (255 / m), 0, 255))
+        b = np.uint8(np.clip(l1 * (255 / m), 0, 255))
+        return cv2.calcOpticalFlowFarneback(a, b, None, 0.5, 3, 15, 3, 5, 1.2, 0)
+
+    def _release(self):
+        if hasattr(self.source, 'close'):
+            self.source.close()
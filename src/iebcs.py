@@ -0,0 +1,402 @@
+"""
+    Command line interface of the simulator
+
+        python iebcs.py simulate config.toml [--set sensor.th_pos=0.3] [--max-frames 100]
+        python iebcs.py merge merged.dat a.dat b.dat [--offsets 0,0 640,0] [--index]
+        python iebcs.py render events.dat events.avi [--frame-us 1000] [--mode timesurface]
+        python iebcs.py info events.dat
+        python iebcs.py batch jobs.toml [--workers 8] [--retries 1] [--summary summary.json]
+
+    A simulation is described by a configuration file (TOML, or JSON if it ends with .json) with the sections of
+    DEFAULT_CONFIG, see examples/00_video_2_events/config.toml. The frames are read, simulated and written as a
+    stream (see pipeline.SimulationPipeline), so the memory used does not grow with the length of the run. The
+    configuration used, with the defaults filled in, is saved next to the output.
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+import numpy as np
+from arbiter import BottleNeckArbiter, RowArbiter, SynchronousArbiter
+from dat_files import DatWriter, Evt2Writer, load_dat_index, merge_dat_files
+from dvs_sensor import DvsSensor
+from event_display import EventDisplay
+from frame_source import VideoSource, ImageDirSource, InterpolatedSource, IRRADIANCE_SCALE, INTERP_LOG
+from noise_cache import lux_noise_files
+from pipeline import SimulationPipeline, STAGE_SENSOR, STAGE_SINK
+import tracing
+
+# Configuration of a simulation: sections and their default values. Paths are relative to the configuration file
+DEFAULT_CONFIG = {
+    'input': {
+        'type': 'video',         # 'video' or 'images' (directory of images sorted by name)
+        'path': None,            # Path of the video or of the directory of images
+        'skip': 0,               # Number of frames of the video skipped at the beginning
+        'max_frames': None,      # Maximum number of frames read, None for all of them
+        'convert': 'gray',       # 'gray', 'luv' (L channel) or None (single channel frames)
+        'scale': IRRADIANCE_SCALE,  # Irradiance (lux) of a greylevel of 1
+        'lut': True,             # Give the greylevels to the sensor, converted with lookup tables
+        'n_interp': 0,           # Number of frames interpolated between two frames of the input
+        'interp_method': INTERP_LOG,  # 'log' or 'flow', see frame_source.InterpolatedSource
+        'n_workers': 2,          # Number of threads decoding the images
+    },
+    'sensor': {
+        'th_pos': 0.4,           # ON threshold (log change)
+        'th_neg': 0.4,           # OFF threshold (log change)
+        'th_noise': 0.01,        # Standard deviation of the thresholds
+        'lat': 100,              # Latency (us)
+        'tau': 40,               # Time constant of the front-end at 1 klux (us)
+        'jit': 10,               # Temporal jitter (us)
+        'bgnp': 0.1,             # ON noise rate (Hz)
+        'bgnn': 0.01,            # OFF noise rate (Hz)
+        'ref': 100,              # Refractory period (us)
+        'noise': 'measure',      # 'freq' (bgnp and bgnn), 'measure' (noise_pos and noise_neg) or 'lux'
+        'noise_pos': None,       # Positive noise distributions, data/noise_pos_161lux.npy if None
+        'noise_neg': None,       # Negative noise distributions, data/noise_neg_161lux.npy if None
+        'noise_dir': None,       # Directory of the distributions of the 'lux' noise, data/ if None
+        'seed': None,            # Seed of the simulation, None for a random one
+        'tile_size': 0,          # Size of the tiles skipped when static, see DvsSensor.set_tile_skipping
+        'tile_tol': 1e-4,        # Log difference under which a pixel has converged
+        'max_log_step': 0,       # Log change above which a pixel is sub-stepped, see DvsSensor.set_substeps
+        'max_substeps': 16,      # Number of sub-steps of the fast pixels in a frame
+    },
+    'simulation': {
+        'dt': None,              # Time between two frames of the input (us), 1e6 / fps of the video if None
+        'max_frames': None,      # Maximum number of frames simulated
+        'queue_size': 4,         # Packets waiting between two stages of the pipeline
+        'profile': None,         # Path of the per-frame profile of the sensor (CSV or JSON), see profiling.py
+        'trace': None,           # Path of the Chrome trace of the run, see tracing.py
+    },
+    'arbiter': {
+        'type': None,            # None, 'bottleneck', 'row' or 'synchronous'
+        't_per_event': 0.01,     # Time to process one event of the bottleneck and row arbiters (us)
+        'clock_period': 0.1,     # Clock period of the synchronous arbiter (us)
+    },
+    'output': {
+        'path': 'events.dat',    # Path of the events
+        'format': 'dat',         # 'dat' or 'evt2'
+        'sort_window': 10000,    # Events kept before being written to keep the file sorted (us)
+        'index': True,           # Write the sidecar index of the .dat file
+        'threaded': True,        # Write the .dat file in a background thread
+        'compression': None,     # Compression of the EVT 2.0 file: None, 'zlib' or 'lzma'
+    },
+    'display': {
+        'enabled': False,        # Show the events while simulating
+        'frametime': None,       # Time between two displayed frames (us), dt if None
+    },
+}
+PATH_KEYS = [('input', 'path'), ('sensor', 'noise_pos'), ('sensor', 'noise_neg'), ('sensor', 'noise_dir'),
+             ('simulation', 'profile'), ('simulation', 'trace'), ('output', 'path')]
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+def load_config(filename, overrides=()):
+    """ Read the configuration of a simulation
+        Args:
+            filename: TOML file, or JSON file if it ends with .json
+            overrides: list of "section.key=value" strings, the values are parsed as JSON (or kept as strings)
+        Returns:
+            dict of the sections of DEFAULT_CONFIG, with the defaults filled in and the paths made absolute
+    """
+    user = read_config(filename)
+    for item in overrides:
+        key, _, value = item.partition('=')
+        section, _, name = key.partition('.')
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+        user.setdefault(section, {})[name] = value
+    config = resolve_config(user, os.path.dirname(os.path.abspath(filename)), name=filename)
+    if config['input']['path'] is None:
+        raise ValueError("input.path is missing in {}".format(filename))
+    return config
+
+
+def read_config(filename):
+    """ Read a TOML file, or a JSON file if it ends with .json, as a dict """
+    if filename.endswith('.json'):
+        with open(filename, 'r') as f:
+            return json.load(f)
+    try:
+        import tomllib
+    except ImportError:
+        import tomli as tomllib
+    with open(filename, 'rb') as f:
+        return tomllib.load(f)
+
+
+def resolve_config(user, root, base=None, name='the configuration'):
+    """ Apply values to a configuration
+        Args:
+            user: dict of sections of values
+            root: directory the relative paths are relative to
+            base: configuration the values are applied to, DEFAULT_CONFIG if None (it is not modified)
+            name: name of the configuration in the error messages
+        Returns:
+            new configuration, with the paths made absolute
+    """
+    config = copy.deepcopy(DEFAULT_CONFIG if base is None else base)
+    for section, values in user.items():
+        if section not in config:
+            raise ValueError("Unknown section [{}] in {}".format(section, name))
+        for key, value in values.items():
+            if key not in config[section]:
+                raise ValueError("Unknown key {}.{} in {}".format(section, key, name))
+            config[section][key] = value
+    for section, key in PATH_KEYS:
+        if config[section][key] is not None:
+            config[section][key] = os.path.normpath(os.path.join(root, os.path.expanduser(config[section][key])))
+    return config
+
+
+def open_frames(cfg):
+    """ Source of the frames of the [input] section, before interpolation
+        The frames are greylevels (uint8) with input.lut, irradiance (float32) otherwise
+    """
+    dtype = np.uint8 if cfg['lut'] else np.float32
+    scale = None if cfg['lut'] else cfg['scale']
+    if cfg['type'] == 'video':
+        return VideoSource(cfg['path'], skip=cfg['skip'], max_frames=cfg['max_frames'], convert=cfg['convert'],
+                           scale=scale, dtype=dtype)
+    if cfg['type'] == 'images':
+        source = ImageDirSource(cfg['path'], convert=cfg['convert'], scale=scale, dtype=dtype,
+                                n_workers=cfg['n_workers'])
+        source.files = source.files[cfg['skip']:]
+        if cfg['max_frames'] is not None:
+            source.files = source.files[:cfg['max_frames']]
+        return source
+    raise ValueError("Unknown input type {}".format(cfg['type']))
+
+
+def make_source(cfg, open_source=None):
+    """ Frame source of the [input] section
+        Args:
+            cfg: [input] section
+            open_source: function of cfg giving the source of the frames before interpolation, open_frames if None
+        Returns:
+            FrameSource, and the radiometric value of a greylevel of 1 of its frames (None if they are irradiance)
+    """
+    lut = cfg['lut'] and cfg['n_interp'] == 0
+    source = (open_frames if open_source is None else open_source)(cfg)
+    if cfg['n_interp'] > 0:
+        source = InterpolatedSource(source, cfg['n_interp'], method=cfg['interp_method'],
+                                    scale=cfg['scale'] if cfg['lut'] else None, dtype=np.float32)
+    return source, cfg['scale'] if lut else None
+
+
+def make_sensor(cfg, width, height):
+    """ DvsSensor of the [sensor] section """
+    if cfg['seed'] is not None:
+        np.random.seed(cfg['seed'])
+    dvs = DvsSensor("IEBCS")
+    dvs.initCamera(width, height, lat=cfg['lat'], jit=cfg['jit'], ref=cfg['ref'], tau=cfg['tau'],
+                   th_pos=cfg['th_pos'], th_neg=cfg['th_neg'], th_noise=cfg['th_noise'], bgnp=cfg['bgnp'],
+                   bgnn=cfg['bgnn'])
+    if cfg['noise'] == 'measure':
+        dvs.init_bgn_hist(cfg['noise_pos'] or os.path.join(DATA_DIR, 'noise_pos_161lux.npy'),
+                          cfg['noise_neg'] or os.path.join(DATA_DIR, 'noise_neg_161lux.npy'), seed=cfg['seed'])
+    elif cfg['noise'] == 'lux':
+        dvs.init_bgn_lux(lux_noise_files(cfg['noise_dir'] or DATA_DIR), seed=cfg['seed'])
+    elif cfg['noise'] != 'freq':
+        raise ValueError("Unknown noise model {}".format(cfg['noise']))
+    if cfg['tile_size'] > 0:
+        dvs.set_tile_skipping(cfg['tile_size'], cfg['tile_tol'])
+    if cfg['max_log_step'] > 0:
+        dvs.set_substeps(cfg['max_log_step'], cfg['max_substeps'])
+    return dvs
+
+
+def make_arbiter(cfg, height):
+    """ Arbiter of the [arbiter] section, None if there is none """
+    if cfg['type'] in (None, 'none'):
+        return None
+    if cfg['type'] == 'bottleneck':
+        return BottleNeckArbiter(cfg['t_per_event'], 0)
+    if cfg['type'] == 'row':
+        return RowArbiter(cfg['t_per_event'], 0)
+    if cfg['type'] == 'synchronous':
+        return SynchronousArbiter(cfg['clock_period'], 0, height)
+    raise ValueError("Unknown arbiter {}".format(cfg['type']))
+
+
+def make_writer(cfg, width, height):
+    """ Writer of the [output] section """
+    os.makedirs(os.path.dirname(os.path.abspath(cfg['path'])), exist_ok=True)
+    if cfg['format'] == 'dat':
+        return DatWriter(cfg['path'], width, height, sort_window=cfg['sort_window'], threaded=cfg['threaded'],
+                         index=cfg['index'])
+    if cfg['format'] == 'evt2':
+        return Evt2Writer(cfg['path'], width, height, compression=cfg['compression'],
+                          sort_window=cfg['sort_window'])
+    raise ValueError("Unknown output format {}".format(cfg['format']))
+
+
+def simulate(config, max_frames=None, progress=True, open_source=None):
+    """ Run the simulation described by a configuration
+        Args:
+            config: configuration, see load_config
+            max_frames: maximum number of frames simulated, simulation.max_frames if None
+            progress: display a progress bar
+            open_source: function opening the frames of the [input] section, see make_source
+        Returns:
+            dict of the statistics of the run: frames, events, total time (s), frames/s, events/s, the statistics
+            of each stage of the pipeline and the peak memory (MB)
+    """
+    sim = config['simulation']
+    max_frames = sim['max_frames'] if max_frames is None else max_frames
+    source, scale = make_source(config['input'], open_source)
+    dt = sim['dt']
+    if dt is None:
+        fps = getattr(getattr(source, 'source', source), 'fps', 0)
+        if not fps:
+            raise ValueError("simulation.dt is needed for an input without frame rate")
+        dt = 1e6 / fps
+    dt = dt / (config['input']['n_interp'] + 1)
+    dvs = make_sensor(config['sensor'], source.width, source.height)
+    arbiter = make_arbiter(config['arbiter'], source.height)
+    writer = make_writer(config['output'], source.width, source.height)
+    display = None
+    if config['display']['enabled']:
+        display = EventDisplay("Events", source.width, source.height, config['display']['frametime'] or dt,
+                               threaded=True)
+    profiler = dvs.set_profiling() if sim['profile'] is not None else None
+    if sim['trace'] is not None:
+        tracing.start_tracing()
+    with open(config['output']['path'] + '.config.json', 'w') as f:
+        json.dump(config, f, indent=1)
+
+    pipeline = SimulationPipeline(source, dvs, dt, arbiter=arbiter, display=display, sinks=[writer],
+                                  queue_size=sim['queue_size'], scale=scale)
+    try:
+        stats = pipeline.run(max_frames=max_frames, progress=progress)
+    finally:
+        writer.close()
+        source.close()
+        if display is not None:
+            display.close()
+        tracer = tracing.stop_tracing() if sim['trace'] is not None else None
+        if tracer is not None:
+            tracer.save(sim['trace'])
+        if profiler is not None:
+            profiler.export(sim['profile'])
+    frames = stats[STAGE_SENSOR]['frames']
+    events = stats[STAGE_SINK]['events']
+    stats.update({'frames': frames, 'events': events, 'fps': frames / stats['total'] if stats['total'] > 0 else 0,
+                  'events_per_s': events / stats['total'] if stats['total'] > 0 else 0, 'peak_rss_mb': peak_rss_mb()})
+    return stats
+
+
+def peak_rss_mb():
+    """ Peak resident memory of the process (MB), None if it is not known """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+
+
+def print_stats(stats):
+    """ Print the throughput of a simulation and the time spent by each stage """
+    print("{} frames, {} events in {:.2f} s: {:.1f} frames/s, {:.3g} events/s".format(
+        stats['frames'], stats['events'], stats['total'], stats['fps'], stats['events_per_s']))
+    for name in ['sensor', 'arbiter', 'sink']:
+        if name in stats:
+            s = stats[name]
+            print("  {:<8} busy {:.2f} s, waiting for input {:.2f} s, for output {:.2f} s".format(
+                name, s['busy'], s['wait_in'], s['wait_out']))
+    if stats.get('peak_rss_mb') is not None:
+        print("  peak memory {:.0f} MB".format(stats['peak_rss_mb']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='iebcs', description="Event-based camera simulator")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('simulate', help="simulate a sensor described by a configuration file")
+    p.add_argument('config', help="TOML (or JSON) configuration file")
+    p.add_argument('--set', '-s', action='append', default=[], metavar='SECTION.KEY=VALUE',
+                   help="override a value of the configuration")
+    p.add_argument('--max-frames', type=int, help="maximum number of frames simulated")
+    p.add_argument('--no-progress', action='store_true', help="do not display the progress bar")
+    p.add_argument('--stats', help="save the statistics of the run in a JSON file")
+
+    p = commands.add_parser('batch', help="run the jobs of a manifest with a pool of processes")
+    p.add_argument('manifest', help="TOML or JSON manifest, or JSON lines file of jobs, see batch.py")
+    p.add_argument('--workers', type=int, help="number of processes, the number of CPUs by default")
+    p.add_argument('--retries', type=int, default=1, help="number of times a job which failed is run again")
+    p.add_argument('--jobs-per-task', type=int, help="jobs of the same input sent at once to a worker")
+    p.add_argument('--frame-cache-mb', type=float, help="decoded frames kept by each worker (MB)")
+    p.add_argument('--output-dir', help="directory of the events of the jobs without output.path")
+    p.add_argument('--summary', help="save the results of the jobs and the summary in a JSON file")
+    p.add_argument('--no-progress', action='store_true', help="do not display the progress bar")
+
+    p = commands.add_parser('merge', help="merge time-sorted .dat files")
+    p.add_argument('output', help=".dat file created")
+    p.add_argument('inputs', nargs='+', help=".dat files merged")
+    p.add_argument('--offsets', nargs='+', metavar='X,Y', help="position of each input in the output sensor")
+    p.add_argument('--index', action='store_true', help="write the sidecar index of the output")
+
+    p = commands.add_parser('render', help="render a .dat file into a video")
+    p.add_argument('input', help=".dat file")
+    p.add_argument('output', help="video file")
+    p.add_argument('--frame-us', type=int, default=1000, help="duration of a frame (us)")
+    p.add_argument('--fps', type=float, default=20.0, help="frame rate of the video")
+    p.add_argument('--mode', default='timesurface', choices=['timesurface', 'binary', 'count'])
+    p.add_argument('--workers', type=int, help="number of processes")
+
+    p = commands.add_parser('info', help="statistics of a .dat file")
+    p.add_argument('input', help=".dat file")
+
+    args = parser.parse_args(argv)
+    if args.command == 'simulate':
+        try:
+            config = load_config(args.config, args.set)
+        except (ValueError, IOError) as e:
+            parser.error(str(e))
+        stats = simulate(config, args.max_frames, not args.no_progress)
+        print_stats(stats)
+        if args.stats:
+            with open(args.stats, 'w') as f:
+                json.dump(stats, f, indent=1)
+    elif args.command == 'batch':
+        import batch
+        try:
+            jobs = batch.load_manifest(args.manifest, args.output_dir)
+        except (ValueError, IOError) as e:
+            parser.error(str(e))
+        n_workers = os.cpu_count() if args.workers is None else args.workers
+        results, total = batch.run_batch(
+            jobs, n_workers, args.retries, args.jobs_per_task or batch.JOBS_PER_TASK,
+            batch.FRAME_CACHE_MB if args.frame_cache_mb is None else args.frame_cache_mb, not args.no_progress)
+        summary = batch.summarize(results, total, n_workers)
+        batch.print_summary(summary, results)
+        if args.summary:
+            with open(args.summary, 'w') as f:
+                json.dump({'summary': summary, 'jobs': results}, f, indent=1)
+        if summary['failed'] > 0:
+            sys.exit(1)
+    elif args.command == 'merge':
+        offsets = None
+        if args.offsets is not None:
+            offsets = [tuple(int(v) for v in o.split(',')) for o in args.offsets]
+        t0 = time.perf_counter()
+        n = merge_dat_files(args.inputs, args.output, offsets=offsets, index=args.index)
+        t = time.perf_counter() - t0
+        print("{} events merged in {:.2f} s ({:.3g} events/s)".format(n, t, n / t if t > 0 else 0))
+    elif args.command == 'render':
+        from render import render_dat_video
+        t0 = time.perf_counter()
+        n = render_dat_video(args.input, args.output, frame_us=args.frame_us, fps=args.fps, mode=args.mode,
+                             n_workers=args.workers)
+        print("{} frames rendered in {:.2f} s".format(n, time.perf_counter() - t0))
+    elif args.command == 'info':
+        for key, value in load_dat_index(args.input, build=True).summary().items():
+            print("{:<10} {}".format(key, value))
+
+
+if __name__ == '__main__':
+    main()
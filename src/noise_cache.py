@@ -0,0 +1,195 @@
+import hashlib
+import os
+import shutil
+from collections import OrderedDict
+import numpy as np
+
+# Log bins of the frequencies of the measured noise distributions (Hz)
+bins = []
+for dec in range(-3, 5, 1):
+    bins.append(np.arange(10 ** dec, 10 ** (dec + 1), 10 ** dec))
+bins = np.array(bins)
+FREQ = bins.reshape(bins.shape[0] * bins.shape[1])
+
+NOISE_CACHE_VERSION = 1
+NOISE_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "iebcs", "noise")
+NOISE_TABLES = ['cdf_pos', 'cdf_neg', 'id_pos', 'id_neg', 'next_pos', 'next_neg']
+NOISE_LUX_TABLES = ['lux', 'cdf_pos', 'cdf_neg', 'id_pos', 'id_neg']
+# Noise distributions measured in data/: illumination (lux) and name of the files
+NOISE_LUX_LEVELS = [(0.1, '0.1lux'), (161, '161lux'), (3000, '3klux')]
+DRAW_CHUNK = 1 << 16  # Number of pixels drawn at once
+NOISE_MEMORY_SIZE = 8  # Number of tables kept loaded by a process, see load_noise_tables
+_loaded = OrderedDict()
+
+
+def load_noise_cdf(filename):
+    """ Load measured noise distributions and normalise them
+        Args:
+            filename: .npy file of shape (..., len(FREQ)) of cumulative distributions
+        Returns:
+            array (n_spectra, len(FREQ)) of normalised cumulative distributions
+    """
+    cdf = np.load(filename)
+    cdf = np.array(np.reshape(cdf, (-1, cdf.shape[-1])), dtype=float)
+    if len(cdf) == 0:
+        raise ValueError("{} is not correct".format(filename))
+    s = np.sum(cdf, axis=1)
+    cdf[s == 0, 0] = 1
+    cdf[s > 0, :] /= cdf[s > 0, -2:-1]
+    return cdf
+
+
+def draw_noise_delays(cdf, ids, u):
+    """ Delays until the next noise event of pixels
+        Args:
+            cdf: normalised cumulative distributions, see load_noise_cdf
+            ids: distribution of each pixel
+            u: uniform values in [0, 1) of each pixel
+        Returns:
+            array of the shape of ids of the delays (us)
+    """
+    ids = np.ravel(ids)
+    u = np.ravel(u)
+    ind = np.empty(len(ids), dtype=np.intp)
+    for i in range(0, len(ids), DRAW_CHUNK):
+        # First bin reaching u, as np.searchsorted(cdf, u, side='left') on each distribution: the last bin if the
+        # distribution ends below u after rounding
+        above = cdf[ids[i:i + DRAW_CHUNK]] >= u[i:i + DRAW_CHUNK, None]
+        first = np.argmax(above, axis=1)
+        first[~above[np.arange(above.shape[0]), first]] = cdf.shape[1] - 1
+        ind[i:i + DRAW_CHUNK] = first
+    return np.uint64(1e6 / FREQ[ind])
+
+
+def compile_noise_tables(filename_pos, filename_neg, shape, rng=None):
+    """ Compile the noise tables of a sensor
+        Pick randomly one noise distribution for each pixel and polarity, and the random phase of the first
+        noise event of each pixel.
+        Args:
+            filename_pos, filename_neg: paths of the positive and negative noise distributions
+            shape: (height, width) of the sensor
+            rng: np.random.RandomState, the global generator if None
+        Returns:
+            dict of arrays: normalised distributions (cdf_pos, cdf_neg), distribution of each pixel (id_pos, id_neg)
+            and time of the first noise event of each pixel (next_pos, next_neg)
+    """
+    rng = np.random if rng is None else rng
+    shape = tuple(shape)
+    tables = {'cdf_pos': load_noise_cdf(filename_pos), 'cdf_neg': load_noise_cdf(filename_neg)}
+    tables['id_neg'] = rng.randint(0, tables['cdf_neg'].shape[0], size=shape).astype(np.int32)
+    tables['id_pos'] = rng.randint(0, tables['cdf_pos'].shape[0], size=shape).astype(np.int32)
+    for pol in ['pos', 'neg']:
+        delays = draw_noise_delays(tables['cdf_' + pol], tables['id_' + pol], rng.uniform(0, 1, shape))
+        tables['next_' + pol] = np.uint64(delays.reshape(shape) * rng.uniform(0, 1, shape))
+    return tables
+
+
+def compile_lux_noise_tables(levels, shape, rng=None):
+    """ Compile the noise tables of a sensor whose noise depends on the illumination
+        Pick randomly one noise distribution of each illumination level for each pixel and polarity.
+        Args:
+            levels: list of (lux, filename_pos, filename_neg) of the measured distributions, see lux_noise_files
+            shape: (height, width) of the sensor
+            rng: np.random.RandomState, the global generator if None
+        Returns:
+            dict of arrays: illuminations of the levels sorted (lux), distributions of all the levels stacked
+            (cdf_pos, cdf_neg) and row of the distribution of each level and pixel (id_pos, id_neg of shape
+            (n_levels, height, width))
+    """
+    rng = np.random if rng is None else rng
+    shape = tuple(shape)
+    levels = sorted(levels, key=lambda level: level[0])
+    tables = {'lux': np.array([level[0] for level in levels], dtype=float)}
+    for i, pol in [(1, 'pos'), (2, 'neg')]:
+        cdfs = [load_noise_cdf(level[i]) for level in levels]
+        offsets = np.cumsum([0] + [len(cdf) for cdf in cdfs])
+        tables['cdf_' + pol] = np.concatenate(cdfs)
+        tables['id_' + pol] = np.stack([offsets[k] + rng.randint(0, len(cdf), size=shape)
+                                        for k, cdf in enumerate(cdfs)]).astype(np.int32)
+    return tables
+
+
+def lux_noise_files(data_dir):
+    """ Levels of the noise distributions measured in the data directory of the repository
+        Args:
+            data_dir: path of the data directory, e.g. "../../data" from the examples
+        Returns:
+            list of (lux, filename_pos, filename_neg), see DvsSensor.init_bgn_lux
+    """
+    return [(lux, os.path.join(data_dir, 'noise_pos_' + name + '.npy'),
+             os.path.join(data_dir, 'noise_neg_' + name + '.npy')) for lux, name in NOISE_LUX_LEVELS]
+
+
+def noise_cache_key(filenames, shape, seed, extra=None):
+    """ Name of the cached tables: hash of the content of the distributions, the shape of the sensor and the seed """
+    h = hashlib.sha1()
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    h.update("{} {} {} {} {}".format(NOISE_CACHE_VERSION, tuple(shape)[0], tuple(shape)[1], seed, extra).encode())
+    return h.hexdigest()
+
+
+def load_noise_tables(filename_pos, filename_neg, shape, seed, cache_dir=None):
+    """ Noise tables of a sensor, compiled once and shared through a cache
+        The tables are compiled with np.random.RandomState(seed) and saved as .npy files in a directory of the
+        cache named by noise_cache_key. They are then loaded read-only with memory mapping: loading them is
+        immediate and the processes using the same tables share their memory. The last NOISE_MEMORY_SIZE tables
+        loaded stay in memory, so a process simulating many sensors (see batch.py) neither hashes the distributions
+        nor opens the cache again while the files are not modified.
+        Args:
+            filename_pos, filename_neg: paths of the positive and negative noise distributions
+            shape: (height, width) of the sensor
+            seed: seed of the random draws
+            cache_dir: directory of the cache, NOISE_CACHE_DIR if None
+        Returns:
+            dict of read-only arrays, see compile_noise_tables
+    """
+    return _remember([filename_pos, filename_neg], shape, seed, None, cache_dir, lambda: _load_cached(
+        noise_cache_key([filename_pos, filename_neg], shape, seed), NOISE_TABLES, cache_dir,
+        lambda: compile_noise_tables(filename_pos, filename_neg, shape, np.random.RandomState(seed))))
+
+
+def load_lux_noise_tables(levels, shape, seed, cache_dir=None):
+    """ Noise tables of a sensor whose noise depends on the illumination, compiled once and shared through a cache
+        See load_noise_tables and compile_lux_noise_tables
+    """
+    levels = sorted(levels, key=lambda level: level[0])
+    filenames = [f for level in levels for f in level[1:]]
+    lux = [level[0] for level in levels]
+    return _remember(filenames, shape, seed, lux, cache_dir, lambda: _load_cached(
+        noise_cache_key(filenames, shape, seed, lux), NOISE_LUX_TABLES, cache_dir,
+        lambda: compile_lux_noise_tables(levels, shape, np.random.RandomState(seed))))
+
+
+def _remember(filenames, shape, seed, extra, cache_dir, load):
+    """ Tables kept in memory by the process, identified by the paths, sizes and dates of the distributions """
+    key = (tuple((os.path.abspath(f), os.path.getsize(f), os.path.getmtime(f)) for f in filenames),
+           tuple(shape), seed, None if extra is None else tuple(extra), cache_dir)
+    if key in _loaded:
+        _loaded.move_to_end(key)
+        return _loaded[key]
+    tables = load()
+    _loaded[key] = tables
+    while len(_loaded) > NOISE_MEMORY_SIZE:
+        _loaded.popitem(last=False)
+    return tables
+
+
+def _load_cached(key, names, cache_dir, compile_tables):
+    """ Load tables from the cache, after compiling and saving them if they are not in the cache """
+    cache_dir = NOISE_CACHE_DIR if cache_dir is None else cache_dir
+    path = os.path.join(cache_dir, key)
+    if not os.path.isdir(path):
+        tables = compile_tables()
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        os.makedirs(tmp, exist_ok=True)
+        for name in names:
+            np.save(os.path.join(tmp, name + '.npy'), tables[name])
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # Compiled at the same time by another process
+            shutil.rmtree(tmp, ignore_errors=True)
+    return {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in names}
@@ -0,0 +1,222 @@
+import queue
+import threading
+import time
+from tqdm import tqdm
+from event_buffer import EventBuffer
+
+# Stages of the pipeline
+STAGE_SENSOR = 'sensor'
+STAGE_ARBITER = 'arbiter'
+STAGE_SINK = 'sink'
+
+
+class StageStats():
+    """ Time spent by a stage of the pipeline """
+    # name = ""          # Name of the stage
+    # frames = 0         # Number of packets processed
+    # events = 0         # Number of events produced
+    # busy = 0           # Time spent processing (s)
+    # wait_in = 0        # Time spent waiting for the previous stage, or the frame source (s)
+    # wait_out = 0       # Time spent waiting for the next stage (s)
+
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.events = 0
+        self.busy = 0.0
+        self.wait_in = 0.0
+        self.wait_out = 0.0
+
+    def as_dict(self):
+        return {'frames': self.frames, 'events': self.events, 'busy': self.busy, 'wait_in': self.wait_in,
+                'wait_out': self.wait_out}
+
+
+class SimulationPipeline():
+    """ Run a frame source, a DvsSensor, an optional arbiter and sinks as concurrent stages
+        The sensor and the arbiter run in their own threads, connected by bounded queues: a stage blocks when the
+        next one is late (backpressure), and packets are passed by reference. The frame source decodes in its own
+        threads (see frame_source). The sinks (display, writers, EventBuffer) run in the thread calling run(),
+        so that the OpenCV windows stay in the main thread. The throughput is limited by the slowest stage instead
+        of the sum of the stages, the time spent by each stage is reported in stats.
+
+            pipeline = SimulationPipeline(VideoSource("video.mp4"), dvs, dt, arbiter=ea,
+                                          display=ed, sinks=[DatWriter("ev.dat", w, h, sort_window=10000)])
+            stats = pipeline.run()
+    """
+    # source = None          # Iterator over the irradiance frames, e.g. a FrameSource
+    # sensor = None          # DvsSensor
+    # dt = 1000              # Time between two frames (us)
+    # arbiter = None         # Optional arbiter, with a process(ev, dt) method
+    # display = None         # Optional EventDisplay
+    # sinks = []             # Objects receiving the events: EventBuffer, write(ev) or callable(ev)
+    # stats = {}             # StageStats of each stage
+
+    def __init__(self, source, sensor, dt, arbiter=None, display=None, sinks=(), queue_size=4,
+                 init_first_frame=True, scale=None):
+        """ Connect the stages
+            Args:
+                source: iterator over the irradiance frames
+                sensor: DvsSensor, initialised with initCamera
+                dt: time between two frames (us)
+                arbiter: optional arbiter (BottleNeckArbiter, RowArbiter, SynchronousArbiter)
+                display: optional EventDisplay
+                sinks: objects receiving the events: DatWriter, EventBuffer or callable
+                queue_size: maximum number of packets waiting between two stages
+                init_first_frame: use the first frame of the source as the initial image of the sensor
+                scale: radiometric value of a greylevel of 1 for integer frames, see DvsSensor.update
+        """
+        self.source = source
+        self.sensor = sensor
+        self.dt = dt
+        self.arbiter = arbiter
+        self.display = display
+        self.sinks = list(sinks)
+        self.queue_size = queue_size
+        self.init_first_frame = init_first_frame
+        self.scale = scale
+        self.stats = {}
+        self.error = None
+        self.stop = threading.Event()
+
+    def run(self, max_frames=None, progress=False):
+        """ Run the pipeline until the end of the source
+            Args:
+                max_frames: maximum number of frames simulated, None for the whole source
+                progress: display a progress bar
+            Returns:
+                dict of the statistics of each stage (see StageStats) and the total time (s)
+        """
+        self.stats = {STAGE_SENSOR: StageStats(STAGE_SENSOR), STAGE_SINK: StageStats(STAGE_SINK)}
+        if self.arbiter is not None:
+            self.stats[STAGE_ARBITER] = StageStats(STAGE_ARBITER)
+        self.error = None
+        self.stop.clear()
+        t_start = time.perf_counter()
+
+        sensor_out = queue.Queue(maxsize=self.queue_size)
+        threads = [threading.Thread(target=self._run_sensor, args=(sensor_out, max_frames), name="Sensor",
+                                    daemon=True)]
+        sink_in = sensor_out
+        if self.arbiter is not None:
+            sink_in = queue.Queue(maxsize=self.queue_size)
+            threads.append(threading.Thread(target=self._run_arbiter, args=(sensor_out, sink_in), name="Arbiter",
+                                            daemon=True))
+        for t in threads:
+            t.start()
+        try:
+            self._run_sinks(sink_in, tqdm(total=max_frames, desc="Simulation") if progress else None)
+        except BaseException as e:
+            self.stop.set()
+            self.error = self.error or e
+            self._drain(sink_in)
+        for t in threads:
+            t.join()
+        if self.error is not None:
+            raise self.error
+        result = {name: s.as_dict() for name, s in self.stats.items()}
+        result['total'] = time.perf_counter() - t_start
+        return result
+
+    def _run_sensor(self, out, max_frames):
+        """ Sensor stage: read the frames and simulate the sensor """
+        st = self.stats[STAGE_SENSOR]
+        try:
+            it = iter(self.source)
+            first = self.init_first_frame
+            n = 0
+            while not self.stop.is_set() and (max_frames is None or n < max_frames):
+                t0 = time.perf_counter()
+                im = next(it, None)
+                t1 = time.perf_counter()
+                st.wait_in += t1 - t0
+                if im is None:
+                    break
+                if first:
+                    self.sensor.init_image(im, self.scale)
+                    first = False
+                    st.busy += time.perf_counter() - t1
+                    continue
+                ev = self.sensor.update(im, self.dt, self.scale)
+                t2 = time.perf_counter()
+                st.busy += t2 - t1
+                st.frames += 1
+                n += 1
+                if ev is None:
+                    continue
+                st.events += ev.i
+                self._put(out, ev, st)
+        except BaseException as e:
+            self.error = self.error or e
+            self.stop.set()
+        finally:
+            self._put(out, None, st, force=True)
+
+    def _run_arbiter(self, inp, out):
+        """ Arbiter stage: delay the events through the arbiter """
+        st = self.stats[STAGE_ARBITER]
+        try:
+            while True:
+                t0 = time.perf_counter()
+                ev = inp.get()
+                t1 = time.perf_counter()
+                st.wait_in += t1 - t0
+                if ev is None:
+                    break
+                ev = self.arbiter.process(ev, self.dt)
+                st.busy += time.perf_counter() - t1
+                st.frames += 1
+                st.events += ev.i
+                self._put(out, ev, st)
+        except BaseException as e:
+            self.error = self.error or e
+            self.stop.set()
+            self._drain(inp)
+        finally:
+            self._put(out, None, st, force=True)
+
+    def _run_sinks(self, inp, bar):
+        """ Sink stage: display and store the events, in the calling thread """
+        st = self.stats[STAGE_SINK]
+        while True:
+            t0 = time.perf_counter()
+            ev = inp.get()
+            t1 = time.perf_counter()
+            st.wait_in += t1 - t0
+            if ev is None:
+                break
+            if self.display is not None:
+                self.display.update(ev, self.dt)
+            for sink in self.sinks:
+                if isinstance(sink, EventBuffer):
+                    sink.increase_ev(ev)
+                elif hasattr(sink, 'write'):
+                    sink.write(ev)
+                else:
+                    sink(ev)
+            st.busy += time.perf_counter() - t1
+            st.frames += 1
+            st.events += ev.i
+            if bar is not None:
+                bar.set_postfix(events=st.events, refresh=False)
+                bar.update(1)
+        if bar is not None:
+            bar.close()
+
+    def _put(self, out, item, st, force=False):
+        """ Give an item to the next stage, waiting while its queue is full """
+        t0 = time.perf_counter()
+        while True:
+            try:
+                out.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                if self.stop.is_set() and not force:
+                    break
+        st.wait_out += time.perf_counter() - t0
+
+    @staticmethod
+    def _drain(inp):
+        """ Empty a queue until its end marker, so that the previous stage can finish """
+        while inp.get() is not None:
+            pass
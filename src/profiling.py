@@ -0,0 +1,107 @@
+import csv
+import json
+import time
+from collections import deque
+import numpy as np
+
+# Stages of DvsSensor.update, in order
+STAGES = ['convert', 'tiles', 'refractory', 'noise', 'substeps', 'integrate', 'merge']
+# Counters of a frame
+COUNTERS = ['rounds', 'n_substeps', 'n_fast', 'signal_on', 'signal_off', 'noise_on', 'noise_off']
+
+
+class FrameProfiler():
+    """ Per-frame profile of DvsSensor.update
+        Enabled with dvs.set_profiling(), each call to update adds a record: the duration (s) of each stage (see
+        STAGES), the number of rounds of the threshold-crossing loop, the number of sub-steps and of sub-stepped
+        pixels, the signal and noise events of each polarity and the ratio of active pixels:
+
+            profiler = dvs.set_profiling()
+            for im in source:
+                ev = dvs.update(im, dt)
+            print(profiler.summary())
+            profiler.export("profile.csv")
+
+        A sensor without profiler (the default) only tests that it has none at each stage.
+    """
+    # records = deque()        # Records of the frames, the last max_frames ones
+    # n_frames = 0             # Number of frames profiled
+
+    def __init__(self, max_frames=None):
+        """ Args:
+                max_frames: number of records kept, all of them if None
+        """
+        self.records = deque(maxlen=max_frames)
+        self.n_frames = 0
+        self._rec = None
+        self._t = 0
+
+    def start(self, t, dt):
+        """ Start the record of a frame
+            Args:
+                t: time of the sensor before the frame (us)
+                dt: duration of the frame (us)
+        """
+        self._rec = {'frame': self.n_frames, 'time': int(t), 'dt': int(dt), 'total': 0.0, 'active_ratio': 1.0}
+        self._rec.update({s: 0.0 for s in STAGES})
+        self._rec.update({c: 0 for c in COUNTERS})
+        self._t = time.perf_counter()
+
+    def stage(self, name):
+        """ End a stage: its duration is the time since the previous stage """
+        t = time.perf_counter()
+        self._rec[name] += t - self._t
+        self._t = t
+
+    def count(self, name, n):
+        """ Add n to a counter of the frame """
+        self._rec[name] += int(n)
+
+    def set(self, name, value):
+        """ Set a value of the record of the frame """
+        self._rec[name] = value
+
+    def end(self):
+        """ End the record of the frame """
+        self._rec['total'] = sum(self._rec[s] for s in STAGES)
+        self.records.append(self._rec)
+        self.n_frames += 1
+        self._rec = None
+
+    def clear(self):
+        """ Forget the records """
+        self.records.clear()
+
+    def summary(self):
+        """ Statistics of the frames recorded
+            Returns:
+                dict with the number of frames, the mean duration of each stage and of a frame (s), its share of
+                the time of a frame, the totals of the counters and the mean number of rounds and active ratio
+        """
+        n = len(self.records)
+        if n == 0:
+            return {'frames': 0}
+        total = sum(r['total'] for r in self.records)
+        summary = {'frames': n, 'total': total / n, 'fps': n / total if total > 0 else 0.0}
+        for s in STAGES:
+            t = sum(r[s] for r in self.records)
+            summary[s] = t / n
+            summary[s + '_share'] = t / total if total > 0 else 0.0
+        for c in COUNTERS:
+            summary[c] = sum(r[c] for r in self.records)
+        summary['mean_rounds'] = summary['rounds'] / n
+        summary['active_ratio'] = float(np.mean([r['active_ratio'] for r in self.records]))
+        return summary
+
+    def export(self, filename):
+        """ Save the records, in CSV if filename ends with .csv, in JSON otherwise """
+        records = list(self.records)
+        if filename.endswith('.csv'):
+            with open(filename, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=['frame', 'time', 'dt', 'total'] + STAGES + COUNTERS +
+                                        ['active_ratio'])
+                writer.writeheader()
+                writer.writerows(records)
+        else:
+            with open(filename, 'w') as f:
+                json.dump({'stages': STAGES, 'counters': COUNTERS, 'records': records}, f)
@@ -0,0 +1,152 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import cv2
+from dat_files import load_dat_index, load_dat_window, read_dat_header
+from representations import TimeSurface, count_image, pixel_index
+
+# Rendering of the frames
+RENDER_TIMESURFACE = 'timesurface'  # Last event of each pixel, decaying exponentially with its age
+RENDER_BINARY = 'binary'            # Polarity of the last event of each pixel during the frame
+RENDER_COUNT = 'count'              # Number of ON minus OFF events of each pixel during the frame
+
+TIMESURFACE_SPAN = 5  # Events older than TIMESURFACE_SPAN * tau are not rendered in the time surfaces
+
+_worker = {}  # State of the rendering processes
+
+
+def render_frames(ts, x, y, p, t_ends, width, height, frame_us, mode=RENDER_TIMESURFACE, tau=None, count_max=4,
+                  colormap=cv2.COLORMAP_VIRIDIS, display_time=True):
+    """ Render consecutive frames from sorted events
+        Args:
+            ts, x, y, p: events, sorted by timestamps, starting early enough for the first frame
+            t_ends: end (us) of each frame, increasing
+            width, height: size of the sensor
+            frame_us: duration of a frame (us)
+            mode: RENDER_TIMESURFACE, RENDER_BINARY or RENDER_COUNT
+            tau: decay of the time surfaces (us), 3 * frame_us if None
+            count_max: number of events giving the full scale in RENDER_COUNT
+            colormap: OpenCV colormap applied to the frames, None for greylevels
+            display_time: write the time of the frame in the frame
+        Returns:
+            list of BGR images
+    """
+    tau = 3 * frame_us if tau is None else tau
+    ts = np.asarray(ts, dtype=np.int64)
+    t_ends = np.asarray(t_ends, dtype=np.int64)
+    pol = np.asarray(p, dtype=np.int16)
+    ends = np.searchsorted(ts, t_ends, side='left')
+    starts = np.searchsorted(ts, t_ends - frame_us, side='left')
+    if mode == RENDER_TIMESURFACE:
+        surface = TimeSurface(width, height, tau)
+        i_prev = 0
+    elif mode == RENDER_BINARY:
+        flat = pixel_index(x, y, width)
+    elif mode == RENDER_COUNT:
+        counts = np.zeros((2, height, width), dtype=np.int32)
+    img = np.empty((height, width), dtype=np.float32)
+    frames = []
+    for k, t in enumerate(t_ends):
+        sl = slice(starts[k], ends[k])
+        if mode == RENDER_TIMESURFACE:
+            sl = slice(i_prev, ends[k])
+            surface.update((ts[sl], x[sl], y[sl], pol[sl]))
+            i_prev = ends[k]
+            img = 125 + 125 * surface.render(t, out=img, signed=True)
+        elif mode == RENDER_BINARY:
+            img[:] = 125
+            img.reshape(-1)[flat[sl]] = pol[sl] * 255
+        elif mode == RENDER_COUNT:
+            count_image((ts[sl], x[sl], y[sl], pol[sl]), width, height, out=counts)
+            img = 125 + 125 * np.clip((counts[1] - counts[0]) / count_max, -1, 1)
+        else:
+            raise ValueError("Unknown rendering mode {}".format(mode))
+        im = np.clip(img, 0, 255).astype(np.uint8)
+        if display_time:
+            im = cv2.putText(im, '{} us'.format(int(t)), (0, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, 255)
+        frames.append(cv2.applyColorMap(im, colormap) if colormap is not None else
+                      cv2.cvtColor(im, cv2.COLOR_GRAY2BGR))
+    return frames
+
+
+def render_dat_video(filename, output, frame_us=1000, fps=20.0, mode=RENDER_TIMESURFACE, tau=None, count_max=4,
+                     t_start=None, t_stop=None, width=None, height=None, colormap=cv2.COLORMAP_VIRIDIS,
+                     fourcc='MJPG', n_workers=None, frames_per_task=16):
+    """ Render a .dat file into a video, with frames rendered in parallel by a pool of processes
+        The frames are split into tasks of consecutive frames. Each process reads only the events of its frames
+        through the sidecar index of the file (built if it does not exist, see load_dat_index), renders them and
+        gives them back in order to the VideoWriter.
+        Args:
+            filename: path of the .dat file
+            output: path of the video
+            frame_us: duration of a frame (us)
+            fps: frame rate of the video
+            mode, tau, count_max, colormap: see render_frames
+            t_start, t_stop: time window rendered (us), the whole file if None
+            width, height: size of the sensor, read from the header of the file if None
+            fourcc: codec of the video
+            n_workers: number of processes, os.cpu_count() if None, 0 to render in the calling process
+            frames_per_task: number of consecutive frames rendered by a task
+        Returns:
+            number of frames written
+    """
+    header = read_dat_header(filename)
+    width = header['width'] if width is None else width
+    height = header['height'] if height is None else height
+    if width is None or height is None:
+        raise ValueError("The size of the sensor is not in the header of {}".format(filename))
+    index = load_dat_index(filename, build=True)
+    if index.n_events == 0:
+        return 0
+    t_start = index.t_first if t_start is None else t_start
+    t_stop = index.t_last + 1 if t_stop is None else t_stop
+    n_frames = max(0, -(-(t_stop - t_start) // frame_us))
+    params = dict(width=width, height=height, frame_us=frame_us, mode=mode, tau=tau, count_max=count_max,
+                  colormap=colormap)
+    tasks = [(t_start, k, min(k + frames_per_task, n_frames)) for k in range(0, n_frames, frames_per_task)]
+
+    out = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*fourcc), fps, (width, height))
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    try:
+        if n_workers <= 0:
+            _init_worker(filename, params)
+            for task in tasks:
+                for im in _render_task(task):
+                    out.write(im)
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                     initargs=(filename, params)) as pool:
+                pending = deque()
+                for task in tasks:
+                    pending.append(pool.submit(_render_task, task))
+                    if len(pending) >= 2 * n_workers:
+                        for im in pending.popleft().result():
+                            out.write(im)
+                while len(pending) > 0:
+                    for im in pending.popleft().result():
+                        out.write(im)
+    finally:
+        out.release()
+    return n_frames
+
+
+def _init_worker(filename, params):
+    """ Load the index of the file once per process """
+    _worker['filename'] = filename
+    _worker['index'] = load_dat_index(filename, build=True)
+    _worker['params'] = params
+
+
+def _render_task(task):
+    """ Render the frames k0 to k1 (excluded) of the video """
+    t_start, k0, k1 = task
+    params = _worker['params']
+    frame_us = params['frame_us']
+    t_ends = t_start + frame_us * np.arange(k0 + 1, k1 + 1, dtype=np.int64)
+    t_first = int(t_ends[0]) - frame_us
+    if params['mode'] == RENDER_TIMESURFACE:
+        tau = 3 * frame_us if params['tau'] is None else params['tau']
+        t_first -= int(TIMESURFACE_SPAN * tau)
+    ts, x, y, p = load_dat_window(_worker['filename'], max(0, t_first), int(t_ends[-1]), _worker['index'])
+    return render_frames(ts, x, y, p, t_ends, **params)
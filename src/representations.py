@@ -0,0 +1,164 @@
+import numpy as np
+from event_buffer import EventBuffer
+
+
+def event_arrays(ev):
+    """ Arrays of the events of an EventBuffer, or of a tuple (ts, x, y, p) as returned by load_dat_event """
+    if isinstance(ev, EventBuffer):
+        return ev.ts[:ev.i], ev.x[:ev.i], ev.y[:ev.i], ev.p[:ev.i]
+    return ev
+
+
+def pixel_index(x, y, width, p=None, height=None):
+    """ Flattened index of the pixels of events, per polarity (p * height * width + y * width + x) if p is given """
+    ind = np.asarray(y, dtype=np.int64) * width + np.asarray(x, dtype=np.int64)
+    if p is not None:
+        ind += np.asarray(p, dtype=np.int64) * (width * height)
+    return ind
+
+
+def count_image(ev, width, height, out=None, accumulate=False):
+    """ Number of events of each pixel and polarity
+        Args:
+            ev: EventBuffer or (ts, x, y, p)
+            width, height: size of the sensor
+            out: preallocated array of shape (2, height, width), allocated if None
+            accumulate: add the counts to out instead of replacing them, to accumulate several packets
+        Returns:
+            array (2, height, width) of the counts of the OFF (0) and ON (1) events
+    """
+    ts, x, y, p = event_arrays(ev)
+    if out is None:
+        out = np.zeros((2, height, width), dtype=np.int32)
+    counts = np.bincount(pixel_index(x, y, width, p, height), minlength=2 * width * height)
+    if accumulate:
+        out += counts.reshape(out.shape).astype(out.dtype, copy=False)
+    else:
+        out[:] = counts.reshape(out.shape)
+    return out
+
+
+def voxel_grid(ev, width, height, n_bins, t_start=None, t_stop=None, out=None, signed=True):
+    """ Voxel grid of events, interpolated bilinearly in time
+        The window [t_start, t_stop] is mapped to the bins 0 to n_bins - 1, each event is split between the two
+        bins surrounding its timestamp with weights linear in their distance.
+        Args:
+            ev: EventBuffer or (ts, x, y, p)
+            width, height: size of the sensor
+            n_bins: number of temporal bins
+            t_start, t_stop: window of the grid (us), the first and last events if None
+            out: preallocated array of shape (n_bins, height, width), allocated if None
+            signed: OFF events count -1 and ON events +1, otherwise every event counts 1
+        Returns:
+            array (n_bins, height, width) of float32
+    """
+    ts, x, y, p = event_arrays(ev)
+    if out is None:
+        out = np.zeros((n_bins, height, width), dtype=np.float32)
+    out[:] = 0
+    if len(ts) == 0:
+        return out
+    ts = np.asarray(ts, dtype=np.float64)
+    t_start = ts[0] if t_start is None else t_start
+    t_stop = ts[-1] if t_stop is None else t_stop
+    t_norm = np.clip((ts - t_start) * ((n_bins - 1) / max(t_stop - t_start, 1)), 0, n_bins - 1)
+    b = np.minimum(t_norm.astype(np.int64), n_bins - 2) if n_bins > 1 else np.zeros(len(ts), dtype=np.int64)
+    frac = t_norm - b
+    value = 2.0 * np.asarray(p, dtype=np.float64) - 1 if signed else np.ones(len(ts))
+    ind = pixel_index(x, y, width)
+    size = width * height
+    grid = np.bincount(b * size + ind, weights=value * (1 - frac), minlength=n_bins * size)
+    if n_bins > 1:
+        grid += np.bincount((b + 1) * size + ind, weights=value * frac, minlength=n_bins * size)
+    out += grid.reshape(out.shape)
+    return out
+
+
+def event_windows(ev, window_us=None, window_n=None, t_start=None, t_stop=None):
+    """ Split sorted events into consecutive windows of fixed duration or fixed number of events
+        Args:
+            ev: EventBuffer or (ts, x, y, p), sorted by timestamps
+            window_us: duration of the windows (us)
+            window_n: number of events of the windows, if window_us is None
+            t_start, t_stop: time span split into windows of window_us, the first and last events if None
+        Yields:
+            (t_start, t_stop, (ts, x, y, p)) of each window, the arrays are views of the events
+    """
+    ts, x, y, p = event_arrays(ev)
+    if window_us is None and window_n is None:
+        raise ValueError("window_us or window_n has to be given")
+    if len(ts) == 0:
+        return
+    if window_us is not None:
+        t0 = int(ts[0]) if t_start is None else int(t_start)
+        t1 = int(ts[-1]) + 1 if t_stop is None else int(t_stop)
+        edges = np.arange(t0, t1 + window_us, window_us, dtype=np.int64)
+        edges = edges[:max(2, -(-(t1 - t0) // window_us) + 1)]
+        bounds = np.searchsorted(ts, edges, side='left')
+        for k in range(len(edges) - 1):
+            sl = slice(bounds[k], bounds[k + 1])
+            yield int(edges[k]), int(edges[k + 1]), (ts[sl], x[sl], y[sl], p[sl])
+    else:
+        for i in range(0, len(ts), window_n):
+            sl = slice(i, i + window_n)
+            yield int(ts[sl][0]), int(ts[sl][-1]) + 1, (ts[sl], x[sl], y[sl], p[sl])
+
+
+class TimeSurface():
+    """ Time surfaces of a stream of events
+        Keeps the timestamp of the last event of each pixel and polarity, updated packet by packet, and renders it
+        with an exponential decay:
+
+            surface = TimeSurface(width, height, tau=30000)
+            for ev in packets:
+                surface.update(ev)
+                img = surface.render(t, out=img, signed=True)
+    """
+    # width = 0                # Width of the sensor
+    # height = 0               # Height of the sensor
+    # tau = 30000              # Decay of the surfaces (us)
+    # last_ts = np.zeros((2, height, width))  # Timestamp of the last OFF and ON event of each pixel, -inf if none
+
+    def __init__(self, width, height, tau):
+        """ Args:
+                width, height: size of the sensor
+                tau: decay of the surfaces (us)
+        """
+        self.width = width
+        self.height = height
+        self.tau = tau
+        self.last_ts = np.full((2, height, width), -np.inf)
+
+    def reset(self):
+        """ Forget the events received so far """
+        self.last_ts[:] = -np.inf
+
+    def update(self, ev):
+        """ Add sorted events to the surfaces
+            Args:
+                ev: EventBuffer or (ts, x, y, p)
+        """
+        ts, x, y, p = event_arrays(ev)
+        self.last_ts.reshape(-1)[pixel_index(x, y, self.width, p, self.height)] = ts
+
+    def render(self, t, out=None, signed=False):
+        """ Decayed surfaces at time t
+            Args:
+                t: time of the rendering (us), after the events received
+                out: preallocated array, of shape (height, width) if signed, (2, height, width) otherwise
+                signed: render the last event of each pixel, -1 to 1 for OFF to ON events, instead of one surface
+                        for each polarity
+            Returns:
+                array of float32 values between 0 and 1 (-1 and 1 if signed)
+        """
+        if signed:
+            if out is None:
+                out = np.zeros((self.height, self.width), dtype=np.float32)
+            on = self.last_ts[1] >= self.last_ts[0]
+            np.exp((np.maximum(self.last_ts[0], self.last_ts[1]) - t) / self.tau, out=out, casting='unsafe')
+            out[~on] *= -1
+            return out
+        if out is None:
+            out = np.zeros((2, self.height, self.width), dtype=np.float32)
+        np.exp((self.last_ts - t) / self.tau, out=out, casting='unsafe')
+        return out
@@ -0,0 +1,203 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Number of spans kept by default, the oldest ones are dropped
+TRACE_CAPACITY = 1 << 20
+
+_tracer = None  # Tracer recording the spans, None if tracing is disabled
+
+
+class Tracer():
+    """ Ring buffer of the spans of a run, exported as a Chrome trace
+        A span is the execution of a function (see traced) or of a block (see span) by a thread. The spans of all
+        the threads are recorded in a bounded deque, under a lock counting them. The trace can be opened in
+        chrome://tracing or https://ui.perfetto.dev, with one row per thread, so that the decoding of the frames,
+        the sensor, the arbiter, the display and the writing of the files can be seen overlapping or waiting
+        for each other:
+
+            start_tracing()
+            ...simulation...
+            stop_tracing().save("trace.json")
+    """
+    # capacity = TRACE_CAPACITY  # Number of spans kept
+    # spans = deque()            # (name, category, start (ns), end (ns), thread id, args)
+    # threads = {}               # Name of each thread id
+    # t0 = 0                     # Origin of the timestamps (ns)
+    # n_spans = 0                # Number of spans recorded, including the dropped ones
+
+    def __init__(self, capacity=TRACE_CAPACITY):
+        """ Args:
+                capacity: number of spans kept
+        """
+        self.capacity = capacity
+        self.spans = deque(maxlen=capacity)
+        self.threads = {}
+        self.t0 = time.perf_counter_ns()
+        self.n_spans = 0
+        self.lock = threading.Lock()
+
+    def add(self, name, cat, t_start, t_end, args=None):
+        """ Record a span
+            Args:
+                name: name of the span
+                cat: category of the span, e.g. 'sensor'
+                t_start, t_end: time.perf_counter_ns() at the beginning and the end of the span
+                args: dict of values shown with the span
+        """
+        tid = threading.get_ident()
+        if tid not in self.threads:
+            self.threads[tid] = threading.current_thread().name
+        with self.lock:
+            self.spans.append((name, cat, t_start, t_end, tid, args))
+            self.n_spans += 1
+
+    def instant(self, name, cat='', args=None):
+        """ Record an event without duration, e.g. a dropped frame """
+        t = time.perf_counter_ns()
+        self.add(name, cat, t, t, args)
+
+    def dropped(self):
+        """ Number of spans dropped by the ring buffer """
+        with self.lock:
+            return self.n_spans - len(self.spans)
+
+    def events(self):
+        """ Spans in the Chrome Trace Event format
+            Returns:
+                list of dicts: complete events ('X') in us, and the names of the threads ('M')
+        """
+        pid = os.getpid()
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                  for tid, name in list(self.threads.items())]
+        with self.lock:
+            spans = list(self.spans)
+        for name, cat, t_start, t_end, tid, args in spans:
+            ev = {'name': name, 'cat': cat, 'pid': pid, 'tid': tid, 'ts': (t_start - self.t0) / 1e3}
+            if t_end > t_start:
+                ev['ph'] = 'X'
+                ev['dur'] = (t_end - t_start) / 1e3
+            else:
+                ev['ph'] = 'i'
+                ev['s'] = 't'
+            if args is not None:
+                ev['args'] = args
+            events.append(ev)
+        return events
+
+    def save(self, filename):
+        """ Save the trace in the Chrome Trace Event JSON format """
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': self.events(), 'displayTimeUnit': 'ms',
+                       'otherData': {'dropped_spans': self.dropped()}}, f)
+
+    def save_folded(self, filename):
+        """ Save the spans as folded stacks ("thread;outer;inner self_time_us" lines), for flamegraph.pl
+            The stacks are given by the nesting of the spans of each thread.
+        """
+        stacks = {}
+        by_thread = {}
+        with self.lock:
+            spans = list(self.spans)
+        for name, cat, t_start, t_end, tid, args in spans:
+            by_thread.setdefault(tid, []).append((t_start, -t_end, name))
+        for tid, spans in by_thread.items():
+            spans.sort()
+            open_spans = []  # [end, path, self time] of the enclosing spans
+            for t_start, neg_end, name in spans:
+                t_end = -neg_end
+                while len(open_spans) > 0 and open_spans[-1][0] <= t_start:
+                    _fold(stacks, open_spans.pop())
+                parent = open_spans[-1] if len(open_spans) > 0 else None
+                path = (parent[1] if parent is not None else self.threads.get(tid, str(tid))) + ';' + name
+                if parent is not None:
+                    parent[2] -= min(t_end, parent[0]) - t_start
+                open_spans.append([t_end, path, t_end - t_start])
+            while len(open_spans) > 0:
+                _fold(stacks, open_spans.pop())
+        with open(filename, 'w') as f:
+            for path, t in sorted(stacks.items()):
+                if t >= 1000:
+                    f.write("{} {}\n".format(path, t // 1000))
+
+
+def _fold(stacks, span):
+    """ Add the self time of a closed span to its stack """
+    stacks[span[1]] = stacks.get(span[1], 0) + max(0, span[2])
+
+
+def start_tracing(capacity=TRACE_CAPACITY):
+    """ Start recording the spans of all the threads
+        Args:
+            capacity: number of spans kept
+        Returns:
+            Tracer
+    """
+    global _tracer
+    _tracer = Tracer(capacity)
+    return _tracer
+
+
+def stop_tracing():
+    """ Stop recording the spans
+        Returns:
+            Tracer with the spans recorded, None if tracing was not started
+    """
+    global _tracer
+    tracer = _tracer
+    _tracer = None
+    return tracer
+
+
+def get_tracer():
+    """ Tracer recording the spans, None if tracing is disabled """
+    return _tracer
+
+
+class span():
+    """ Record the execution of a block as a span, nothing is recorded if tracing is disabled
+
+            with span('decode', 'source', frame=i):
+                ...
+    """
+
+    def __init__(self, name, cat='', **args):
+        self.name = name
+        self.cat = cat
+        self.args = args if len(args) > 0 else None
+        self.tracer = _tracer
+
+    def __enter__(self):
+        if self.tracer is not None:
+            self.t_start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.tracer is not None:
+            self.tracer.add(self.name, self.cat, self.t_start, time.perf_counter_ns(), self.args)
+
+
+def traced(cat, name=None):
+    """ Decorator recording each call of a function as a span when tracing is enabled
+        Args:
+            cat: category of the spans
+            name: name of the spans, the qualified name of the function if None
+    """
+    def decorate(fn):
+        span_name = fn.__qualname__ if name is None else name
+
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return fn(*args, **kwargs)
+            t_start = time.perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                tracer.add(span_name, cat, t_start, time.perf_counter_ns())
+        return call
+    return decorate
@@ -0,0 +1,123 @@
+import json
+import os
+import cv2
+import numpy as np
+import pytest
+import batch
+from batch import STATUS_FAILED, STATUS_OK, load_manifest, run_batch, summarize
+from dat_files import load_dat_event
+from iebcs import main
+
+WIDTH, HEIGHT = 40, 30
+MANIFEST = """
+output_dir = "out"
+
+[defaults.sensor]
+noise = "freq"
+seed = 0
+
+[defaults.simulation]
+dt = 1000
+
+[[jobs]]
+name = "th02"
+input = {type = "images", path = "frames"}
+sensor = {th_pos = 0.2, th_neg = 0.2}
+
+[[jobs]]
+name = "th05"
+input = {type = "images", path = "frames"}
+sensor = {th_pos = 0.5, th_neg = 0.5}
+
+[[jobs]]
+name = "missing"
+input = {type = "images", path = "missing"}
+"""
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    os.makedirs(str(tmp_path / 'frames'))
+    x = np.arange(WIDTH)
+    for k in range(8):
+        im = np.full((HEIGHT, WIDTH), 20, dtype=np.uint8)
+        im[:, (x >= 2 * k) & (x < 2 * k + 4)] = 30
+        cv2.imwrite(str(tmp_path / 'frames' / 'im{:02d}.png'.format(k)), im)
+    with open(str(tmp_path / 'jobs.toml'), 'w') as f:
+        f.write(MANIFEST)
+    return str(tmp_path / 'jobs.toml')
+
+
+def test_a_failed_job_is_retried_and_reported(manifest, tmp_path):
+    jobs = load_manifest(manifest)
+    assert [job['name'] for job in jobs] == ['th02', 'th05', 'missing']
+    assert jobs[0]['config']['output']['path'] == str(tmp_path / 'out' / 'th02.dat')
+    assert jobs[0]['cost'] == 7 * WIDTH * HEIGHT and jobs[2]['cost'] == 0
+
+    results, total = run_batch(jobs, n_workers=0, retries=2, progress=False)
+    assert [r['name'] for r in results] == ['th02', 'th05', 'missing']
+    assert [r['status'] for r in results] == [STATUS_OK, STATUS_OK, STATUS_FAILED]
+    assert [r['attempts'] for r in results] == [1, 1, 3]
+    assert 'missing' in results[2]['error']
+    for r in results[:2]:
+        assert r['frames'] == 7 and r['events'] == len(load_dat_event(r['output'])[0]) > 0
+    # The lower thresholds give more events, the second job replays the frames of the first one
+    assert results[0]['events'] > results[1]['events']
+    assert [r['frame_cache_hit'] for r in results[:2]] == [False, True]
+
+    summary = summarize(results, total, 0)
+    assert (summary['jobs'], summary['ok'], summary['failed'], summary['retried']) == (3, 2, 1, 1)
+    assert summary['frames'] == 14 and summary['frame_cache_hits'] == 1
+
+
+def test_a_job_which_fails_once_succeeds_when_retried(manifest, monkeypatch):
+    jobs = load_manifest(manifest)[:2]
+    calls = []
+    simulate = batch.simulate
+
+    def flaky(config, *args, **kwargs):
+        calls.append(config['output']['path'])
+        if len(calls) == 1:
+            raise IOError("Flaky input")
+        return simulate(config, *args, **kwargs)
+
+    monkeypatch.setattr(batch, 'simulate', flaky)
+    results, _ = run_batch(jobs, n_workers=0, retries=1, progress=False)
+    assert [(r['status'], r['attempts']) for r in results] == [(STATUS_OK, 2), (STATUS_OK, 1)]
+    assert calls == [jobs[0]['config']['output']['path'], jobs[1]['config']['output']['path'],
+                     jobs[0]['config']['output']['path']]
+
+    # Without retries the error is reported
+    calls.clear()
+    results, _ = run_batch(jobs, n_workers=0, retries=0, progress=False)
+    assert results[0]['status'] == STATUS_FAILED and 'Flaky input' in results[0]['error']
+    assert results[0]['attempts'] == 1 and results[1]['status'] == STATUS_OK
+
+
+def test_a_dead_worker_only_fails_its_own_job(manifest, monkeypatch):
+    jobs = load_manifest(manifest)[:2]
+    simulate = batch.simulate
+
+    def crash(config, *args, **kwargs):
+        if config['output']['path'].endswith('th05.dat'):
+            os._exit(1)
+        return simulate(config, *args, **kwargs)
+
+    # The workers are forked with the patched function
+    monkeypatch.setattr(batch, 'simulate', crash)
+    results, _ = run_batch(jobs, n_workers=2, retries=1, jobs_per_task=2, progress=False)
+    assert (results[0]['status'], results[0]['attempts']) == (STATUS_OK, 1)
+    assert (results[1]['status'], results[1]['attempts']) == (STATUS_FAILED, 2)
+    assert results[1]['error'] == "The worker process died"
+
+
+def test_command_line_exits_with_an_error_when_a_job_failed(manifest, tmp_path, capsys):
+    summary_file = str(tmp_path / 'summary.json')
+    with pytest.raises(SystemExit) as e:
+        main(['batch', manifest, '--workers', '0', '--retries', '0', '--no-progress', '--summary', summary_file])
+    assert e.value.code == 1
+    assert 'Job missing failed after 1 attempt(s)' in capsys.readouterr().out
+    with open(summary_file) as f:
+        saved = json.load(f)
+    assert saved['summary']['ok'] == 2 and saved['summary']['failed'] == 1
+    assert [r['name'] for r in saved['jobs']] == ['th02', 'th05', 'missing']
@@ -0,0 +1,79 @@
+import os
+import shutil
+import numpy as np
+from checkpoint import save_checkpoint, load_checkpoint, restore_checkpoint
+from dat_files import DatWriter, load_dat_event
+from dvs_sensor import DvsSensor
+
+WIDTH, HEIGHT = 40, 30
+DT = 1000
+
+
+def frames(n):
+    x = np.arange(WIDTH, dtype=float)[None, :]
+    for k in range(n + 1):
+        yield np.repeat(100 + 900 / (1 + np.exp(-(x - 2 * k) / 2.0)), HEIGHT, axis=0)
+
+
+def make_sensor():
+    np.random.seed(0)
+    dvs = DvsSensor("Test")
+    dvs.initCamera(WIDTH, HEIGHT, lat=100, jit=10, ref=100, tau=40, th_pos=0.4, th_neg=0.4, th_noise=0.01,
+                   bgnp=0.1, bgnn=0.01)
+    return dvs
+
+
+def test_resume_gives_the_same_events(tmp_path):
+    ims = list(frames(20))
+    ref = str(tmp_path / 'ref.dat')
+    dvs = make_sensor()
+    dvs.init_image(ims[0])
+    with DatWriter(ref, WIDTH, HEIGHT, sort_window=10000) as writer:
+        for im in ims[1:]:
+            writer.write(dvs.update(im, DT))
+
+    out = str(tmp_path / 'out.dat')
+    ckpt = str(tmp_path / 'ckpt')
+    dvs = make_sensor()
+    dvs.init_image(ims[0])
+    writer = DatWriter(out, WIDTH, HEIGHT, sort_window=10000)
+    for im in ims[1:11]:
+        writer.write(dvs.update(im, DT))
+    save_checkpoint(ckpt, sensor=dvs, writer=writer, frame=11)
+    writer.f.close()
+
+    dvs = DvsSensor("Resumed")
+    state = restore_checkpoint(ckpt, sensor=dvs, mmap=False)
+    with DatWriter(out, WIDTH, HEIGHT, sort_window=10000, resume=state['writer']) as writer:
+        for im in ims[state['extra']['frame']:]:
+            writer.write(dvs.update(im, DT))
+    assert len(load_dat_event(ref)[0]) > 0
+    for a, b in zip(load_dat_event(ref), load_dat_event(out)):
+        np.testing.assert_array_equal(a, b)
+
+
+class State():
+    def __init__(self, value):
+        self.value = value
+
+    def get_state(self):
+        return {'a': np.full(3, self.value)}
+
+
+def test_interrupted_saves_keep_the_last_checkpoint(tmp_path):
+    path = str(tmp_path / 'ckpt')
+    save_checkpoint(path, sensor=State(1), frame=1)
+    # Stopped after moving the checkpoint to .old, before replacing it
+    os.replace(path, path + '.old')
+    ckpt = load_checkpoint(path)
+    assert ckpt['extra']['frame'] == 1
+    np.testing.assert_array_equal(ckpt['sensor']['a'], [1, 1, 1])
+    del ckpt
+    save_checkpoint(path, sensor=State(2), frame=2)
+    assert load_checkpoint(path, mmap=False)['extra']['frame'] == 2
+    assert not os.path.exists(path + '.old')
+    # Stopped before deleting .old
+    shutil.copytree(path, path + '.old')
+    save_checkpoint(path, sensor=State(3), frame=3)
+    assert load_checkpoint(path, mmap=False)['extra']['frame'] == 3
+    assert not os.path.exists(path + '.old')
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+from dat_files import (DatWriter, Evt2Writer, PARALLEL_MIN_CHUNK, decode_dat_records, load_dat_event,
+                       load_dat_index, load_dat_window, load_evt2_event, memmap_dat_event, merge_dat_files,
+                       pack_events, read_dat_header, write_event_dat)
+
+WIDTH, HEIGHT = 64, 48
+
+
+def make_events(n, t0=0, span=1000000, seed=0):
+    rng = np.random.default_rng(seed)
+    ts = np.sort(rng.integers(t0, t0 + span, n)).astype(np.uint64)
+    return ts, rng.integers(0, WIDTH, n), rng.integers(0, HEIGHT, n), rng.integers(0, 2, n)
+
+
+def write_packets(filename, events, n_packets=10, **kwargs):
+    with DatWriter(filename, WIDTH, HEIGHT, **kwargs) as writer:
+        for packet in zip(*(np.array_split(a, n_packets) for a in events)):
+            writer.write_events(*packet)
+
+
+def assert_events_equal(a, b):
+    assert len(a[0]) == len(b[0])
+    for u, v in zip(a, b):
+        np.testing.assert_array_equal(np.asarray(u, dtype=np.int64), np.asarray(v, dtype=np.int64))
+
+
+def test_write_read_round_trip(tmp_path):
+    events = make_events(10000)
+    filename = str(tmp_path / 'ev.dat')
+    write_event_dat(filename, *events, width=WIDTH, height=HEIGHT)
+    header = read_dat_header(filename)
+    assert (header['width'], header['height'], header['n_events']) == (WIDTH, HEIGHT, 10000)
+    assert_events_equal(load_dat_event(filename), events)
+
+    write_packets(filename, events, threaded=True)
+    assert_events_equal(load_dat_event(filename), events)
+
+
+def test_rollover_uses_epoch_markers(tmp_path):
+    events = make_events(10000, t0=(1 << 32) - 500000)
+    filename = str(tmp_path / 'ev.dat')
+    write_packets(filename, events)
+    # One marker record before the first event of the epoch 1
+    assert read_dat_header(filename)['n_events'] == 10001
+    ts, x, y, pol = load_dat_event(filename)
+    assert ts.dtype == np.uint64
+    assert_events_equal((ts, x, y, pol), events)
+
+
+def test_index_window_matches_full_scan(tmp_path):
+    events = make_events(20000, t0=(1 << 32) - 500000)
+    filename = str(tmp_path / 'ev.dat')
+    write_packets(filename, events, index=True, index_every_n=1000, index_every_us=5000)
+    index = load_dat_index(filename)
+    assert index is not None
+    ts = load_dat_event(filename)[0]
+    for t_start, t_stop in [(int(ts[0]), int(ts[-1]) + 1), ((1 << 32) - 123457, (1 << 32) + 98765),
+                            ((1 << 32) + 1000, (1 << 32) + 1001)]:
+        keep = (events[0] >= t_start) & (events[0] < t_stop)
+        assert_events_equal(load_dat_window(filename, t_start, t_stop, index), [a[keep] for a in events])
+
+
+def test_merge_is_sorted(tmp_path):
+    a, b = make_events(5000, seed=1), make_events(7000, t0=200000, seed=2)
+    write_event_dat(str(tmp_path / 'a.dat'), *a, width=WIDTH, height=HEIGHT)
+    write_event_dat(str(tmp_path / 'b.dat'), *b, width=WIDTH, height=HEIGHT)
+    output = str(tmp_path / 'merged.dat')
+    n = merge_dat_files([str(tmp_path / 'a.dat'), str(tmp_path / 'b.dat')], output, offsets=[(0, 0), (WIDTH, 0)],
+                        chunk_size=1000)
+    assert n == 12000
+    assert read_dat_header(output)['width'] == 2 * WIDTH
+    ts, x, y, pol = load_dat_event(output)
+    assert np.all(np.diff(ts.astype(np.int64)) >= 0)
+    # The events of each file keep their order
+    from_b = x >= WIDTH
+    assert_events_equal((ts[~from_b], x[~from_b], y[~from_b], pol[~from_b]), a)
+    assert_events_equal((ts[from_b], x[from_b] - WIDTH, y[from_b], pol[from_b]), b)
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib', 'lzma'])
+def test_evt2_round_trip(tmp_path, compression):
+    events = make_events(10000)
+    filename = str(tmp_path / 'ev.raw')
+    with Evt2Writer(filename, WIDTH, HEIGHT, compression=compression, chunk_size=1000) as writer:
+        for packet in zip(*(np.array_split(a, 7) for a in events)):
+            writer.write_events(*packet)
+    assert_events_equal(load_evt2_event(filename), events)
+
+
+def test_threaded_pack_and_decode(tmp_path):
+    events = make_events(4 * PARALLEL_MIN_CHUNK, t0=(1 << 32) - 500000)
+    records = pack_events(*events, n_threads=1)
+    np.testing.assert_array_equal(pack_events(*events, n_threads=4), records)
+
+    filename = str(tmp_path / 'ev.dat')
+    write_event_dat(filename, *events, width=WIDTH, height=HEIGHT, n_threads=4)
+    data = memmap_dat_event(filename)
+    np.testing.assert_array_equal(data.reshape(-1), records)
+    assert_events_equal(decode_dat_records(data, n_threads=4), events)
+    assert_events_equal(load_dat_event(filename, n_threads=1), events)
+
+
+def test_merge_reads_past_chunks_of_markers(tmp_path):
+    a, b = make_events(50, t0=(1 << 32) - 25, span=50, seed=1), make_events(10, t0=(1 << 32) - 100, span=50, seed=2)
+    write_event_dat(str(tmp_path / 'a.dat'), *a, width=WIDTH, height=HEIGHT)
+    write_event_dat(str(tmp_path / 'b.dat'), *b, width=WIDTH, height=HEIGHT)
+    output = str(tmp_path / 'merged.dat')
+    # With chunks of one record, the epoch marker of each file is read alone
+    assert merge_dat_files([str(tmp_path / 'a.dat'), str(tmp_path / 'b.dat')], output, chunk_size=1) == 60
+    ts = load_dat_event(output)[0]
+    np.testing.assert_array_equal(ts, np.sort(np.concatenate((a[0], b[0]))))
@@ -0,0 +1,144 @@
+import numpy as np
+import pytest
+from noise_cache import FREQ
+from dvs_sensor import DvsSensor
+
+WIDTH, HEIGHT = 40, 30
+DT = 1600
+
+
+def make_sensor(seed=0, bgn=0.1, th_noise=0.01):
+    np.random.seed(seed)
+    dvs = DvsSensor("Test")
+    dvs.initCamera(WIDTH, HEIGHT, lat=100, jit=10, ref=100, tau=40, th_pos=0.4, th_neg=0.4, th_noise=th_noise,
+                   bgnp=bgn, bgnn=bgn)
+    return dvs
+
+
+def bar_frames(n, speed=1, low=100, high=1000):
+    """ Bright bar moving to the right on a static background, with a dark corner """
+    x = np.arange(WIDTH)
+    for k in range(n + 1):
+        im = np.full((HEIGHT, WIDTH), float(low))
+        im[:, (x >= speed * k) & (x < speed * k + 4)] = high
+        im[:4, :4] = 0
+        yield im
+
+
+def count_map(ev):
+    counts = np.zeros((2, HEIGHT, WIDTH), dtype=int)
+    np.add.at(counts, (ev[3], ev[2], ev[1]), 1)
+    return counts
+
+
+def simulate(dvs, frames, scale=None, dt=DT, init=True):
+    frames = iter(frames)
+    if init:
+        dvs.init_image(next(frames), scale=scale)
+    ev = []
+    for im in frames:
+        pk = dvs.update(im, dt, scale)
+        ev.append(np.stack([pk.ts[:pk.i].astype(np.int64), pk.x[:pk.i], pk.y[:pk.i], pk.p[:pk.i]]))
+    return np.concatenate(ev, axis=1)
+
+
+@pytest.mark.parametrize('dtype, scale', [(np.uint8, None), (np.uint16, 0.5)])
+def test_lookup_tables_give_the_events_of_float_images(dtype, scale):
+    high = 200 if dtype == np.uint8 else 2000
+    frames = [im.astype(dtype) for im in bar_frames(10, high=high)]
+    ref = simulate(make_sensor(), [im.astype(float) for im in frames], scale)
+    assert ref.shape[1] > 0
+    np.testing.assert_array_equal(simulate(make_sensor(), frames, scale), ref)
+
+
+@pytest.mark.parametrize('tile_size', [8, 16])
+def test_exact_tile_skipping_gives_the_events_of_plain_updates(tile_size):
+    ref = simulate(make_sensor(), bar_frames(20))
+    dvs = make_sensor()
+    dvs.set_tile_skipping(tile_size, 0)
+    out = simulate(dvs, bar_frames(20))
+    # The static tiles are skipped
+    assert dvs.active_ratio < 1
+    np.testing.assert_array_equal(out, ref)
+
+
+def test_substeps_follow_a_higher_frame_rate():
+    n_sub = 16
+    # Without noise, and with fixed thresholds which do not depend on the order of the random draws
+    dvs = make_sensor(bgn=1e-9, th_noise=0)
+    dvs.set_substeps(0.1, n_sub)
+    out = simulate(dvs, bar_frames(8, speed=2))
+
+    # Reference simulated with the frames interpolated in the log domain
+    def interpolated():
+        frames = bar_frames(8, speed=2)
+        prev = next(frames)
+        yield prev
+        for im in frames:
+            l0, l1 = np.log(prev + 1), np.log(im + 1)
+            for k in range(1, n_sub + 1):
+                yield np.exp(l0 + (l1 - l0) * (k / n_sub)) - 1
+            prev = im
+    ref = simulate(make_sensor(bgn=1e-9, th_noise=0), interpolated(), dt=DT // n_sub)
+    assert ref.shape[1] > 1000
+    # The interpolations only differ by rounding, which moves a few crossings by a sub-step
+    counts, ref_counts = count_map(out), count_map(ref)
+    assert np.count_nonzero(counts != ref_counts) <= 0.01 * counts.size
+    assert abs(out.shape[1] - ref.shape[1]) <= 0.01 * ref.shape[1]
+    assert abs(np.mean(out[0]) - np.mean(ref[0])) < DT / n_sub
+    # Sub-stepping is needed: the events of the frames are gathered at the beginning of the frames
+    plain = simulate(make_sensor(bgn=1e-9, th_noise=0), bar_frames(8, speed=2))
+    assert np.count_nonzero(count_map(plain) != ref_counts) > 0.01 * counts.size
+
+
+def test_lux_levels_are_interpolated_in_the_log_domain():
+    dvs = make_sensor()
+    dvs.bgn_lux = np.log(np.array([0.1, 161, 3000]) + 1)
+    lux = np.array([0.01, 0.1, 161, 3000, 1e5])
+    np.testing.assert_array_equal(dvs.get_lux_level(np.log(lux + 1)), [0, 0, 1, 2, 2])
+    # Halfway between two levels, each of them is picked half of the time
+    mid = np.full(100000, (dvs.bgn_lux[1] + dvs.bgn_lux[2]) / 2)
+    assert np.mean(dvs.get_lux_level(mid)) == pytest.approx(1.5, abs=0.01)
+    quarter = np.full(100000, 0.75 * dvs.bgn_lux[0] + 0.25 * dvs.bgn_lux[1])
+    assert np.mean(dvs.get_lux_level(quarter)) == pytest.approx(0.25, abs=0.01)
+    dvs.bgn_lux = dvs.bgn_lux[:1]
+    np.testing.assert_array_equal(dvs.get_lux_level(np.log(lux + 1)), np.zeros(5))
+
+
+def test_noise_follows_the_level_of_the_illumination(tmp_path):
+    # Noise at 1 kHz in the dark and at 0.01 Hz under 3000 lux
+    levels = []
+    for lux, freq in [(3000, 0.01), (0.1, 1000)]:
+        cdf = (FREQ >= freq).astype(float)[None, :]
+        names = [str(tmp_path / 'noise_{}_{}.npy'.format(pol, lux)) for pol in ['pos', 'neg']]
+        for name in names:
+            np.save(name, cdf)
+        levels.append((lux,) + tuple(names))
+    dvs = make_sensor()
+    dvs.init_bgn_lux(levels)
+    np.testing.assert_array_equal(dvs.bgn_lux, np.log(np.array([0.1, 3000]) + 1))
+    im = np.full((HEIGHT, WIDTH), 3000.0)
+    im[:, :WIDTH // 2] = 0.1
+    dvs.init_image(im)
+    for next_noise in [dvs.bgn_pos_next, dvs.bgn_neg_next]:
+        assert next_noise[:, :WIDTH // 2].max() <= 1000
+        assert next_noise[:, WIDTH // 2:].max() > 1000
+
+
+@pytest.mark.parametrize('setup', [None, lambda dvs: dvs.set_tile_skipping(8, 0), lambda dvs: dvs.set_substeps(0.1, 4)])
+def test_state_round_trip_in_the_middle_of_a_run(setup):
+    frames = list(bar_frames(20))
+    dvs = make_sensor()
+    if setup is not None:
+        setup(dvs)
+    simulate(dvs, frames[:11])
+    state = dvs.get_state()
+    ref = simulate(dvs, frames[11:], init=False)
+    assert ref.shape[1] > 0
+
+    # The state is a copy, the sensor goes on without changing it
+    resumed = DvsSensor("Resumed")
+    resumed.set_state(state)
+    assert resumed.time == 10 * DT
+    out = simulate(resumed, frames[11:], init=False)
+    np.testing.assert_array_equal(out, ref)
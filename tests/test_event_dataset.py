@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from dat_files import write_event_dat
+from event_dataset import REPR_COUNT, EventDataset
+
+WIDTH, HEIGHT = 32, 24
+
+
+def make_events(n, t0=0, span=100000, seed=0):
+    rng = np.random.default_rng(seed)
+    ts = np.sort(rng.integers(t0, t0 + span, n)).astype(np.uint64)
+    return ts, rng.integers(0, WIDTH, n), rng.integers(0, HEIGHT, n), rng.integers(0, 2, n)
+
+
+@pytest.fixture
+def files(tmp_path):
+    # The second file crosses the rollover of the 32 bits timestamps
+    events = [make_events(3000, seed=1), make_events(5000, t0=(1 << 32) - 40000, seed=2)]
+    for k, ev in enumerate(events):
+        write_event_dat(str(tmp_path / 'ev{}.dat'.format(k)), *ev, width=WIDTH, height=HEIGHT)
+    return str(tmp_path), events
+
+
+def test_windows_of_fixed_duration(files):
+    path, events = files
+    dataset = EventDataset(path, window_us=7000)
+    for i, (ts, x, y, p) in enumerate(events):
+        starts = dataset.windows[dataset.windows[:, 0] == i, 1]
+        # Consecutive windows from the first event, the last one contains the last event
+        np.testing.assert_array_equal(np.diff(starts), 7000)
+        assert starts[0] == ts[0] and starts[-1] <= ts[-1] < starts[-1] + 7000
+        for start in starts:
+            keep = (ts >= start) & (ts < start + 7000)
+            ev = dataset.load(i, start)
+            for a, b in zip(ev, (ts[keep], x[keep], y[keep], p[keep])):
+                np.testing.assert_array_equal(np.asarray(a, dtype=np.int64), np.asarray(b, dtype=np.int64))
+    # A window starting anywhere
+    ts = events[1][0]
+    start = int(ts[100]) + 1
+    assert len(dataset.load(1, start)[0]) == np.count_nonzero((ts >= start) & (ts < start + 7000))
+
+
+def test_windows_of_fixed_number_of_records(files):
+    path, events = files
+    dataset = EventDataset(path, window_n=1000)
+    # The epoch marker of the second file is a record
+    assert len(dataset) == 3 + 5
+    ts = np.concatenate([dataset[k][0] for k in range(len(dataset)) if dataset.windows[k, 0] == 1])
+    np.testing.assert_array_equal(ts, events[1][0][:4999])
+
+
+def test_representations_are_loaded_in_parallel(files):
+    path, events = files
+    dataset = EventDataset(path, window_us=20000, representation=REPR_COUNT, transform=lambda c: c.sum(axis=0))
+    counts = list(dataset.iterate())
+    assert counts[0].shape == (HEIGHT, WIDTH)
+    assert sum(c.sum() for c in counts) == 8000
+    for a, b in zip(dataset.iterate(n_workers=2, windows_per_task=2), counts):
+        np.testing.assert_array_equal(a, b)
+    shuffled = list(dataset.iterate(shuffle=True, seed=0, n_workers=2))
+    assert sum(c.sum() for c in shuffled) == 8000
+
+    windows = dataset.random_windows(100, seed=0)
+    assert set(windows[:, 0]) == {0, 1}
+    for i, start in windows:
+        assert dataset.indexes[i].t_first <= start <= dataset.indexes[i].t_last + 1 - 20000
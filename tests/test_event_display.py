@@ -0,0 +1,51 @@
+import time
+import numpy as np
+import pytest
+from event_buffer import EventBuffer
+from event_display import EventDisplay
+
+WIDTH, HEIGHT = 40, 30
+DT = 1000
+
+
+def packet(t, x, y, p):
+    pk = EventBuffer(1)
+    pk.add(t, y, x, p)
+    return pk
+
+
+@pytest.mark.parametrize('threaded', [False, True])
+def test_headless_display_gives_the_frames_to_on_frame(threaded):
+    frames = []
+    display = EventDisplay("Test", WIDTH, HEIGHT, 5 * DT, threaded=threaded, headless=True,
+                           on_frame=lambda im, t: frames.append((im.copy(), t)))
+    display.display_time = False
+    try:
+        for k in range(1, 13):
+            # ON events in the first frame, OFF events in the second one
+            display.update(packet(k * DT, k, 5, 1) if k < 7 else packet(k * DT, k, 20, 0), DT)
+            deadline = time.time() + 10
+            while threaded and display.mailbox is not None and time.time() < deadline:
+                time.sleep(0.001)
+    finally:
+        display.close()
+    assert display.dropped == 0
+    assert not display.shown
+    assert [t for _, t in frames] == [6 * DT, 12 * DT]
+    im, _ = frames[0]
+    assert im.shape == (HEIGHT, WIDTH, 3)
+    # Events of the last frametime only
+    assert np.all(im[5, 1] == 125) and np.all(im[5, 2] == 255) and np.all(im[5, 6] == 255)
+    assert np.count_nonzero(im[:, :, 0] != 125) == 5
+    im, _ = frames[1]
+    assert np.all(im[20, 12] == 0) and np.all(im[5, 6] == 125)
+
+
+def test_headless_display_without_on_frame_renders_nothing(monkeypatch):
+    display = EventDisplay("Test", WIDTH, HEIGHT, DT, headless=True)
+    monkeypatch.setattr(display, 'render_frame', lambda *args: pytest.fail("rendered"))
+    for k in range(1, 5):
+        display.update(packet(k * DT, k, 5, 1), DT)
+    display.close()
+    assert not display.shown
+    assert display.time_surface[5, 4] == 4 * DT and display.pol_surface[5, 4] == 1
@@ -0,0 +1,126 @@
+import time
+import cv2
+import numpy as np
+import pytest
+from frame_source import INTERP_FLOW, IRRADIANCE_SCALE, ArraySource, ImageDirSource, InterpolatedSource
+
+WIDTH, HEIGHT = 32, 24
+
+
+def make_frames(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.uniform(10, 1000, (HEIGHT, WIDTH)) for _ in range(n)]
+
+
+@pytest.mark.parametrize('n_workers, prefetch', [(1, True), (3, True), (1, False)])
+def test_interpolation_keeps_the_frames_of_the_source(n_workers, prefetch):
+    frames = make_frames(4)
+    with InterpolatedSource(ArraySource(frames), n_interp=3, n_workers=n_workers, prefetch=prefetch) as source:
+        out = [im.copy() for im in source]
+    assert len(out) == 3 * 4 + 1
+    for i, im in enumerate(frames):
+        np.testing.assert_array_equal(out[4 * i], im)
+    # Linear in the log domain between the frames
+    for k in range(1, 4):
+        t = k / 4
+        expected = np.expm1((1 - t) * np.log1p(frames[1]) + t * np.log1p(frames[2]))
+        np.testing.assert_allclose(out[4 + k], expected, rtol=1e-12)
+
+
+def test_interpolation_of_a_plain_iterator():
+    frames = make_frames(3)
+    with pytest.raises(ValueError):
+        InterpolatedSource(iter(frames), n_interp=1)
+    with InterpolatedSource(iter(frames), n_interp=1, scale=2.0, width=WIDTH, height=HEIGHT) as source:
+        out = [im.copy() for im in source]
+    assert len(out) == 5
+    np.testing.assert_array_equal(out[0], 2.0 * frames[0])
+    np.testing.assert_array_equal(out[4], 2.0 * frames[2])
+
+
+def test_flow_interpolation_of_a_static_scene():
+    frame = np.repeat(np.linspace(10, 1000, WIDTH)[None, :], HEIGHT, axis=0)
+    with InterpolatedSource(ArraySource([frame, frame]), n_interp=2, method=INTERP_FLOW) as source:
+        out = [im.copy() for im in source]
+    assert len(out) == 4
+    np.testing.assert_array_equal(out[0], frame)
+    np.testing.assert_array_equal(out[3], frame)
+    np.testing.assert_allclose(out[1], frame, rtol=1e-3)
+
+
+def write_images(path, n):
+    files = []
+    for k in range(n):
+        files.append(str(path / 'im{:03d}.png'.format(k)))
+        cv2.imwrite(files[-1], np.full((HEIGHT, WIDTH), 10 * k, dtype=np.uint8))
+    return files
+
+
+@pytest.mark.parametrize('n_workers, prefetch', [(1, True), (4, True), (4, False)])
+def test_frames_are_returned_in_order(tmp_path, n_workers, prefetch):
+    write_images(tmp_path, 20)
+    with ImageDirSource(str(tmp_path), n_workers=n_workers, prefetch=prefetch) as source:
+        assert len(source) == 20
+        out = [im.copy() for im in source]
+        assert source.n_frames == 20
+        with pytest.raises(StopIteration):
+            next(source)
+    assert len(out) == 20
+    for k, im in enumerate(out):
+        np.testing.assert_array_equal(im, np.full((HEIGHT, WIDTH), 10 * k * IRRADIANCE_SCALE))
+
+
+def test_greylevels_are_kept_without_scale(tmp_path):
+    write_images(tmp_path, 3)
+    with ImageDirSource(str(tmp_path), scale=None, dtype=np.uint8) as source:
+        out = [im.copy() for im in source]
+    assert out[2].dtype == np.uint8
+    np.testing.assert_array_equal(out[2], 20)
+
+
+def test_frames_are_decoded_ahead_into_a_pool_of_buffers():
+    frames = make_frames(10)
+    source = ArraySource(frames, n_buffers=3)
+    ids = set()
+    first = next(source)
+    # The next frames are decoded while the first one is used
+    deadline = time.time() + 10
+    while source.filled.qsize() < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert source.filled.qsize() == 2
+    np.testing.assert_array_equal(first, frames[0])
+    ids.add(id(first))
+    for k, im in enumerate(source):
+        np.testing.assert_array_equal(im, frames[k + 1])
+        ids.add(id(im))
+    assert ids <= {id(buf) for buf in source.buffers}
+    source.close()
+
+
+def test_close_stops_the_decoding():
+    released = []
+
+    class Source(ArraySource):
+        def _release(self):
+            released.append(True)
+
+    # The worker waits for a free buffer when close is called
+    source = Source(make_frames(20), n_buffers=2)
+    next(source)
+    source.close()
+    assert source.thread is None and released == [True]
+    with pytest.raises(StopIteration):
+        next(source)
+
+
+def test_decoding_errors_are_raised_in_order(tmp_path):
+    files = write_images(tmp_path, 4)
+    with open(files[2], 'wb') as f:
+        f.write(b'not an image')
+    with ImageDirSource(str(tmp_path), n_workers=2) as source:
+        next(source)
+        next(source)
+        with pytest.raises(IOError):
+            next(source)
+        with pytest.raises(StopIteration):
+            next(source)
@@ -0,0 +1,89 @@
+import json
+import os
+import cv2
+import numpy as np
+import pytest
+from dat_files import load_dat_event, read_dat_header
+from iebcs import main
+
+WIDTH, HEIGHT = 40, 30
+CONFIG = """
+[input]
+type = "images"
+path = "frames"
+
+[sensor]
+noise = "freq"
+seed = 0
+
+[simulation]
+dt = 1000
+
+[output]
+path = "out/events.dat"
+"""
+
+
+@pytest.fixture
+def config(tmp_path):
+    os.makedirs(str(tmp_path / 'frames'))
+    x = np.arange(WIDTH)
+    for k in range(12):
+        im = np.full((HEIGHT, WIDTH), 20, dtype=np.uint8)
+        im[:, (x >= 2 * k) & (x < 2 * k + 4)] = 200
+        cv2.imwrite(str(tmp_path / 'frames' / 'im{:02d}.png'.format(k)), im)
+    with open(str(tmp_path / 'config.toml'), 'w') as f:
+        f.write(CONFIG)
+    return str(tmp_path / 'config.toml')
+
+
+def test_simulate_a_directory_of_images(config, tmp_path):
+    stats_file = str(tmp_path / 'stats.json')
+    main(['simulate', config, '--no-progress', '--stats', stats_file, '--set', 'sensor.tile_size=8'])
+    output = str(tmp_path / 'out' / 'events.dat')
+    header = read_dat_header(output)
+    assert (header['width'], header['height']) == (WIDTH, HEIGHT)
+    ts, x, y, p = load_dat_event(output)
+    with open(stats_file) as f:
+        stats = json.load(f)
+    # The first image initialises the sensor
+    assert stats['frames'] == 11 and stats['events'] == len(ts) > 0
+    assert np.all(np.diff(ts.astype(np.int64)) >= 0) and ts[-1] < 11 * 1000
+    # The configuration used is saved next to the events
+    with open(output + '.config.json') as f:
+        used = json.load(f)
+    assert used['sensor']['tile_size'] == 8 and used['input']['path'] == str(tmp_path / 'frames')
+
+    # The same seed gives the same events
+    main(['simulate', config, '--no-progress', '--max-frames', '5', '--set', 'output.path="out/first.dat"',
+          '--set', 'sensor.tile_size=8'])
+    first = load_dat_event(str(tmp_path / 'out' / 'first.dat'))
+    assert 0 < len(first[0]) < len(ts)
+    np.testing.assert_array_equal(first[0], ts[:len(first[0])])
+
+
+def test_merge_render_and_info(config, tmp_path, capsys):
+    main(['simulate', config, '--no-progress'])
+    events = str(tmp_path / 'out' / 'events.dat')
+    merged = str(tmp_path / 'merged.dat')
+    main(['merge', merged, events, events, '--offsets', '0,0', '{},0'.format(WIDTH), '--index'])
+    assert read_dat_header(merged)['width'] == 2 * WIDTH
+    assert len(load_dat_event(merged)[0]) == 2 * len(load_dat_event(events)[0])
+    assert os.path.exists(merged + '.idx')
+
+    video = str(tmp_path / 'events.avi')
+    main(['render', events, video, '--mode', 'count', '--workers', '0'])
+    assert os.path.getsize(video) > 0
+    capsys.readouterr()
+    main(['info', merged])
+    out = capsys.readouterr().out
+    assert 'n_events' in out
+
+
+def test_configuration_errors(config, tmp_path):
+    with pytest.raises(SystemExit):
+        main(['simulate', config, '--set', 'sensor.unknown=1'])
+    with open(str(tmp_path / 'empty.toml'), 'w') as f:
+        f.write('[sensor]\nseed = 0\n')
+    with pytest.raises(SystemExit):
+        main(['simulate', str(tmp_path / 'empty.toml')])
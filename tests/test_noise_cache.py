@@ -0,0 +1,91 @@
+import os
+from collections import OrderedDict
+import numpy as np
+import pytest
+import noise_cache
+from noise_cache import FREQ, NOISE_TABLES, draw_noise_delays, load_noise_tables, noise_cache_key
+
+SHAPE = (30, 40)
+
+
+@pytest.fixture
+def distributions(tmp_path, monkeypatch):
+    monkeypatch.setattr(noise_cache, '_loaded', OrderedDict())
+    rng = np.random.default_rng(0)
+    filenames = []
+    for pol in ['pos', 'neg']:
+        filename = str(tmp_path / 'noise_{}.npy'.format(pol))
+        np.save(filename, np.cumsum(rng.random((5, len(FREQ))), axis=1))
+        filenames.append(filename)
+    return filenames
+
+
+def test_cache_key(distributions, tmp_path):
+    key = noise_cache_key(distributions, SHAPE, 1)
+    assert noise_cache_key(distributions, SHAPE, 1) == key
+    assert noise_cache_key(distributions, SHAPE, 2) != key
+    assert noise_cache_key(distributions, (40, 30), 1) != key
+    assert noise_cache_key(distributions, SHAPE, 1, [0.1, 161]) != key
+    assert noise_cache_key(distributions[::-1], SHAPE, 1) != key
+    # The key depends on the content of the distributions, not on their paths
+    copy = str(tmp_path / 'copy.npy')
+    with open(distributions[0], 'rb') as src, open(copy, 'wb') as dst:
+        dst.write(src.read())
+    assert noise_cache_key([copy, distributions[1]], SHAPE, 1) == key
+
+
+def test_tables_are_compiled_once(distributions, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    tables = load_noise_tables(*distributions, SHAPE, 1, cache_dir)
+    assert os.listdir(cache_dir) == [noise_cache_key(distributions, SHAPE, 1)]
+    assert all(isinstance(tables[name], np.memmap) for name in NOISE_TABLES)
+    assert tables['id_pos'].shape == SHAPE
+
+    # Kept in memory by the process
+    assert load_noise_tables(*distributions, SHAPE, 1, cache_dir) is tables
+
+    # Read from the cache by a new process
+    monkeypatch.setattr(noise_cache, '_loaded', OrderedDict())
+    monkeypatch.setattr(noise_cache, 'compile_noise_tables', lambda *args: pytest.fail("compiled again"))
+    cached = load_noise_tables(*distributions, SHAPE, 1, cache_dir)
+    for name in NOISE_TABLES:
+        np.testing.assert_array_equal(cached[name], tables[name])
+
+
+def test_concurrent_compilation_reuses_the_first_tables(distributions, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    compile_noise_tables = noise_cache.compile_noise_tables
+
+    def compile_while_another_process_saves(*args):
+        # Another process finishes saving the same tables first
+        tables = compile_noise_tables(*args)
+        monkeypatch.setattr(noise_cache, '_loaded', OrderedDict())
+        monkeypatch.setattr(noise_cache, 'compile_noise_tables', compile_noise_tables)
+        first.update(load_noise_tables(*distributions, SHAPE, 1, cache_dir))
+        return tables
+
+    first = {}
+    monkeypatch.setattr(noise_cache, 'compile_noise_tables', compile_while_another_process_saves)
+    tables = load_noise_tables(*distributions, SHAPE, 1, cache_dir)
+    assert os.listdir(cache_dir) == [noise_cache_key(distributions, SHAPE, 1)]
+    for name in NOISE_TABLES:
+        np.testing.assert_array_equal(tables[name], first[name])
+
+
+def test_modified_distributions_are_reloaded(distributions, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    tables = load_noise_tables(*distributions, SHAPE, 1, cache_dir)
+    np.save(distributions[0], np.cumsum(np.ones((3, len(FREQ))), axis=1))
+    reloaded = load_noise_tables(*distributions, SHAPE, 1, cache_dir)
+    assert reloaded is not tables
+    assert reloaded['cdf_pos'].shape[0] == 3
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_delays_follow_the_first_bin_reaching_u():
+    cdf = np.tile(np.linspace(1.0 / len(FREQ), 1, len(FREQ)), (2, 1))
+    # The second distribution ends slightly below 1 after rounding
+    cdf[1] *= 1 - 1e-12
+    u = np.array([0.0, 0.5, 1 - 1e-15, 1 - 1e-15])
+    ind = np.array([np.searchsorted(cdf[0], v) for v in u[:3]] + [len(FREQ) - 1])
+    np.testing.assert_array_equal(draw_noise_delays(cdf, np.array([0, 0, 0, 1]), u), np.uint64(1e6 / FREQ[ind]))
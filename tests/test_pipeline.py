@@ -0,0 +1,91 @@
+import threading
+import numpy as np
+import pytest
+from dvs_sensor import DvsSensor
+from event_buffer import EventBuffer
+from pipeline import STAGE_ARBITER, STAGE_SENSOR, STAGE_SINK, SimulationPipeline
+
+WIDTH, HEIGHT = 40, 30
+DT = 1000
+
+
+def frames(n):
+    x = np.arange(WIDTH, dtype=float)[None, :]
+    for k in range(n + 1):
+        yield np.repeat(100 + 900 / (1 + np.exp(-(x - 2 * k) / 2.0)), HEIGHT, axis=0)
+
+
+def make_sensor():
+    np.random.seed(0)
+    dvs = DvsSensor("Test")
+    dvs.initCamera(WIDTH, HEIGHT, lat=100, jit=10, ref=100, tau=40, th_pos=0.4, th_neg=0.4, th_noise=0.01,
+                   bgnp=0.1, bgnn=0.01)
+    return dvs
+
+
+class Failing():
+    """ Arbiter or sink raising an error at its n-th packet """
+
+    def __init__(self, n):
+        self.n = n
+        self.packets = []
+
+    def process(self, ev, dt):
+        self.write(ev)
+        return ev
+
+    def write(self, ev):
+        if len(self.packets) == self.n:
+            raise RuntimeError("packet {}".format(self.n))
+        self.packets.append(ev)
+
+
+def stage_threads():
+    return [t for t in threading.enumerate() if t.name in ['Sensor', 'Arbiter']]
+
+
+def test_events_of_the_pipeline_follow_the_sensor():
+    dvs = make_sensor()
+    it = frames(20)
+    dvs.init_image(next(it))
+    ref = [dvs.update(im, DT) for im in it]
+
+    packets = []
+    out = EventBuffer(0)
+    arbiter = Failing(-1)
+    pipeline = SimulationPipeline(frames(20), make_sensor(), DT, arbiter=arbiter, sinks=[out, packets.append],
+                                  queue_size=2)
+    stats = pipeline.run()
+    assert [stats[name]['frames'] for name in [STAGE_SENSOR, STAGE_ARBITER, STAGE_SINK]] == [20, 20, 20]
+    assert stats[STAGE_SINK]['events'] == out.i == sum(ev.i for ev in ref)
+    for ev, ev_ref in zip(packets, ref):
+        np.testing.assert_array_equal(ev.ts[:ev.i], ev_ref.ts[:ev_ref.i])
+    assert stage_threads() == []
+
+    # The first frames only
+    stats = SimulationPipeline(frames(20), make_sensor(), DT).run(max_frames=5)
+    assert stats[STAGE_SINK]['frames'] == 5
+
+
+@pytest.mark.parametrize('failing', ['sensor', 'arbiter', 'sink'])
+def test_errors_of_a_stage_stop_the_pipeline(failing, monkeypatch):
+    dvs = make_sensor()
+    if failing == 'sensor':
+        update = dvs.update
+        n_updates = []
+
+        def update_and_fail(im, dt, scale=None):
+            n_updates.append(1)
+            if len(n_updates) == 3:
+                raise RuntimeError("packet 2")
+            return update(im, dt, scale)
+        monkeypatch.setattr(dvs, 'update', update_and_fail)
+    arbiter = Failing(2 if failing == 'arbiter' else -1)
+    sink = Failing(2 if failing == 'sink' else -1)
+    # Small queues: the stages before the failing one are blocked on their output
+    pipeline = SimulationPipeline(frames(50), dvs, DT, arbiter=arbiter, sinks=[sink], queue_size=1)
+    with pytest.raises(RuntimeError, match="packet 2"):
+        pipeline.run()
+    assert stage_threads() == []
+    assert pipeline.stats[STAGE_SENSOR].frames < 50
+    assert len(sink.packets) == 2
@@ -0,0 +1,76 @@
+import csv
+import json
+import numpy as np
+from dvs_sensor import DvsSensor
+from profiling import COUNTERS, STAGES, FrameProfiler
+
+WIDTH, HEIGHT = 40, 30
+DT = 1000
+
+
+def frames(n):
+    x = np.arange(WIDTH)
+    for k in range(n + 1):
+        im = np.full((HEIGHT, WIDTH), 100.0)
+        im[:, (x >= 2 * k) & (x < 2 * k + 4)] = 1000
+        yield im
+
+
+def test_stages_and_counters_of_the_updates(tmp_path):
+    np.random.seed(0)
+    dvs = DvsSensor("Test")
+    dvs.initCamera(WIDTH, HEIGHT, lat=100, jit=10, ref=100, tau=40, th_pos=0.4, th_neg=0.4, th_noise=0.01,
+                   bgnp=100, bgnn=100)
+    dvs.set_tile_skipping(8, 1e-4)
+    dvs.set_substeps(0.1, 4)
+    profiler = dvs.set_profiling(max_frames=10)
+    it = frames(15)
+    dvs.init_image(next(it))
+    n_events = [dvs.update(im, DT).i for im in it]
+
+    assert profiler.n_frames == 15 and len(profiler.records) == 10
+    records = list(profiler.records)
+    assert [r['frame'] for r in records] == list(range(5, 15))
+    assert [r['time'] for r in records] == [k * DT for k in range(5, 15)]
+    for r, n in zip(records, n_events[5:]):
+        assert r['signal_on'] + r['signal_off'] + r['noise_on'] + r['noise_off'] == n
+        assert r['total'] == sum(r[s] for s in STAGES)
+        assert r['n_substeps'] == 4 and r['n_fast'] > 0 and r['rounds'] > 0
+        assert 0 < r['active_ratio'] < 1
+    assert all(records[-1][s] > 0 for s in ['convert', 'tiles', 'noise', 'substeps', 'integrate', 'merge'])
+
+    summary = profiler.summary()
+    assert summary['frames'] == 10
+    assert summary['signal_on'] == sum(r['signal_on'] for r in records)
+    assert summary['noise_on'] + summary['noise_off'] > 0
+    assert abs(sum(summary[s + '_share'] for s in STAGES) - 1) < 1e-9
+
+    profiler.export(str(tmp_path / 'profile.csv'))
+    with open(str(tmp_path / 'profile.csv')) as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 10 and int(rows[0]['frame']) == 5
+    profiler.export(str(tmp_path / 'profile.json'))
+    with open(str(tmp_path / 'profile.json')) as f:
+        saved = json.load(f)
+    assert saved['stages'] == STAGES and saved['counters'] == COUNTERS and saved['records'] == records
+
+    # Profiling disabled
+    assert dvs.set_profiling(False) is None
+    dvs.update(next(frames(16)), DT)
+    assert profiler.n_frames == 15
+
+
+def test_a_stage_run_twice_adds_up():
+    profiler = FrameProfiler()
+    profiler.start(0, DT)
+    profiler.stage('tiles')
+    profiler.count('rounds', 2)
+    profiler.stage('integrate')
+    profiler.stage('tiles')
+    profiler.count('rounds', 3)
+    profiler.end()
+    record = profiler.records[0]
+    assert record['rounds'] == 5
+    assert record['total'] == sum(record[s] for s in STAGES)
+    profiler.clear()
+    assert profiler.summary() == {'frames': 0}
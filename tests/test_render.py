@@ -0,0 +1,76 @@
+import cv2
+import numpy as np
+import pytest
+from dat_files import write_event_dat
+from render import RENDER_BINARY, RENDER_COUNT, RENDER_TIMESURFACE, render_dat_video, render_frames
+
+WIDTH, HEIGHT = 32, 24
+FRAME_US = 1000
+
+# ts, x, y, p: two ON events at (3, 2) and one OFF event at (5, 4) in the first frame, one ON event at (5, 4) in
+# the second one
+EVENTS = (np.array([100, 200, 900, 1500]), np.array([3, 3, 5, 5]), np.array([2, 2, 4, 4]), np.array([1, 1, 0, 1]))
+
+
+def render(mode, **kwargs):
+    return render_frames(*EVENTS, [FRAME_US, 2 * FRAME_US], WIDTH, HEIGHT, FRAME_US, mode=mode, colormap=None,
+                         display_time=False, **kwargs)
+
+
+def test_binary_frames():
+    frames = render(RENDER_BINARY)
+    assert len(frames) == 2 and frames[0].shape == (HEIGHT, WIDTH, 3)
+    first, second = frames[0][:, :, 0], frames[1][:, :, 0]
+    assert (first[2, 3], first[4, 5], second[2, 3], second[4, 5]) == (255, 0, 125, 255)
+    assert np.count_nonzero(first != 125) == 2
+
+
+def test_count_frames():
+    first, second = [im[:, :, 0] for im in render(RENDER_COUNT, count_max=2)]
+    assert (first[2, 3], first[4, 5], second[4, 5]) == (250, 62, 187)
+    assert np.count_nonzero(second != 125) == 1
+
+
+def test_time_surface_frames():
+    first, second = [im[:, :, 0] for im in render(RENDER_TIMESURFACE, tau=500)]
+    # Last event of each pixel, decayed and truncated to a greylevel
+    assert abs(first[2, 3] - (125 + 125 * np.exp(-800 / 500))) < 1
+    assert abs(first[4, 5] - (125 - 125 * np.exp(-100 / 500))) < 1
+    # The events of the previous frames keep decaying
+    assert abs(second[2, 3] - (125 + 125 * np.exp(-1800 / 500))) < 1
+    assert abs(second[4, 5] - (125 + 125 * np.exp(-500 / 500))) < 1
+    assert np.count_nonzero(second != 125) == 2
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        render('unknown')
+
+
+def read_video(filename):
+    cap = cv2.VideoCapture(filename)
+    frames = []
+    while True:
+        ret, im = cap.read()
+        if not ret:
+            break
+        frames.append(im)
+    cap.release()
+    return frames
+
+
+@pytest.mark.parametrize('mode', [RENDER_TIMESURFACE, RENDER_BINARY])
+def test_video_rendered_in_parallel(tmp_path, mode):
+    rng = np.random.default_rng(0)
+    ts = np.sort(rng.integers(0, 20 * FRAME_US, 5000))
+    filename = str(tmp_path / 'ev.dat')
+    write_event_dat(filename, ts, rng.integers(0, WIDTH, 5000), rng.integers(0, HEIGHT, 5000),
+                    rng.integers(0, 2, 5000), width=WIDTH, height=HEIGHT)
+    videos = []
+    for n_workers in [0, 2]:
+        output = str(tmp_path / 'video{}.avi'.format(n_workers))
+        assert render_dat_video(filename, output, FRAME_US, mode=mode, n_workers=n_workers, frames_per_task=3) == 20
+        videos.append(read_video(output))
+    assert len(videos[0]) == 20
+    for a, b in zip(*videos):
+        np.testing.assert_array_equal(a, b)
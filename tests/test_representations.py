@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from event_buffer import EventBuffer
+from representations import TimeSurface, count_image, event_windows, voxel_grid
+
+WIDTH, HEIGHT = 8, 6
+
+# ts, x, y, p
+EVENTS = (np.array([0, 250, 500, 500, 1000], dtype=np.uint64), np.array([1, 1, 2, 1, 7]), np.array([0, 0, 3, 0, 5]),
+          np.array([1, 1, 0, 0, 1]))
+
+
+def test_count_image_of_a_buffer_and_of_arrays():
+    ev = EventBuffer(0)
+    ev.add_array(EVENTS[0], EVENTS[2], EVENTS[1], EVENTS[3])
+    for events in [EVENTS, ev]:
+        counts = count_image(events, WIDTH, HEIGHT)
+        assert counts.shape == (2, HEIGHT, WIDTH)
+        assert (counts[1, 0, 1], counts[0, 0, 1], counts[0, 3, 2], counts[1, 5, 7]) == (2, 1, 1, 1)
+        assert counts.sum() == 5
+    count_image(EVENTS, WIDTH, HEIGHT, out=counts, accumulate=True)
+    assert counts[1, 0, 1] == 4 and counts.sum() == 10
+
+
+def test_voxel_grid_splits_the_events_between_two_bins():
+    grid = voxel_grid(EVENTS, WIDTH, HEIGHT, 3)
+    assert grid.shape == (3, HEIGHT, WIDTH) and grid.dtype == np.float32
+    # t = 0 and 250 are in the first half: 1 + 0.5 in the bin 0 and 0.5 in the bin 1, then -1 in the bin 1 at t = 500
+    np.testing.assert_allclose(grid[:, 0, 1], [1.5, -0.5, 0])
+    np.testing.assert_allclose(grid[:, 3, 2], [0, -1, 0])
+    np.testing.assert_allclose(grid[:, 5, 7], [0, 0, 1])
+    # Each event counts 1 in total
+    assert grid.sum() == pytest.approx(1)
+    assert voxel_grid(EVENTS, WIDTH, HEIGHT, 3, signed=False).sum() == pytest.approx(5)
+
+    # Events outside the window go to the first and last bins
+    grid = voxel_grid(EVENTS, WIDTH, HEIGHT, 2, t_start=500, t_stop=1000)
+    np.testing.assert_allclose(grid[:, 0, 1], [1, 0])
+    np.testing.assert_allclose(grid[:, 5, 7], [0, 1])
+    assert np.all(voxel_grid((EVENTS[0][:0],) + EVENTS[1:], WIDTH, HEIGHT, 2) == 0)
+
+
+def test_event_windows_of_fixed_duration_and_size():
+    windows = list(event_windows(EVENTS, window_us=500))
+    assert [(t0, t1, len(ev[0])) for t0, t1, ev in windows] == [(0, 500, 2), (500, 1000, 2), (1000, 1500, 1)]
+    windows = list(event_windows(EVENTS, window_us=400, t_start=100, t_stop=900))
+    assert [(t0, t1, len(ev[0])) for t0, t1, ev in windows] == [(100, 500, 1), (500, 900, 2)]
+    windows = list(event_windows(EVENTS, window_n=2))
+    assert [(t0, t1, len(ev[0])) for t0, t1, ev in windows] == [(0, 251, 2), (500, 501, 2), (1000, 1001, 1)]
+    with pytest.raises(ValueError):
+        list(event_windows(EVENTS))
+
+
+def test_time_surface_keeps_the_last_event_of_each_polarity():
+    surface = TimeSurface(WIDTH, HEIGHT, tau=500)
+    surface.update(EVENTS)
+    assert surface.last_ts[1, 0, 1] == 250 and surface.last_ts[0, 0, 1] == 500
+    out = surface.render(1000)
+    assert out.shape == (2, HEIGHT, WIDTH)
+    assert out[1, 0, 1] == pytest.approx(np.exp(-1.5)) and out[1, 5, 7] == pytest.approx(1)
+    assert out[1, 3, 2] == 0
+    signed = surface.render(1000, signed=True)
+    assert signed[0, 1] == pytest.approx(-np.exp(-1)) and signed[5, 7] == pytest.approx(1)
+    assert signed[0, 0] == 0
+    surface.reset()
+    assert np.all(surface.render(1000) == 0)
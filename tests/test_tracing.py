@@ -0,0 +1,73 @@
+import json
+import threading
+import tracing
+from tracing import Tracer, span, start_tracing, stop_tracing, traced
+
+
+@traced('test')
+def work(n):
+    with span('inner', 'test', n=n):
+        return sum(range(n))
+
+
+def test_spans_of_all_threads_are_counted():
+    tracer = start_tracing()
+    # The threads run at the same time, so that their ids are different
+    barrier = threading.Barrier(4)
+
+    def run():
+        barrier.wait()
+        for _ in range(1000):
+            work(10)
+        barrier.wait()
+    try:
+        threads = [threading.Thread(target=run, name='worker{}'.format(k)) for k in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        assert stop_tracing() is tracer
+    assert tracer.n_spans == 8000
+    assert tracer.dropped() == 0
+    names = {ev['args']['name'] for ev in tracer.events() if ev['ph'] == 'M'}
+    assert {'worker0', 'worker1', 'worker2', 'worker3'} <= names
+    # Nothing is recorded once tracing is stopped
+    work(10)
+    assert tracer.n_spans == 8000
+
+
+def test_ring_buffer_drops_the_oldest_spans():
+    tracer = Tracer(capacity=10)
+    for k in range(25):
+        tracer.add('span{}'.format(k), 'test', k, k + 1)
+    assert tracer.dropped() == 15
+    assert [ev['name'] for ev in tracer.events() if ev['ph'] == 'X'] == ['span{}'.format(k) for k in range(15, 25)]
+
+
+def test_save_chrome_trace_and_folded_stacks(tmp_path):
+    tracer = start_tracing()
+    try:
+        work(100)
+        tracer.instant('dropped', 'test')
+    finally:
+        stop_tracing()
+    tracer.save(str(tmp_path / 'trace.json'))
+    with open(str(tmp_path / 'trace.json')) as f:
+        trace = json.load(f)
+    spans = {ev['name']: ev for ev in trace['traceEvents'] if ev['ph'] in ['X', 'i']}
+    assert spans['inner']['args'] == {'n': 100}
+    assert spans['dropped']['ph'] == 'i'
+    outer = spans['work']
+    assert outer['ts'] <= spans['inner']['ts'] and spans['inner']['dur'] <= outer['dur']
+
+    # Long enough spans to appear in the folded stacks (us)
+    thread = threading.current_thread().name
+    folded = Tracer()
+    folded.threads[threading.get_ident()] = thread
+    folded.spans.extend([('outer', 'test', 0, 10000000, threading.get_ident(), None),
+                         ('inner', 'test', 2000000, 5000000, threading.get_ident(), None)])
+    folded.save_folded(str(tmp_path / 'stacks.txt'))
+    with open(str(tmp_path / 'stacks.txt')) as f:
+        assert f.read().splitlines() == ['{};outer 7000'.format(thread), '{};outer;inner 3000'.format(thread)]
+    assert tracing.get_tracer() is None